@@ -1,21 +1,39 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from typing import List
-import os
 from app.services.document_processor import DocumentProcessor
-from app.models.schemas import DocumentRequest, ExtractionResponse
-from app.utils.logger import logger
+from app.services.job_queue import JobQueue
+from app.services.downloader import DocumentDownloader, MAX_DOCUMENT_BYTES
+from app.models.schemas import (
+    DocumentRequest, ExtractionResponse, BatchDocumentRequest, BatchExtractionItem,
+    JobSubmitResponse, JobStatusResponse, FraudCheckMode, FraudReport
+)
+from app.utils.logger import logger, get_request_id, set_request_id, DroppingQueueHandler
+from app.utils.metrics import metrics, record_stage, start_stage_timings, server_timing_header
 import httpx
+import asyncio
+import os
 import base64
-import hashlib
 import time
+import uuid
+from contextlib import asynccontextmanager
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await downloader.start()
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await downloader.close()
+    document_processor.shutdown()
 
 app = FastAPI(
     title="FinServ Invoice Extraction API",
     description="AI-powered invoice data extraction with fraud detection",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -27,10 +45,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Tag every log line of a request with its id (the caller's X-Request-ID, or a new one)"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    set_request_id(request_id[:64])
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id[:64]
+    return response
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 document_processor = DocumentProcessor()
+downloader = DocumentDownloader()
+
+# Documents processed at once across all batch requests (covers OCR and LLM stages)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", max(2, (os.cpu_count() or 1) * 2)))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 500))
+batch_limiter = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+# Return per-stage durations of single-document requests in a Server-Timing header
+STAGE_TIMINGS_HEADER = os.getenv("STAGE_TIMINGS_HEADER", "false").lower() in ("1", "true", "yes")
+
+# Background workers for /jobs; extract_document is defined below
+job_queue = JobQueue(
+    lambda document, fraud_check: extract_document(document, endpoint="job", fraud_check=fraud_check)
+)
 
 @app.get("/")
 async def root():
@@ -38,23 +79,101 @@ async def root():
     return FileResponse('static/index.html')
 
 @app.post("/extract-bill-data", response_model=ExtractionResponse)
-async def extract_bill_data(request: DocumentRequest):
+async def extract_bill_data(request: DocumentRequest, response: Response):
     """
     Extract line items and amounts from invoice documents
     Accepts document URL or base64 encoded image
     """
+    timings = start_stage_timings()
+    result = await extract_document(request.document, fraud_check=request.fraud_check)
+    if STAGE_TIMINGS_HEADER:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return result
+
+@app.post("/extract-bill-data-batch")
+async def extract_bill_data_batch(request: BatchDocumentRequest):
+    """
+    Extract many documents in one call
+    Streams one BatchExtractionItem per line (NDJSON) as each document finishes;
+    a failed document yields is_success=false without failing the batch
+    """
+    if len(request.documents) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large: max {MAX_BATCH_SIZE} documents")
+    
+    logger.info(f"Received batch of {len(request.documents)} documents")
+    return StreamingResponse(stream_batch(request.documents), media_type="application/x-ndjson")
+
+async def stream_batch(documents: List[DocumentRequest]):
+    """Run documents concurrently under the shared batch limit, yielding results in completion order"""
+    async def run(index: int, document: DocumentRequest) -> BatchExtractionItem:
+        async with batch_limiter:
+            set_request_id(f"{batch_id}-{index}")
+            result = await extract_document(document.document, endpoint="batch", fraud_check=document.fraud_check)
+        return BatchExtractionItem(index=index, **result.model_dump())
+    
+    batch_id = get_request_id() or uuid.uuid4().hex[:16]
     start_time = time.time()
-    temp_path = None
+    tasks = [asyncio.create_task(run(index, document)) for index, document in enumerate(documents)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            item = await finished
+            yield item.model_dump_json() + "\n"
+        logger.info(f"Batch of {len(documents)} documents finished in {(time.time() - start_time) * 1000:.2f}ms")
+    finally:
+        # Client went away (or we're done): don't keep working on abandoned documents
+        for task in tasks:
+            task.cancel()
+
+@app.post("/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_job(request: DocumentRequest):
+    """
+    Queue a document for background extraction
+    Poll GET /jobs/{job_id}, then fetch GET /jobs/{job_id}/result
+    """
+    job_id = await job_queue.submit(request.document, request.fraud_check)
+    return JobSubmitResponse(job_id=job_id, status="queued")
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Job state: queued | running | done | failed"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatusResponse(**job)
+
+@app.get("/jobs/{job_id}/result", response_model=ExtractionResponse)
+async def get_job_result(job_id: str):
+    """Extraction result of a finished job (409 while it is still queued/running)"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["result"] is None:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return ExtractionResponse(**job["result"])
+
+@app.get("/fraud-checks/{check_id}", response_model=FraudReport)
+async def get_fraud_check(check_id: str):
+    """Report of a deferred fraud check (status pending until it finishes)"""
+    report = await document_processor.get_fraud_check(check_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Fraud check not found")
+    return report
+
+async def extract_document(document: str, endpoint: str = "extract",
+                           fraud_check: FraudCheckMode = "inline") -> ExtractionResponse:
+    """Download/decode and process one document; errors are returned, never raised"""
+    start_time = time.time()
+    result = None
     
     try:
-        logger.info(f"Received extraction request for document: {request.document[:50]}...")
+        logger.info(f"Received extraction request for document: {document[:50]}...")
         
-        # Download document from URL or decode base64
-        temp_path = await download_document(request.document)
-        logger.info(f"Document downloaded to: {temp_path}")
+        # Download document from URL or decode base64 (kept in memory)
+        with metrics.stage("download"):
+            content = await download_document(document)
         
         # Process document
-        result = await document_processor.process_document(temp_path)
+        result = await document_processor.process_document(content, fraud_check)
         
         processing_time = (time.time() - start_time) * 1000
         if result.is_success and result.data:
@@ -64,56 +183,53 @@ async def extract_bill_data(request: DocumentRequest):
     
     except httpx.HTTPError as e:
         logger.error(f"HTTP error downloading document: {str(e)}")
-        return ExtractionResponse(
+        result = ExtractionResponse(
             is_success=False,
             error=f"Failed to download document: {str(e)}"
         )
+        return result
     
     except Exception as e:
         logger.error(f"Extraction failed: {str(e)}", exc_info=True)
-        return ExtractionResponse(
+        result = ExtractionResponse(
             is_success=False,
             error=f"Extraction failed: {str(e)}"
         )
+        return result
     
     finally:
-        # Cleanup temporary files
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-                # Also remove preprocessed version if exists
-                preprocessed_path = temp_path.replace('.', '_preprocessed.')
-                if os.path.exists(preprocessed_path):
-                    os.remove(preprocessed_path)
-            except Exception as e:
-                logger.warning(f"Failed to cleanup temp file: {str(e)}")
+        _record_request(endpoint, start_time, result)
+
+def _record_request(endpoint: str, start_time: float, result: ExtractionResponse = None):
+    """End-to-end latency per endpoint and outcome (cancelled requests have no result)"""
+    elapsed = time.time() - start_time
+    outcome = "cancelled" if result is None else ("success" if result.is_success else "error")
+    metrics.observe("request_seconds", elapsed, {"endpoint": endpoint, "outcome": outcome})
+    record_stage("total", elapsed)
+    metrics.inc(f"requests_{outcome}_total")
 
 @app.post("/extract-bill-data-upload", response_model=ExtractionResponse)
-async def extract_bill_data_upload(file: UploadFile = File(...)):
+async def extract_bill_data_upload(response: Response, file: UploadFile = File(...),
+                                   fraud_check: FraudCheckMode = Query("inline")):
     """
     Extract line items from uploaded invoice image/PDF
     Accepts direct file upload instead of URL
     """
     start_time = time.time()
-    temp_path = None
+    timings = start_stage_timings()
+    result = None
 
     try:
         logger.info(f"Received file upload: {file.filename}")
 
-        # Save uploaded file
-        os.makedirs("temp", exist_ok=True)
-        # ensure unique name to avoid collisions
-        safe_name = f"{int(time.time()*1000)}_{file.filename}"
-        temp_path = os.path.join("temp", safe_name)
-
-        with open(temp_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        logger.info(f"File saved to: {temp_path}")
+        with metrics.stage("upload"):
+            content = await file.read(MAX_DOCUMENT_BYTES + 1)
+        if len(content) > MAX_DOCUMENT_BYTES:
+            raise ValueError(f"Document too large: over {MAX_DOCUMENT_BYTES} bytes")
+        logger.info(f"Received {len(content)} bytes")
 
         # Process document
-        result = await document_processor.process_document(temp_path)
+        result = await document_processor.process_document(content, fraud_check)
 
         processing_time = (time.time() - start_time) * 1000
         logger.info(f"Extraction successful in {processing_time:.2f}ms")
@@ -122,54 +238,26 @@ async def extract_bill_data_upload(file: UploadFile = File(...)):
 
     except Exception as e:
         logger.error(f"Extraction failed: {str(e)}", exc_info=True)
-        return ExtractionResponse(
+        result = ExtractionResponse(
             is_success=False,
             error=f"Extraction failed: {str(e)}"
         )
+        return result
 
     finally:
-        # Cleanup temporary files
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-                preprocessed_path = temp_path.replace('.', '_preprocessed.')
-                if os.path.exists(preprocessed_path):
-                    os.remove(preprocessed_path)
-            except Exception as e:
-                logger.warning(f"Failed to cleanup temp file: {str(e)}")
-
-async def download_document(url_or_base64: str) -> str:
-    """Download document from URL or decode base64 to temp file"""
-    os.makedirs("temp", exist_ok=True)
-    
+        _record_request("upload", start_time, result)
+        if STAGE_TIMINGS_HEADER:
+            response.headers["Server-Timing"] = server_timing_header(timings)
+
+async def download_document(url_or_base64: str) -> bytes:
+    """Download document from URL or decode base64, returning the raw bytes"""
     # Check if it's a URL
     if url_or_base64.startswith("http://") or url_or_base64.startswith("https://"):
         logger.info(f"Downloading from URL: {url_or_base64[:100]}...")
         
-        async with httpx.AsyncClient(timeout=60.0, follow_redirects=True) as client:
-            response = await client.get(url_or_base64)
-            response.raise_for_status()
-            
-            # Determine file extension from content type or URL
-            content_type = response.headers.get("content-type", "").lower()
-            if "png" in content_type or url_or_base64.lower().endswith(".png"):
-                ext = ".png"
-            elif "jpeg" in content_type or "jpg" in content_type or url_or_base64.lower().endswith((".jpg", ".jpeg")):
-                ext = ".jpg"
-            elif "pdf" in content_type or url_or_base64.lower().endswith(".pdf"):
-                ext = ".pdf"
-            else:
-                ext = ".png"  # default
-            
-            # Create unique filename using hash
-            file_hash = hashlib.md5(url_or_base64.encode()).hexdigest()[:8]
-            temp_path = f"temp/document_{file_hash}{ext}"
-            
-            with open(temp_path, "wb") as f:
-                f.write(response.content)
-            
-            logger.info(f"Downloaded {len(response.content)} bytes")
-            return temp_path
+        content = await downloader.fetch(url_or_base64)
+        logger.info(f"Downloaded {len(content)} bytes")
+        return content
     
     else:
         # Handle base64 encoded data
@@ -180,13 +268,11 @@ async def download_document(url_or_base64: str) -> str:
                 url_or_base64 = url_or_base64.split(",", 1)[1]
             
             decoded_data = base64.b64decode(url_or_base64)
-            temp_path = "temp/document_base64.png"
-            
-            with open(temp_path, "wb") as f:
-                f.write(decoded_data)
+            if len(decoded_data) > MAX_DOCUMENT_BYTES:
+                raise ValueError(f"Document too large: {len(decoded_data)} bytes (max {MAX_DOCUMENT_BYTES})")
             
             logger.info(f"Decoded {len(decoded_data)} bytes")
-            return temp_path
+            return decoded_data
         
         except Exception as e:
             logger.error(f"Failed to decode base64: {str(e)}")
@@ -203,3 +289,14 @@ async def health_check():
             "llm": "ready"
         }
     }
+
+@app.get("/metrics")
+async def get_metrics(format: str = "prometheus"):
+    """
+    Pipeline counters (OCR passes/fallbacks, ...) and latency histograms
+    Prometheus text format by default, ?format=json for a JSON snapshot
+    """
+    metrics.set("log_records_dropped_total", DroppingQueueHandler.dropped)
+    if format == "json":
+        return {"counters": metrics.snapshot(), "histograms": metrics.histogram_snapshot()}
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1,14 +1,22 @@
 from pydantic import BaseModel, Field, HttpUrl
-from typing import List, Optional
+from typing import List, Literal, Optional
 from decimal import Decimal
 
+# inline: fraud analysis runs alongside extraction and is returned with it
+# deferred: returned as pending with a check_id to poll at GET /fraud-checks/{check_id}
+# skip: no fraud analysis
+FraudCheckMode = Literal["inline", "deferred", "skip"]
+
 class DocumentRequest(BaseModel):
     document: str  # URL or base64 string
+    fraud_check: FraudCheckMode = "inline"
 
 class TokenUsage(BaseModel):
     total_tokens: int
     input_tokens: int
     output_tokens: int
+    tokens_saved: Optional[int] = None  # Estimated input tokens removed by prompt compaction
+    reused: bool = False  # Served by the LLM cache or another request's in-flight call, so not billed again
 
 class BillItem(BaseModel):
     item_name: str
@@ -26,8 +34,49 @@ class ExtractionData(BaseModel):
     total_item_count: int
     reconciled_amount: float # Kept as per "provide Final Total" requirement
 
+class FraudRegion(BaseModel):
+    page_no: int
+    type: str = Field(..., description="whiteout | font_height | jpeg_ela")
+    box: List[int]  # x0, y0, x1, y1 in pixels of the page as OCR'd
+    score: float  # 0-1
+    text: Optional[str] = None  # OCR word in the region, if any
+
+class DuplicateMatch(BaseModel):
+    kind: str = Field(..., description="near_duplicate | line_items")
+    doc_hash: str  # sha256 of the earlier document's bytes
+    seen_at: float  # Unix time the earlier document was processed
+    distance: Optional[int] = None  # Perceptual hash distance in bits (near_duplicate)
+    amount_overlap: Optional[float] = None  # Share of OCR amounts in common (near_duplicate)
+
+class FraudReport(BaseModel):
+    status: str = Field(..., description="done | pending | failed")
+    check_id: Optional[str] = None  # Set for deferred checks
+    detected: bool = False
+    confidence: float = 0.0
+    details: List[str] = []
+    regions: List[FraudRegion] = []
+    duplicate: Optional[DuplicateMatch] = None  # Earlier submission of the same bill
+
 class ExtractionResponse(BaseModel):
     is_success: bool
     token_usage: Optional[TokenUsage] = None
     data: Optional[ExtractionData] = None
     error: Optional[str] = None
+    fraud: Optional[FraudReport] = None  # None when skipped or the document had no text
+
+class BatchDocumentRequest(BaseModel):
+    documents: List[DocumentRequest]
+
+class BatchExtractionItem(ExtractionResponse):
+    index: int  # Position of the document in the request
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="queued | running | done | failed")
+    created_at: float
+    updated_at: float
+    error: Optional[str] = None
@@ -0,0 +1,136 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from app.utils.logger import logger
+from app.utils.metrics import metrics
+
+class TieredCache:
+    """
+    Key/value cache for JSON-serializable values
+    Values are stored serialized, so callers always get a private copy
+    - In-memory LRU tier bounded by max_entries
+    - Optional SQLite tier under CACHE_DIR, bounded by disk_max_entries
+    Entries older than ttl_seconds are treated as missing (ttl_seconds=0 keeps them forever)
+    """
+    
+    def __init__(self, name: str, max_entries: int = 256, ttl_seconds: float = 0,
+                 db_path: Optional[str] = None, disk_max_entries: int = 10000):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_entries = disk_max_entries
+        
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = None
+        
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.commit()
+        
+        logger.info(
+            f"{name} cache: {max_entries} in memory, "
+            f"{'disk at ' + db_path if db_path else 'no disk tier'}, ttl={ttl_seconds or 'none'}"
+        )
+    
+    @classmethod
+    def from_env(cls, name: str, default_size: int = 256) -> "TieredCache":
+        """
+        Build a cache configured by <NAME>_CACHE_SIZE, <NAME>_CACHE_TTL and CACHE_DIR
+        CACHE_DIR unset disables the disk tier
+        """
+        prefix = name.upper()
+        cache_dir = os.getenv("CACHE_DIR")
+        return cls(
+            name=name,
+            max_entries=int(os.getenv(f"{prefix}_CACHE_SIZE", default_size)),
+            ttl_seconds=float(os.getenv(f"{prefix}_CACHE_TTL", 7 * 24 * 3600)),
+            db_path=os.path.join(cache_dir, f"{name}.sqlite3") if cache_dir else None,
+            disk_max_entries=int(os.getenv(f"{prefix}_CACHE_DISK_SIZE", 10000))
+        )
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value or None, counting hits and misses"""
+        value = self._get(key)
+        if value is None:
+            metrics.inc(f"{self.name}_cache_misses_total")
+        else:
+            metrics.inc(f"{self.name}_cache_hits_total")
+        return value
+    
+    def _get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, payload = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    return json.loads(payload)
+                del self._memory[key]
+            
+            if self._db is None:
+                return None
+            
+            row = self._db.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            
+            payload, created = row
+            if self._expired(created, now):
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, created, payload)
+            return json.loads(payload)
+    
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        payload = json.dumps(value)
+        
+        with self._lock:
+            self._remember(key, now, payload)
+            
+            if self._db is not None and self.disk_max_entries > 0:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, payload, now, now)
+                )
+                # Evict least recently used rows beyond the disk budget
+                self._db.execute(
+                    "DELETE FROM entries WHERE key IN "
+                    "(SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,)
+                )
+                self._db.commit()
+    
+    def _remember(self, key: str, created: float, payload: str):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (created, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+    
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created > self.ttl_seconds
+    
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,12 +1,35 @@
-import time
 import os
-from typing import List
+import time
+import uuid
+import asyncio
+import hashlib
+import numpy as np
+from typing import Dict, List, Optional, Tuple, Union
 from app.services.ocr_service import OCRService
 from app.services.llm_service import LLMService
 from app.services.preprocessor import DocumentPreprocessor
 from app.services.fraud_detector import FraudDetector
-from app.models.schemas import ExtractionData, PagewiseLineItems, ExtractionResponse, TokenUsage
-from app.utils.logger import logger
+from app.services.table_extractor import TableExtractor
+from app.services.executor import PipelineExecutor
+from app.services.cache import TieredCache
+from app.services.triage import DocumentTriage, ROUTE_REJECT
+from app.services.duplicate_index import DuplicateIndex, perceptual_hashes, ocr_amounts, line_item_fingerprint
+from app.models.schemas import (
+    ExtractionData, PagewiseLineItems, ExtractionResponse, TokenUsage, FraudReport, DuplicateMatch
+)
+from app.utils.logger import logger, log_text
+from app.utils.metrics import metrics, record_stage, SIZE_BUCKETS, COUNT_BUCKETS, TOKEN_BUCKETS
+from app.utils.document_io import sniff_document_type
+
+# Bump when pipeline logic changes in a way the service signatures don't capture
+# (e.g. validation/reconciliation rules), so cached results are not reused
+PIPELINE_VERSION = "1"
+
+FRAUD_DONE = "done"
+FRAUD_PENDING = "pending"
+FRAUD_FAILED = "failed"
+# Fraud confidence of a resubmitted bill
+DUPLICATE_CONFIDENCE = 0.9
 
 class DocumentProcessor:
     def __init__(self):
@@ -14,25 +37,160 @@ class DocumentProcessor:
         self.ocr_service = OCRService()
         self.llm_service = LLMService()
         self.preprocessor = DocumentPreprocessor()
+        self.triage = DocumentTriage()
         self.fraud_detector = FraudDetector()
+        self.table_extractor = TableExtractor()
+        self.executor = PipelineExecutor()
+        self.result_cache = TieredCache.from_env("result")
+        # OCR runs in worker processes, so its cache lives here on the parent side
+        self.ocr_cache = TieredCache.from_env("ocr", default_size=512)
+        # Fraud reports by document, and finished deferred checks by check id
+        self.fraud_cache = TieredCache.from_env("fraud", default_size=1024)
+        # Seconds a failed fraud check is served from the cache before it is retried
+        self.fraud_retry_seconds = float(os.getenv("FRAUD_RETRY_AFTER", 300))
+        self.pipeline_version = self._pipeline_version()
+        self.ocr_signature = hashlib.sha256(self.ocr_service.cache_signature().encode()).hexdigest()[:16]
+        self.fraud_signature = hashlib.sha256(
+            f"{self.pipeline_version}\n{self.fraud_detector.cache_signature()}".encode()
+        ).hexdigest()[:16]
+        # Deferred fraud checks still running, by check id
+        self._deferred: Dict[str, asyncio.Task] = {}
+        # Re-scanned/recompressed resubmissions, which the byte-keyed caches miss
+        self.duplicate_index = DuplicateIndex.from_env()
+        self.reuse_duplicates = os.getenv("DUPLICATE_REUSE_RESULT", "false").lower() in ("1", "true", "yes")
         logger.info("DocumentProcessor initialized successfully")
     
-    async def process_document(self, file_path: str) -> ExtractionResponse:
-        """Process single or multi-page document"""
+    def shutdown(self):
+        """Release worker pools and caches"""
+        for task in list(self._deferred.values()):
+            task.cancel()
+        self.executor.shutdown()
+        self.result_cache.close()
+        self.ocr_cache.close()
+        self.fraud_cache.close()
+        self.llm_service.cache.close()
+        if self.duplicate_index is not None:
+            self.duplicate_index.close()
+    
+    def _pipeline_version(self) -> str:
+        """Hash of everything besides the document bytes that determines the result"""
+        signature = "\n".join([
+            PIPELINE_VERSION,
+            self.preprocessor.cache_signature(),
+            self.triage.cache_signature(),
+            self.ocr_service.cache_signature(),
+            self.table_extractor.cache_signature(),
+            self.llm_service.cache_signature()
+        ])
+        return hashlib.sha256(signature.encode()).hexdigest()[:16]
+    
+    def _hash_bytes(self, data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+    
+    def _hash_array(self, image: np.ndarray) -> str:
+        digest = hashlib.sha256(f"{image.shape}:{image.dtype}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+    
+    def _read_file(self, file_path: str) -> bytes:
+        with open(file_path, "rb") as f:
+            return f.read()
+    
+    async def _extract_text_cached(self, content_hash: str, source: Union[bytes, np.ndarray]) -> Dict:
+        """
+        OCR memoized by the hash of what OCR actually sees (preprocessed page
+        array, or PDF bytes) plus the OCR config
+        """
+        cache_key = f"{self.ocr_signature}:{content_hash}"
+        try:
+            cached = await self.executor.run_io(self.ocr_cache.get, cache_key)
+        except Exception as e:
+            logger.warning(f"OCR cache lookup failed: {e}")
+            cached = None
+        
+        if cached is not None:
+            logger.info("OCR cache hit, skipping Tesseract")
+            return cached
+        
+        with metrics.stage("ocr"):
+            ocr_data = await self.executor.run_cpu(self.ocr_service.extract_text, source)
+        # Counted on fresh runs only, so the OCR metrics reflect real Tesseract work
+        self._record_ocr_metrics(ocr_data)
+        
+        await self.executor.run_io(self.ocr_cache.set, cache_key, ocr_data)
+        return ocr_data
+    
+    async def process_document(self, document: Union[bytes, str], fraud_check: str = "inline") -> ExtractionResponse:
+        """
+        Process single or multi-page document, reusing the cached result for identical bytes
+        document is the raw file content (a file path is read once for convenience)
+        fraud_check: "inline" (returned with the result), "deferred" (pending, poll
+        get_fraud_check) or "skip"
+        """
         start_time = time.time()
-        logger.info(f"Processing document: {file_path}")
         
         try:
-            # Step 1: Preprocess image
-            logger.info("Step 1: Preprocessing image...")
-            preprocessed_path = self.preprocessor.preprocess(file_path)
-            logger.info(f"Preprocessing complete: {preprocessed_path}")
-            
-            # Step 2: OCR extraction
-            logger.info("Step 2: Extracting text via OCR...")
-            ocr_data = self.ocr_service.extract_text(preprocessed_path)
+            if isinstance(document, str):
+                document = await self.executor.run_io(self._read_file, document)
+            doc_hash = await self.executor.run_io(self._hash_bytes, document)
+        except Exception as e:
+            logger.error(f"Failed to read document: {str(e)}")
+            return ExtractionResponse(is_success=False, error=str(e))
+        metrics.observe("document_bytes", len(document), buckets=SIZE_BUCKETS)
+        
+        cache_key = f"{self.pipeline_version}:{doc_hash}"
+        try:
+            cached = await self.executor.run_io(self.result_cache.get, cache_key)
+        except Exception as e:
+            logger.warning(f"Result cache lookup failed: {e}")
+            cached = None
+        
+        if cached is not None:
+            cached.pop("fraud", None)
+            fraud = None if fraud_check == "skip" else await self._cached_fraud(doc_hash)
+            if fraud_check != "skip" and fraud is None:
+                # Extracted before without fraud analysis (or its report expired): run only the check
+                logger.info(f"Result cache hit for {doc_hash[:12]} has no fraud report, running fraud detection")
+                fraud = await self._fraud_only(document, doc_hash, fraud_check)
+            logger.info(f"Result cache hit for {doc_hash[:12]} in {(time.time() - start_time) * 1000:.2f}ms")
+            return ExtractionResponse(**cached, fraud=fraud)
+        logger.info(f"Result cache miss for {doc_hash[:12]}")
+        
+        result = await self._process_uncached(document, doc_hash, fraud_check)
+        
+        # Only cache real extractions; empty results may come from transient LLM/OCR problems
+        if result.is_success and result.data and result.data.total_item_count > 0:
+            try:
+                # Fraud reports are cached on their own, so any fraud_check mode can reuse the result
+                await self.executor.run_io(self.result_cache.set, cache_key, result.model_dump(exclude={"fraud"}))
+            except Exception as e:
+                logger.warning(f"Result cache store failed: {e}")
+        
+        return result
+    
+    async def _process_uncached(self, data: bytes, doc_hash: str, fraud_check: str) -> ExtractionResponse:
+        """Run the full pipeline on the raw document bytes"""
+        start_time = time.time()
+        fraud_task = None
+        image_hashes = None
+        doc_type = sniff_document_type(data)
+        logger.info(f"Processing {doc_type or 'unknown'} document: {len(data)} bytes")
+        
+        try:
+            verdict, images, ocr_data = await self._prepare_pages(data, doc_hash, doc_type)
+            if verdict is not None and verdict["route"] == ROUTE_REJECT:
+                # Junk uploads stop here, before any Tesseract pass
+                return ExtractionResponse(is_success=False, error=f"Document rejected: {verdict['reason']}")
+            if self.duplicate_index is not None:
+                if images:
+                    image_hashes = await self.executor.run_io(perceptual_hashes, images[0])
+                elif ocr_data.get("image_hashes"):
+                    # PDFs are rasterized in the OCR worker, which hashes the first page
+                    image_hashes = tuple(ocr_data["image_hashes"])
             text_length = len(ocr_data.get("text", ""))
-            logger.info(f"OCR extraction complete: {text_length} characters extracted")
+            page_count = ocr_data.get("page_count", 1)
+            metrics.observe("document_pages", page_count, {"type": doc_type or "unknown"}, buckets=COUNT_BUCKETS)
+            logger.info(f"OCR extraction complete: {text_length} characters extracted from {page_count} page(s)")
             
             # Check if OCR produced meaningful text
             if text_length < 50:
@@ -48,25 +206,37 @@ class DocumentProcessor:
                     is_success=True,
                     token_usage=TokenUsage(total_tokens=0, input_tokens=0, output_tokens=0),
                     data=ExtractionData(
-                        pagewise_line_items=[
-                            PagewiseLineItems(page_no="1", page_type="Unknown", bill_items=[])
-                        ],
+                        pagewise_line_items=self._empty_pages(page_count),
                         total_item_count=0,
                         reconciled_amount=0.0
                     )
                 )
             
-            # Step 3: Fraud detection
-            logger.info("Step 3: Running fraud detection...")
-            fraud_result = self.fraud_detector.detect([preprocessed_path], ocr_data)
-            if fraud_result.get("detected"):
-                logger.warning(f"Fraud indicators detected: {fraud_result.get('details')}")
+            # A re-scan of a bill we already extracted: reuse its result, skip the LLM
+            amounts = ocr_amounts(ocr_data.get("text", ""))
+            duplicate = await self._find_near_duplicate(doc_hash, image_hashes, amounts)
+            if duplicate is not None and self.reuse_duplicates:
+                return await self._reuse_duplicate(doc_hash, duplicate, image_hashes, amounts, fraud_check)
+            
+            # Step 3: Fraud detection, in the CPU pool while step 4 waits on the LLM
+            fraud = None
+            if fraud_check != "skip":
+                logger.info(f"Step 3: Starting fraud detection ({fraud_check})...")
+                fraud, fraud_task = self._start_fraud(data, doc_hash, doc_type, verdict, images, ocr_data, fraud_check)
+            
+            # Step 4: Rule-based extraction for clean tables, LLM for everything else
+            with metrics.stage("table"):
+                extraction_data = await self._extract_table(ocr_data)
+            if extraction_data is not None:
+                logger.info("Step 4: Table reconciles with its printed total, skipping LLM")
+                token_usage = TokenUsage(total_tokens=0, input_tokens=0, output_tokens=0)
             else:
-                logger.info("No fraud indicators detected")
+                logger.info("Step 4: Extracting structured data via LLM...")
+                extraction_data, token_usage = await self.llm_service.extract_invoice_data(ocr_data)
+                self._record_token_metrics(token_usage)
             
-            # Step 4: LLM-based structured extraction
-            logger.info("Step 4: Extracting structured data via LLM...")
-            extraction_data, token_usage = await self.llm_service.extract_invoice_data(ocr_data)
+            if fraud_task is not None:
+                fraud = await fraud_task
             
             # Check if extraction is empty
             if extraction_data.get('total_item_count', 0) == 0:
@@ -74,7 +244,7 @@ class DocumentProcessor:
                 logger.error("Debug information:")
                 logger.error(f"- OCR text length: {text_length} chars")
                 logger.error(f"- OCR quality seems poor (garbled text)")
-                logger.error(f"- First 200 chars: {ocr_data.get('text', '')[:200]}")
+                log_text("OCR text of the document without items", ocr_data.get("text", ""), limit=200)
                 logger.error("\nPossible solutions:")
                 logger.error("1. Use a clearer/higher resolution image")
                 logger.error("2. Ensure the image is not rotated")
@@ -86,28 +256,383 @@ class DocumentProcessor:
                     is_success=True,
                     token_usage=token_usage,
                     data=ExtractionData(
-                        pagewise_line_items=[
-                            PagewiseLineItems(page_no="1", page_type="Unknown", bill_items=[])
-                        ],
+                        pagewise_line_items=self._empty_pages(page_count),
                         total_item_count=0,
                         reconciled_amount=0.0
-                    )
+                    ),
+                    fraud=fraud
                 )
             else:
                 logger.info(f"✅ LLM extraction complete: {extraction_data.get('total_item_count')} items found")
             
-            processing_time = (time.time() - start_time) * 1000
-            logger.info(f"Total processing time: {processing_time:.2f}ms")
+            with metrics.stage("validate"):
+                extraction_data["pagewise_line_items"] = self._align_pages(
+                    extraction_data.get("pagewise_line_items", []), page_count
+                )
             
-            return ExtractionResponse(
+            result = ExtractionResponse(
                 is_success=True,
                 token_usage=token_usage,
-                data=ExtractionData(**extraction_data)
+                data=ExtractionData(**extraction_data),
+                fraud=fraud
             )
+            
+            earlier = await self._index_document(doc_hash, image_hashes, amounts, result)
+            match = None
+            if duplicate is not None:
+                match = self._near_duplicate_match(duplicate)
+            elif earlier is not None:
+                metrics.inc("duplicates_line_items_total")
+                logger.warning(f"Line items match earlier document {earlier['doc_hash'][:12]}")
+                match = DuplicateMatch(kind="line_items", **earlier)
+            if match is not None and result.fraud is not None:
+                result.fraud = await self._flag_duplicate(doc_hash, result.fraud, match)
+            
+            processing_time = (time.time() - start_time) * 1000
+            logger.info(f"Total processing time: {processing_time:.2f}ms")
+            
+            return result
         
         except Exception as e:
+            if fraud_task is not None:
+                fraud_task.cancel()
             logger.error(f"Error processing document: {str(e)}", exc_info=True)
             return ExtractionResponse(
                 is_success=False,
                 error=str(e)
             )
+    
+    async def _prepare_pages(self, data: bytes, doc_hash: str,
+                             doc_type: Optional[str]) -> Tuple[Optional[Dict], List[np.ndarray], Dict]:
+        """
+        Steps 1-2: triage and preprocess (images), then OCR (cached)
+        Returns (triage verdict or None, preprocessed pages, OCR data); a rejected
+        document returns its verdict with no pages and no OCR data
+        """
+        if doc_type == "pdf":
+            # Pages are rasterized one at a time inside the OCR workers
+            logger.info("Step 1: PDF document, skipping image preprocessing")
+            logger.info("Step 2: Extracting text via OCR...")
+            return None, [], await self._extract_text_cached(doc_hash, data)
+        
+        # Step 1: Decode once, triage on a thumbnail, preprocess in memory
+        logger.info("Step 1: Preprocessing image...")
+        with metrics.stage("preprocess"):
+            if self.triage.enabled:
+                verdict, image = await self.executor.run_cpu(
+                    self.triage.triage_and_preprocess, self.preprocessor, data
+                )
+            else:
+                verdict, image = None, await self.executor.run_cpu(self.preprocessor.preprocess, data)
+        if verdict is not None:
+            self._record_triage(verdict)
+            if verdict["route"] == ROUTE_REJECT:
+                return verdict, [], {}
+        logger.info(f"Preprocessing complete: {image.shape}")
+        
+        # Step 2: OCR extraction
+        logger.info("Step 2: Extracting text via OCR...")
+        image_hash = await self.executor.run_io(self._hash_array, image)
+        return verdict, [image], await self._extract_text_cached(image_hash, image)
+    
+    def _start_fraud(self, data: bytes, doc_hash: str, doc_type: Optional[str], verdict: Optional[Dict],
+                     images: List[np.ndarray], ocr_data: Dict,
+                     fraud_check: str) -> Tuple[Optional[FraudReport], Optional[asyncio.Task]]:
+        """Deferred checks return their pending report, inline ones a task to await"""
+        metrics.inc(f"fraud_checks_{fraud_check}_total")
+        # Error-level analysis needs the JPEG as uploaded, before preprocessing
+        # (and skips turned pages, whose boxes wouldn't line up with the upload)
+        rotation = verdict["rotation"] if verdict is not None else 0
+        jpeg = data if doc_type == "jpeg" and rotation == 0 else None
+        if fraud_check == "deferred":
+            return self._defer_fraud(doc_hash, images, ocr_data, jpeg), None
+        return None, asyncio.create_task(self._detect_fraud(doc_hash, images, ocr_data, jpeg))
+    
+    async def _fraud_only(self, data: bytes, doc_hash: str, fraud_check: str) -> FraudReport:
+        """Fraud report for a document whose extraction is cached; OCR comes from its cache too"""
+        doc_type = sniff_document_type(data)
+        try:
+            verdict, images, ocr_data = await self._prepare_pages(data, doc_hash, doc_type)
+        except Exception as e:
+            logger.warning(f"Fraud detection failed: {e}")
+            metrics.inc("fraud_checks_failed_total")
+            return FraudReport(status=FRAUD_FAILED, details=[str(e)])
+        if verdict is not None and verdict["route"] == ROUTE_REJECT:
+            return FraudReport(status=FRAUD_FAILED, details=[f"Document rejected: {verdict['reason']}"])
+        fraud, fraud_task = self._start_fraud(data, doc_hash, doc_type, verdict, images, ocr_data, fraud_check)
+        return fraud if fraud_task is None else await fraud_task
+    
+    async def _detect_fraud(self, doc_hash: str, images: List[np.ndarray], ocr_data: Dict,
+                            jpeg: Optional[bytes]) -> FraudReport:
+        """Fraud analysis in the CPU pool; failures are reported, never raised"""
+        try:
+            with metrics.stage("fraud"):
+                fraud_result = await self.executor.run_cpu(self.fraud_detector.detect, images, ocr_data, jpeg)
+        except Exception as e:
+            logger.warning(f"Fraud detection failed: {e}")
+            metrics.inc("fraud_checks_failed_total")
+            report = FraudReport(status=FRAUD_FAILED, details=[str(e)])
+            await self._store_fraud(doc_hash, report)
+            return report
+        
+        if fraud_result.get("detected"):
+            logger.warning(f"Fraud indicators detected: {fraud_result.get('details')}")
+            metrics.inc("fraud_detected_total")
+        else:
+            logger.info("No fraud indicators detected")
+        
+        report = FraudReport(status=FRAUD_DONE, **fraud_result)
+        await self._store_fraud(doc_hash, report)
+        return report
+    
+    async def _store_fraud(self, doc_hash: str, report: FraudReport):
+        value = report.model_dump()
+        if report.status == FRAUD_FAILED:
+            # Served until then, so a failing document isn't re-analyzed on every request
+            value["retry_after"] = time.time() + self.fraud_retry_seconds
+        try:
+            await self.executor.run_io(self.fraud_cache.set, f"{self.fraud_signature}:{doc_hash}", value)
+        except Exception as e:
+            logger.warning(f"Fraud cache store failed: {e}")
+    
+    def _defer_fraud(self, doc_hash: str, images: List[np.ndarray], ocr_data: Dict, jpeg: Optional[bytes]) -> FraudReport:
+        """Start fraud analysis in the background; the caller polls get_fraud_check(check_id)"""
+        check_id = uuid.uuid4().hex
+        
+        async def run():
+            report = await self._detect_fraud(doc_hash, images, ocr_data, jpeg)
+            report.check_id = check_id
+            await self.executor.run_io(self.fraud_cache.set, f"check:{check_id}", report.model_dump())
+        
+        self._track_deferred(check_id, run())
+        return FraudReport(status=FRAUD_PENDING, check_id=check_id)
+    
+    def _track_deferred(self, check_id: str, coro) -> asyncio.Task:
+        """Run a deferred check's work; polls report it pending until the latest task is done"""
+        task = asyncio.create_task(coro)
+        self._deferred[check_id] = task
+        
+        def done(_):
+            if self._deferred.get(check_id) is task:
+                del self._deferred[check_id]
+        
+        task.add_done_callback(done)
+        return task
+    
+    async def _cached_fraud(self, doc_hash: str) -> Optional[FraudReport]:
+        try:
+            cached = await self.executor.run_io(self.fraud_cache.get, f"{self.fraud_signature}:{doc_hash}")
+        except Exception as e:
+            logger.warning(f"Fraud cache lookup failed: {e}")
+            return None
+        if cached is None:
+            return None
+        # A failed check is retried once its retry_after has passed
+        retry_after = cached.pop("retry_after", None)
+        if retry_after is not None and retry_after < time.time():
+            return None
+        return FraudReport(**cached)
+    
+    async def get_fraud_check(self, check_id: str) -> Optional[FraudReport]:
+        """State of a deferred fraud check (None if unknown or expired)"""
+        if check_id in self._deferred:
+            return FraudReport(status=FRAUD_PENDING, check_id=check_id)
+        cached = await self.executor.run_io(self.fraud_cache.get, f"check:{check_id}")
+        return FraudReport(**cached) if cached is not None else None
+    
+    async def _find_near_duplicate(self, doc_hash: str, image_hashes: Optional[tuple],
+                                   amounts: List[str]) -> Optional[Dict]:
+        """Earlier image document that looks the same and shares its amounts, if any"""
+        if self.duplicate_index is None or image_hashes is None:
+            return None
+        try:
+            duplicate = await self.executor.run_io(
+                self.duplicate_index.find_near_duplicate, doc_hash, image_hashes, amounts
+            )
+        except Exception as e:
+            logger.warning(f"Duplicate index lookup failed: {e}")
+            return None
+        
+        if duplicate is not None:
+            metrics.inc("duplicates_near_duplicate_total")
+            logger.warning(
+                f"Near-duplicate of {duplicate['doc_hash'][:12]}: distance {duplicate['distance']} bits, "
+                f"{duplicate['amount_overlap']:.0%} of amounts shared"
+            )
+        return duplicate
+    
+    async def _reuse_duplicate(self, doc_hash: str, duplicate: Dict, image_hashes: tuple,
+                               amounts: List[str], fraud_check: str) -> ExtractionResponse:
+        """The earlier document's result, flagged as a resubmission"""
+        metrics.inc("duplicates_reused_total")
+        result = ExtractionResponse(**duplicate["result"])
+        # Indexed too, so later re-scans match whichever copy they resemble most
+        await self._index_document(doc_hash, image_hashes, amounts, result)
+        if fraud_check != "skip":
+            result.fraud = await self._flag_duplicate(
+                doc_hash, FraudReport(status=FRAUD_DONE), self._near_duplicate_match(duplicate)
+            )
+        return result
+    
+    def _near_duplicate_match(self, duplicate: Dict) -> DuplicateMatch:
+        return DuplicateMatch(
+            kind="near_duplicate",
+            doc_hash=duplicate["doc_hash"],
+            seen_at=duplicate["seen_at"],
+            distance=duplicate["distance"],
+            amount_overlap=duplicate["amount_overlap"]
+        )
+    
+    async def _index_document(self, doc_hash: str, image_hashes: Optional[tuple], amounts: List[str],
+                              result: ExtractionResponse) -> Optional[Dict]:
+        """Record an extraction in the duplicate index; returns an earlier document with the same line items"""
+        if self.duplicate_index is None:
+            return None
+        fingerprint = line_item_fingerprint(result.data.model_dump())
+        
+        def record():
+            earlier = self.duplicate_index.find_by_items(doc_hash, fingerprint) if fingerprint else None
+            self.duplicate_index.add(doc_hash, image_hashes, amounts, fingerprint, result.model_dump(exclude={"fraud"}))
+            return earlier
+        
+        try:
+            return await self.executor.run_io(record)
+        except Exception as e:
+            logger.warning(f"Duplicate index update failed: {e}")
+            return None
+    
+    async def _flag_duplicate(self, doc_hash: str, report: FraudReport, match: DuplicateMatch) -> FraudReport:
+        """Add a resubmission to the fraud report and its stored copy (a deferred check's once it finishes)"""
+        self._apply_duplicate(report, match)
+        if report.status == FRAUD_DONE:
+            await self._store_fraud(doc_hash, report)
+        elif report.status == FRAUD_PENDING:
+            self._flag_deferred(doc_hash, report.check_id, match)
+        return report
+    
+    def _flag_deferred(self, doc_hash: str, check_id: str, match: DuplicateMatch):
+        """Add the resubmission to a deferred check's stored report after its analysis finishes"""
+        analysis = self._deferred.get(check_id)
+        
+        async def run():
+            if analysis is not None:
+                try:
+                    await asyncio.wait([analysis])
+                except asyncio.CancelledError:
+                    analysis.cancel()
+                    raise
+            cached = await self.executor.run_io(self.fraud_cache.get, f"check:{check_id}")
+            if cached is None:
+                return
+            report = self._apply_duplicate(FraudReport(**cached), match)
+            await self.executor.run_io(self.fraud_cache.set, f"check:{check_id}", report.model_dump())
+            if report.status == FRAUD_DONE:
+                await self._store_fraud(doc_hash, report)
+        
+        self._track_deferred(check_id, run())
+    
+    def _apply_duplicate(self, report: FraudReport, match: DuplicateMatch) -> FraudReport:
+        seen = time.strftime("%Y-%m-%d %H:%M", time.localtime(match.seen_at))
+        if match.kind == "near_duplicate":
+            detail = (
+                f"Near-duplicate of a document processed {seen} "
+                f"(image distance {match.distance} bits, {match.amount_overlap:.0%} of amounts shared)"
+            )
+        else:
+            detail = f"Same line items as a document processed {seen}"
+        
+        report.duplicate = match
+        report.detected = True
+        report.confidence = max(report.confidence, DUPLICATE_CONFIDENCE)
+        report.details.append(detail)
+        return report
+    
+    async def _extract_table(self, ocr_data: Dict) -> Optional[Dict]:
+        """Rule-based extraction; None (never an error) means the LLM should handle the document"""
+        if not self.table_extractor.enabled:
+            return None
+        
+        metrics.inc("table_extractor_attempts_total")
+        try:
+            extraction_data = await self.executor.run_cpu(self.table_extractor.extract, ocr_data)
+        except Exception as e:
+            logger.warning(f"Table extractor failed, falling back to LLM: {e}")
+            return None
+        
+        if extraction_data is not None:
+            # bypass rate = table_extractor_bypass_total / table_extractor_attempts_total
+            metrics.inc("table_extractor_bypass_total")
+        return extraction_data
+    
+    def _record_triage(self, verdict: Dict):
+        """Route counts, and triage time as its own stage (it ran inside the preprocess call)"""
+        metrics.inc(f"triage_{verdict['route']}_total")
+        metrics.observe("stage_seconds", verdict["seconds"], {"stage": "triage"})
+        record_stage("triage", verdict["seconds"])
+    
+    def _record_ocr_metrics(self, ocr_data: Dict):
+        """Count Tesseract passes so fallback frequency and OCR CPU time are visible"""
+        ocr_stats = ocr_data.get("ocr_stats", {})
+        metrics.inc("ocr_pages_total", ocr_stats.get("pages", 0))
+        metrics.inc("ocr_passes_total", ocr_stats.get("passes", 0))
+        metrics.inc("ocr_fallbacks_total", ocr_stats.get("fallbacks", 0))
+        metrics.inc("ocr_pages_with_fallback_total", ocr_stats.get("pages_with_fallback", 0))
+        metrics.inc("ocr_tesseract_seconds_total", ocr_stats.get("tesseract_seconds", 0.0))
+        metrics.inc("ocr_roi_pages_total", ocr_stats.get("roi_pages", 0))
+        metrics.inc("ocr_pixels_total", ocr_stats.get("pixels", 0))
+        metrics.inc("ocr_text_layer_pages_total", ocr_stats.get("text_layer_pages", 0))
+        for page in ocr_data.get("pages", []):
+            page_stats = page.get("ocr_stats", {})
+            if page_stats.get("text_layer"):
+                continue
+            metrics.observe("ocr_page_seconds", page_stats.get("seconds", page_stats.get("tesseract_seconds", 0.0)))
+            for config, seconds in page_stats.get("config_seconds", {}).items():
+                metrics.observe("ocr_config_seconds", seconds, {"config": config})
+        logger.info(
+            f"OCR passes: {ocr_stats.get('passes', 0)} over {ocr_stats.get('pages', 0)} page(s), "
+            f"{ocr_stats.get('fallbacks', 0)} fallback(s), {ocr_stats.get('tesseract_seconds', 0.0):.2f}s in Tesseract"
+        )
+    
+    def _record_token_metrics(self, token_usage: TokenUsage):
+        """
+        Tokens per LLM-extracted document (cached replies report their original usage)
+        Billed spend is counted per call by LLMService, not here
+        """
+        metrics.observe("llm_input_tokens", token_usage.input_tokens, buckets=TOKEN_BUCKETS)
+        metrics.observe("llm_output_tokens", token_usage.output_tokens, buckets=TOKEN_BUCKETS)
+    
+    def _empty_pages(self, page_count: int) -> List[PagewiseLineItems]:
+        """One empty entry per real page"""
+        return [
+            PagewiseLineItems(page_no=str(page_no), page_type="Unknown", bill_items=[])
+            for page_no in range(1, page_count + 1)
+        ]
+    
+    def _align_pages(self, pages: List[Dict], page_count: int) -> List[Dict]:
+        """
+        Return exactly one pagewise entry per real page
+        Entries the LLM split or numbered past the last page are merged into the
+        nearest real page, so no extracted item is dropped
+        """
+        aligned = {
+            page_no: {"page_no": str(page_no), "page_type": None, "bill_items": []}
+            for page_no in range(1, page_count + 1)
+        }
+        
+        for page in pages:
+            try:
+                page_no = int(str(page.get("page_no", "1")).strip())
+            except ValueError:
+                page_no = 1
+            page_no = min(max(page_no, 1), page_count)
+            
+            target = aligned[page_no]
+            target["bill_items"].extend(page.get("bill_items", []))
+            if target["page_type"] is None and page.get("page_type"):
+                target["page_type"] = page["page_type"]
+        
+        for page in aligned.values():
+            if page["page_type"] is None:
+                page["page_type"] = "Bill Detail" if page["bill_items"] else "Unknown"
+        
+        return list(aligned.values())
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from app.utils.logger import logger
+
+# 64-bit hashes split into four 16-bit bands for multi-index lookup
+BANDS = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Expired rows are deleted at most this often (seconds)
+PRUNE_INTERVAL = 3600
+
+# Amounts as printed on bills (1,250.00 / 480.50); the numbers a re-scan must share
+AMOUNT_RE = re.compile(r"\d[\d,]*\.\d{2}\b")
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so pHash needs no scipy"""
+    k = np.arange(n)[:, None]
+    basis = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    basis[0] /= np.sqrt(2)
+    return basis * np.sqrt(2 / n)
+
+DCT_32 = _dct_matrix(32)
+
+def perceptual_hashes(image: np.ndarray) -> Tuple[int, int]:
+    """
+    (pHash, dHash) of a page array, 64 bits each
+    pHash: signs of the 8x8 low-frequency DCT block against its median (survives
+    recompression, rescaling and small crops); dHash: horizontal gradient signs
+    of a 9x8 thumbnail (cheap second opinion that rejects same-template look-alikes)
+    """
+    gray = image if image.ndim == 2 else image.mean(axis=2)
+    page = Image.fromarray(np.asarray(gray, dtype=np.uint8))
+    
+    small = np.asarray(page.resize((32, 32), Image.Resampling.BOX), dtype=np.float64)
+    low = (DCT_32 @ small @ DCT_32.T)[:8, :8].ravel()
+    # The DC term only reflects overall brightness
+    phash_bits = low > np.median(low[1:])
+    
+    thumb = np.asarray(page.resize((9, 8), Image.Resampling.BOX), dtype=np.int16)
+    dhash_bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    
+    return _pack(phash_bits), _pack(dhash_bits)
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def ocr_amounts(text: str) -> List[str]:
+    """Decimal amounts in OCR text, normalized and sorted"""
+    return sorted(match.replace(",", "") for match in AMOUNT_RE.findall(text))
+
+def amount_overlap(a: List[str], b: List[str]) -> Tuple[int, float]:
+    """
+    Amounts two lists share (counted with multiplicity) and their multiset Jaccard
+    similarity (1.0 = same numbers)
+    """
+    if not a or not b:
+        return 0, 0.0
+    ca, cb = Counter(a), Counter(b)
+    shared = sum((ca & cb).values())
+    return shared, shared / sum((ca | cb).values())
+
+def line_item_fingerprint(extraction_data: Dict, min_items: int = 3) -> Optional[str]:
+    """
+    Hash of the normalized (name, amount) pairs plus the total, independent of
+    item order, page split and OCR spacing; None for bills too short to be distinctive
+    """
+    items = [
+        item
+        for page in extraction_data.get("pagewise_line_items", [])
+        for item in page.get("bill_items", [])
+    ]
+    if len(items) < min_items:
+        return None
+    
+    normalized = sorted(
+        f"{re.sub(r'[^a-z0-9]', '', str(item.get('item_name', '')).lower())}|{float(item.get('item_amount') or 0):.2f}"
+        for item in items
+    )
+    normalized.append(f"total|{float(extraction_data.get('reconciled_amount') or 0):.2f}")
+    return hashlib.sha256("\n".join(normalized).encode()).hexdigest()
+
+class DuplicateIndex:
+    """
+    SQLite index of processed documents for duplicate and near-duplicate lookup
+    - Documents by the perceptual hash of their (first) page (pHash and dHash within max_distance bits),
+      confirmed by the amounts in their OCR text (at least min_shared_amounts of them,
+      so a template with one or two numbers filled in doesn't match its siblings)
+    - Every document by the fingerprint of its extracted line items (exact)
+    Hamming search uses multi-index hashing: pHash is stored as four indexed 16-bit
+    bands. Two hashes within d bits differ in at most d // 4 bits on some band, so
+    candidates come from index lookups of each band's neighbours, not a table scan,
+    which keeps lookups in milliseconds with millions of rows
+    Rows older than ttl_seconds are pruned (ttl_seconds=0 keeps them forever)
+    """
+    
+    def __init__(self, db_path: str, max_distance: int = 6, min_amount_overlap: float = 0.9,
+                 min_shared_amounts: int = 3, ttl_seconds: float = 0):
+        self.max_distance = max_distance
+        self.min_amount_overlap = min_amount_overlap
+        self.min_shared_amounts = max(1, min_shared_amounts)
+        self.ttl_seconds = ttl_seconds
+        self.band_radius = max_distance // BANDS
+        self._pruned_at = 0.0
+        
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id INTEGER PRIMARY KEY, doc_hash TEXT NOT NULL, phash TEXT, dhash TEXT, "
+            "b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER, amounts TEXT, items TEXT, "
+            "result BLOB, created REAL NOT NULL)"
+        )
+        for column in ("b0", "b1", "b2", "b3", "items", "doc_hash", "created"):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS documents_{column} ON documents ({column})")
+        self._db.commit()
+        self._prune()
+        logger.info(
+            f"Duplicate index at {db_path}: max distance {max_distance} bits, band radius {self.band_radius}, "
+            f"ttl={ttl_seconds or 'none'}"
+        )
+    
+    @classmethod
+    def from_env(cls) -> Optional["DuplicateIndex"]:
+        """
+        Configured by DUPLICATE_INDEX_PATH (empty disables), DUPLICATE_MAX_DISTANCE,
+        DUPLICATE_MIN_AMOUNT_OVERLAP, DUPLICATE_MIN_SHARED_AMOUNTS, DUPLICATE_INDEX_TTL
+        """
+        db_path = os.getenv("DUPLICATE_INDEX_PATH", "data/duplicates.sqlite3")
+        if not db_path:
+            return None
+        return cls(
+            db_path,
+            max_distance=int(os.getenv("DUPLICATE_MAX_DISTANCE", 6)),
+            min_amount_overlap=float(os.getenv("DUPLICATE_MIN_AMOUNT_OVERLAP", 0.9)),
+            min_shared_amounts=int(os.getenv("DUPLICATE_MIN_SHARED_AMOUNTS", 3)),
+            ttl_seconds=float(os.getenv("DUPLICATE_INDEX_TTL", 180 * 24 * 3600))
+        )
+    
+    def find_near_duplicate(self, doc_hash: str, hashes: Tuple[int, int], amounts: List[str]) -> Optional[Dict]:
+        """
+        Closest earlier document within max_distance on both hashes whose
+        OCR amounts overlap by min_amount_overlap; the same file (doc_hash) doesn't count
+        """
+        if len(amounts) < self.min_shared_amounts:
+            return None
+        phash, dhash = hashes
+        neighbours = self._band_neighbours(phash)
+        best = None
+        
+        with self._lock:
+            seen = set()
+            for band, values in enumerate(neighbours):
+                placeholders = ",".join("?" * len(values))
+                rows = self._db.execute(
+                    f"SELECT id, doc_hash, phash, dhash, amounts, created FROM documents "
+                    f"WHERE b{band} IN ({placeholders})",
+                    values
+                ).fetchall()
+                for row in rows:
+                    if row[0] in seen or row[1] == doc_hash:
+                        continue
+                    seen.add(row[0])
+                    distance = max(
+                        bin(phash ^ int(row[2], 16)).count("1"),
+                        bin(dhash ^ int(row[3], 16)).count("1")
+                    )
+                    if distance > self.max_distance or (best is not None and distance >= best["distance"]):
+                        continue
+                    shared, overlap = amount_overlap(amounts, json.loads(row[4]))
+                    if shared < self.min_shared_amounts or overlap < self.min_amount_overlap:
+                        continue
+                    best = {
+                        "id": row[0],
+                        "doc_hash": row[1],
+                        "distance": distance,
+                        "amount_overlap": round(overlap, 3),
+                        "seen_at": row[5]
+                    }
+            
+            if best is not None:
+                # Only the match's result is read and decompressed
+                row = self._db.execute("SELECT result FROM documents WHERE id = ?", (best.pop("id"),)).fetchone()
+                best["result"] = json.loads(zlib.decompress(row[0]))
+        return best
+    
+    def find_by_items(self, doc_hash: str, fingerprint: str) -> Optional[Dict]:
+        """Earliest other document with the same line-item fingerprint"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT doc_hash, created FROM documents WHERE items = ? AND doc_hash != ? ORDER BY created LIMIT 1",
+                (fingerprint, doc_hash)
+            ).fetchone()
+        return {"doc_hash": row[0], "seen_at": row[1]} if row else None
+    
+    def add(self, doc_hash: str, hashes: Optional[Tuple[int, int]], amounts: List[str],
+            fingerprint: Optional[str], result: Dict) -> None:
+        """Record a processed document; hashes is None when the first page couldn't be hashed"""
+        if hashes is not None:
+            phash, dhash = hashes
+            hash_columns = (f"{phash:016x}", f"{dhash:016x}", *self._bands(phash))
+        else:
+            hash_columns = (None,) * (2 + BANDS)
+        with self._lock:
+            # Re-runs of the same file (e.g. after a result cache eviction) add nothing
+            if self._db.execute("SELECT 1 FROM documents WHERE doc_hash = ?", (doc_hash,)).fetchone():
+                return
+            self._db.execute(
+                "INSERT INTO documents (doc_hash, phash, dhash, b0, b1, b2, b3, amounts, items, result, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc_hash, *hash_columns, json.dumps(amounts), fingerprint,
+                 zlib.compress(json.dumps(result).encode()), time.time())
+            )
+            self._db.commit()
+        if time.time() - self._pruned_at > PRUNE_INTERVAL:
+            self._prune()
+    
+    def _prune(self):
+        """Delete documents older than the TTL, so claims outside the resubmission window stop matching"""
+        self._pruned_at = time.time()
+        if not self.ttl_seconds:
+            return
+        with self._lock:
+            deleted = self._db.execute(
+                "DELETE FROM documents WHERE created < ?", (self._pruned_at - self.ttl_seconds,)
+            ).rowcount
+            self._db.commit()
+        if deleted:
+            logger.info(f"Duplicate index: pruned {deleted} document(s) older than {self.ttl_seconds:.0f}s")
+    
+    def _bands(self, value: int) -> List[int]:
+        return [(value >> (band * BAND_BITS)) & BAND_MASK for band in range(BANDS)]
+    
+    def _band_neighbours(self, value: int) -> List[List[int]]:
+        """Per band, every 16-bit value within band_radius bits of the hash's band"""
+        neighbours = []
+        for band in self._bands(value):
+            values = [band]
+            for radius in range(1, self.band_radius + 1):
+                for bits in combinations(range(BAND_BITS), radius):
+                    flipped = band
+                    for bit in bits:
+                        flipped ^= 1 << bit
+                    values.append(flipped)
+            neighbours.append(values)
+        return neighbours
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
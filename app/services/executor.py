@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+from app.utils.logger import logger, get_request_id, set_request_id
+from app.services.ocr_backend import set_tesseract_slots
+
+def _call_with_request_id(request_id: str, fn: Callable, *args, **kwargs) -> Any:
+    """Runs in a worker process, so its log lines carry the caller's request id"""
+    set_request_id(request_id)
+    return fn(*args, **kwargs)
+
+class PipelineExecutor:
+    """
+    Runs blocking pipeline stages off the asyncio event loop
+    - CPU-bound stages (preprocessing, OCR, fraud analysis) go to a bounded process pool
+    - Blocking I/O goes to a thread pool
+    Pool sizes come from CPU_WORKERS / IO_WORKERS; CPU_WORKERS=0 runs CPU stages
+    in the thread pool instead (e.g. on platforms without multiprocessing)
+    Tesseract calls across all CPU workers share TESSERACT_SLOTS (default cpu_count), so
+    a lone large PDF can OCR its pages on every idle core without a busy server
+    running CPU_WORKERS x OCR_PAGE_WORKERS Tesseracts
+    """
+    
+    def __init__(self):
+        self.cpu_workers = max(0, int(os.getenv("CPU_WORKERS", os.cpu_count() or 1)))
+        self.io_workers = max(1, int(os.getenv("IO_WORKERS", 16)))
+        self.tesseract_slots = max(1, int(os.getenv("TESSERACT_SLOTS", os.cpu_count() or 1)))
+        
+        self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="io")
+        self._cpu_pool = self._create_cpu_pool()
+        
+        logger.info(
+            f"PipelineExecutor initialized: {self.cpu_workers} CPU worker(s), {self.io_workers} I/O worker(s), "
+            f"{self.tesseract_slots} Tesseract slot(s)"
+        )
+    
+    def _create_cpu_pool(self):
+        if self.cpu_workers == 0:
+            return None
+        # spawn, not fork: the parent already runs the event loop and worker threads
+        context = multiprocessing.get_context("spawn")
+        # A fresh semaphore per pool, so slots held by workers of a broken pool aren't lost
+        return ProcessPoolExecutor(
+            max_workers=self.cpu_workers,
+            mp_context=context,
+            initializer=set_tesseract_slots,
+            initargs=(context.BoundedSemaphore(self.tesseract_slots),)
+        )
+    
+    async def run_cpu(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a CPU-bound callable in the process pool (fn and args must be picklable)"""
+        if self._cpu_pool is None:
+            return await self.run_io(fn, *args, **kwargs)
+        
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._cpu_pool, functools.partial(_call_with_request_id, get_request_id(), fn, *args, **kwargs)
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); replace the pool so later requests still run
+            logger.error("CPU worker pool broken, restarting it")
+            self._cpu_pool.shutdown(wait=False, cancel_futures=True)
+            self._cpu_pool = self._create_cpu_pool()
+            raise
+    
+    async def run_io(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking I/O callable in the thread pool"""
+        loop = asyncio.get_running_loop()
+        # Like asyncio.to_thread: the thread sees the caller's context (request id, stage timings)
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._io_pool, functools.partial(context.run, fn, *args, **kwargs))
+    
+    def shutdown(self):
+        """Stop both pools, waiting for running stages to finish"""
+        logger.info("Shutting down PipelineExecutor...")
+        if self._cpu_pool is not None:
+            self._cpu_pool.shutdown(wait=True, cancel_futures=True)
+        self._io_pool.shutdown(wait=True, cancel_futures=True)
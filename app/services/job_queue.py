@@ -0,0 +1,211 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+from app.models.schemas import ExtractionResponse
+from app.utils.logger import logger, set_request_id
+from app.utils.metrics import metrics
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class JobStore:
+    """SQLite-backed job records, so queued work and results survive a restart"""
+    
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, document TEXT, result TEXT, error TEXT, "
+            "created REAL NOT NULL, updated REAL NOT NULL, fraud_check TEXT NOT NULL DEFAULT 'inline')"
+        )
+        # Stores created before jobs carried a fraud check mode
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        if "fraud_check" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN fraud_check TEXT NOT NULL DEFAULT 'inline'")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        self._db.commit()
+    
+    def create(self, document: str, fraud_check: str = "inline") -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, document, fraud_check, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, document, fraud_check, now, now)
+            )
+            self._db.commit()
+        return job_id
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, result, error, created, updated FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+            "created_at": row[4],
+            "updated_at": row[5]
+        }
+    
+    def get_payload(self, job_id: str) -> Optional[Tuple[str, str]]:
+        """(document, fraud check mode) of a job that hasn't finished yet"""
+        with self._lock:
+            row = self._db.execute("SELECT document, fraud_check FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return (row[0], row[1]) if row and row[0] is not None else None
+    
+    def mark_running(self, job_id: str):
+        self._update(job_id, status=JOB_RUNNING)
+    
+    def finish(self, job_id: str, result: ExtractionResponse):
+        # The payload is no longer needed once there is a result
+        self._update(
+            job_id,
+            status=JOB_DONE if result.is_success else JOB_FAILED,
+            result=result.model_dump_json(),
+            error=result.error,
+            document=None
+        )
+    
+    def pending(self) -> List[str]:
+        """Jobs to (re)queue at startup; running ones were interrupted by the restart"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def prune(self, older_than: float) -> int:
+        """Delete finished jobs last updated before the given timestamp"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?", (JOB_DONE, JOB_FAILED, older_than)
+            )
+            self._db.commit()
+        return cursor.rowcount
+    
+    def _update(self, job_id: str, **fields):
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._db.commit()
+    
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class JobQueue:
+    """
+    Submit/poll/result processing for long-running documents
+    A fixed pool of asyncio workers (JOB_WORKERS) bounds documents in flight;
+    the backlog lives in the JobStore, not in open HTTP connections
+    """
+    
+    def __init__(self, process: Callable[[str, str], Awaitable[ExtractionResponse]]):
+        self.process = process
+        self.workers = max(1, int(os.getenv("JOB_WORKERS", 4)))
+        self.retention_seconds = float(os.getenv("JOB_RETENTION", 7 * 24 * 3600))
+        # Only this configured endpoint is ever called back, never a caller-supplied URL
+        self.callback_url = os.getenv("JOB_CALLBACK_URL")
+        self.db_path = os.getenv("JOB_DB_PATH", "data/jobs.sqlite3")
+        self.store: Optional[JobStore] = None
+        
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+    
+    async def start(self):
+        self.store = await asyncio.to_thread(JobStore, self.db_path)
+        self._queue = asyncio.Queue()
+        
+        pruned = await asyncio.to_thread(self.store.prune, time.time() - self.retention_seconds)
+        pending = await asyncio.to_thread(self.store.pending)
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(
+            f"Job queue started: {self.workers} worker(s), {len(pending)} job(s) resumed, {pruned} old job(s) pruned"
+        )
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.store.close()
+        logger.info("Job queue stopped")
+    
+    async def submit(self, document: str, fraud_check: str = "inline") -> str:
+        job_id = await asyncio.to_thread(self.store.create, document, fraud_check)
+        self._queue.put_nowait(job_id)
+        metrics.inc("jobs_submitted_total")
+        logger.info(f"Job {job_id} queued ({self._queue.qsize()} waiting)")
+        return job_id
+    
+    async def get(self, job_id: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+    
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+    
+    async def _worker(self, worker_no: int):
+        while True:
+            job_id = await self._queue.get()
+            set_request_id(job_id)
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} crashed in worker {worker_no}: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+    
+    async def _run(self, job_id: str):
+        payload = await asyncio.to_thread(self.store.get_payload, job_id)
+        if payload is None:
+            logger.warning(f"Job {job_id} has no document, skipping")
+            return
+        document, fraud_check = payload
+        
+        await asyncio.to_thread(self.store.mark_running, job_id)
+        start_time = time.time()
+        logger.info(f"Job {job_id} started")
+        
+        result = await self.process(document, fraud_check)
+        
+        await asyncio.to_thread(self.store.finish, job_id, result)
+        metrics.inc("jobs_completed_total" if result.is_success else "jobs_failed_total")
+        logger.info(f"Job {job_id} finished in {(time.time() - start_time) * 1000:.2f}ms, success={result.is_success}")
+        
+        if self.callback_url:
+            await self._notify(job_id, result)
+    
+    async def _notify(self, job_id: str, result: ExtractionResponse):
+        payload = {
+            "job_id": job_id,
+            "status": JOB_DONE if result.is_success else JOB_FAILED,
+            "result": result.model_dump()
+        }
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.post(self.callback_url, json=payload)
+                response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Callback for job {job_id} failed: {e}")
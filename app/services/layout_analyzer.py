@@ -0,0 +1,170 @@
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from app.utils.logger import logger
+from app.utils.layout import ink_mask, to_gray
+
+REGION_HEADER = "header"
+REGION_TABLE = "table"
+REGION_TOTALS = "totals"
+
+# (y0, y1, [(x0, x1), ...]) of one text line and its horizontal ink segments
+Line = Tuple[int, int, List[Tuple[int, int]]]
+
+class LayoutAnalyzer:
+    """
+    Finds the line-item table and totals block of a page from ink alone (no OCR)
+    - Text lines are bands of the row projection profile
+    - Each line splits into segments (1-D connected components of its column profile,
+      with word gaps closed); table rows are lines with several column segments
+    - The table runs from the first stretch of such lines to the last one, so a bill
+      split into sections (room charges, pharmacy, ...) is OCR'd as one region
+    - The totals block is the lines under the table that end at the table's right edge
+    """
+    
+    # Bumped when the regions found for a page change (part of the OCR cache key)
+    VERSION = 2
+    # Work on a page of about this many pixels on its long side
+    ANALYSIS_SIZE = 1500
+    MIN_TABLE_LINES = 3
+    MIN_COLUMNS = 3
+    # Single-column lines tolerated inside a table (wrapped names, section titles)
+    MAX_TABLE_GAP_LINES = 2
+    HEADER_LINES = 3
+    TOTALS_LINES = 8
+    # Regions covering more than this share of the page aren't worth cropping
+    MAX_COVERAGE = 0.8
+    
+    def find_regions(self, image: np.ndarray) -> List[Dict]:
+        """
+        Regions to OCR in reading order: {"type": header/table/totals, "box": (x0, y0, x1, y1)}
+        in page pixel coordinates; empty when no table is found (OCR the whole page instead)
+        """
+        gray = to_gray(image)
+        step = max(1, max(gray.shape) // self.ANALYSIS_SIZE)
+        ink = ink_mask(gray[::step, ::step])
+        # Ruling lines would join table rows into one tall block; drop them
+        ink[:, ink.mean(axis=0) > 0.25] = False
+        ink[ink.mean(axis=1) > 0.5, :] = False
+        
+        lines, line_height = self._text_lines(ink)
+        if len(lines) < self.MIN_TABLE_LINES:
+            return []
+        
+        table = self._find_table(lines)
+        if table is None:
+            return []
+        first, last = table
+        
+        right_edge = int(np.median([line[2][-1][1] for line in lines[first:last + 1] if len(line[2]) >= self.MIN_COLUMNS]))
+        totals_end = self._find_totals(lines, last, right_edge, line_height)
+        header_start = max(0, first - self.HEADER_LINES)
+        
+        pad = max(2, line_height // 2)
+        height, width = ink.shape
+        boxes = []
+        spans = [(REGION_HEADER, header_start, first - 1), (REGION_TABLE, first, last), (REGION_TOTALS, last + 1, totals_end)]
+        for region_type, start, end in spans:
+            if end < start:
+                continue
+            block = lines[start:end + 1]
+            x0 = min(segments[0][0] for _y0, _y1, segments in block)
+            x1 = max(segments[-1][1] for _y0, _y1, segments in block)
+            boxes.append((
+                region_type,
+                max(0, x0 - pad), max(0, block[0][0] - pad),
+                min(width, x1 + pad), min(height, block[-1][1] + pad)
+            ))
+        
+        covered = sum((x1 - x0) * (y1 - y0) for _t, x0, y0, x1, y1 in boxes)
+        if covered > self.MAX_COVERAGE * height * width:
+            logger.info(f"Regions cover {covered / (height * width):.0%} of the page, OCR'ing it whole")
+            return []
+        
+        regions = [
+            {
+                "type": region_type,
+                "box": (
+                    x0 * step, y0 * step,
+                    min(gray.shape[1], x1 * step), min(gray.shape[0], y1 * step)
+                )
+            }
+            for region_type, x0, y0, x1, y1 in boxes
+        ]
+        logger.info(
+            f"Layout: table on lines {first}-{last} of {len(lines)}, "
+            f"{len(regions)} region(s) covering {covered / (height * width):.0%} of the page"
+        )
+        return regions
+    
+    def _text_lines(self, ink: np.ndarray) -> Tuple[List[Line], int]:
+        """Bands of rows with ink, each split into segments separated by column-sized gaps"""
+        min_pixels = max(2, int(ink.shape[1] * 0.003))
+        starts, ends = self._runs(ink.sum(axis=1) > min_pixels)
+        keep = (ends - starts) >= 3
+        starts, ends = starts[keep], ends[keep]
+        if len(starts) == 0:
+            return [], 1
+        
+        line_height = int(np.median(ends - starts))
+        # Gaps wider than about one line height separate columns; narrower ones are word gaps
+        column_gap = max(4, int(line_height * 1.2))
+        
+        lines: List[Line] = []
+        for y0, y1 in zip(starts, ends):
+            if y1 - y0 > 4 * line_height:
+                # Logos, stamps and photos are taller than any text line
+                continue
+            seg_starts, seg_ends = self._runs(ink[y0:y1].any(axis=0))
+            if len(seg_starts) == 0:
+                continue
+            split = np.flatnonzero(seg_starts[1:] - seg_ends[:-1] > column_gap)
+            group_starts = np.concatenate(([0], split + 1))
+            group_ends = np.concatenate((split, [len(seg_starts) - 1]))
+            segments = [(int(seg_starts[a]), int(seg_ends[b])) for a, b in zip(group_starts, group_ends)]
+            lines.append((int(y0), int(y1), segments))
+        return lines, line_height
+    
+    def _runs(self, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Start (inclusive) and end (exclusive) indexes of the True runs of a 1-D mask"""
+        edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+        return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    
+    def _find_table(self, lines: List[Line]) -> Optional[Tuple[int, int]]:
+        """
+        First line of the first stretch of at least MIN_TABLE_LINES multi-column lines
+        (short single-column interruptions allowed) to the last multi-column line after it
+        Section titles and subtotals between table sections are kept inside the span
+        """
+        first = None
+        start, rows, gap = None, 0, 0
+        for index, (_y0, _y1, segments) in enumerate(lines + [(0, 0, [])]):
+            if len(segments) >= self.MIN_COLUMNS:
+                if start is None:
+                    start, rows = index, 0
+                rows += 1
+                gap = 0
+                continue
+            if start is None:
+                continue
+            gap += 1
+            if gap > self.MAX_TABLE_GAP_LINES or index == len(lines):
+                if rows >= self.MIN_TABLE_LINES:
+                    first = start
+                    break
+                start = None
+        
+        if first is None:
+            return None
+        last = max(index for index, (_y0, _y1, segments) in enumerate(lines) if len(segments) >= self.MIN_COLUMNS)
+        return first, last
+    
+    def _find_totals(self, lines: List[Line], table_end: int, right_edge: int, line_height: int) -> int:
+        """Index of the last line after the table that ends at the table's right edge (table_end if none)"""
+        end = table_end
+        tolerance = 2 * line_height
+        for index in range(table_end + 1, min(len(lines), table_end + 1 + self.TOTALS_LINES)):
+            if lines[index][0] - lines[index - 1][1] > 4 * line_height:
+                break
+            if abs(lines[index][2][-1][1] - right_edge) <= tolerance:
+                end = index
+        return end
@@ -0,0 +1,206 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Dict, Optional, Tuple
+from groq import AsyncGroq, APIConnectionError, APIStatusError, RateLimitError
+from app.models.schemas import TokenUsage
+from app.utils.logger import logger
+from app.utils.metrics import metrics
+
+# Rough prompt size estimate used for TPM accounting before Groq reports real usage
+CHARS_PER_TOKEN = 4
+
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+class TokenBucket:
+    """Continuous-refill bucket holding up to `per_minute` units"""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (requests larger than the bucket wait for a full one)"""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+    
+    def take(self, amount: float):
+        self.tokens -= amount
+    
+    def give_back(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class RateLimiter:
+    """
+    Requests/min and tokens/min limits for the Groq API
+    Callers wait in FIFO order; a 429 pauses everyone for the server's retry-after
+    """
+    
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.waiting = 0
+        self._lock = asyncio.Lock()
+        self._blocked_until = 0.0
+    
+    async def acquire(self, tokens: float) -> float:
+        """Wait for capacity for one request of ~tokens tokens; returns seconds waited"""
+        start = time.monotonic()
+        self.waiting += 1
+        metrics.set("llm_queue_depth", self.waiting)
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    wait = max(
+                        self._blocked_until - now,
+                        self.requests.wait_time(1, now),
+                        self.tokens.wait_time(tokens, now)
+                    )
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                self.requests.take(1)
+                self.tokens.take(tokens)
+        finally:
+            self.waiting -= 1
+            metrics.set("llm_queue_depth", self.waiting)
+        
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            metrics.inc("llm_throttled_total")
+            metrics.inc("llm_wait_seconds_total", waited)
+        return waited
+    
+    def settle(self, estimated: float, actual: float):
+        """Correct the token bucket once real usage is known"""
+        if actual > estimated:
+            self.tokens.take(actual - estimated)
+        else:
+            self.tokens.give_back(estimated - actual)
+    
+    def pause(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+class GroqClient:
+    """
+    Async Groq chat client with rate-limit-aware scheduling
+    - RateLimiter sized by GROQ_RPM / GROQ_TPM
+    - Exponential backoff with full jitter, honoring retry-after on 429/503
+    - Identical in-flight requests share one API call
+    """
+    
+    def __init__(self, api_key: str):
+        # Retries are ours, so the SDK must not retry behind the limiter's back
+        self.client = AsyncGroq(api_key=api_key, max_retries=0)
+        self.limiter = RateLimiter(
+            requests_per_minute=float(os.getenv("GROQ_RPM", 30)),
+            tokens_per_minute=float(os.getenv("GROQ_TPM", 12000))
+        )
+        self._inflight: Dict[str, asyncio.Future] = {}
+    
+    async def complete_json(self, max_retries: int = 3, key: Optional[str] = None, **request) -> Tuple[Dict, TokenUsage]:
+        """
+        Run a JSON-mode chat completion; returns (parsed_json, token_usage)
+        Concurrent calls with the same request (or key) are coalesced
+        """
+        if key is None:
+            key = hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+        
+        future = self._inflight.get(key)
+        coalesced = future is not None
+        if coalesced:
+            metrics.inc("llm_coalesced_total")
+            logger.info("Identical LLM request already in flight, waiting for it")
+        else:
+            future = asyncio.ensure_future(self._complete_with_retries(max_retries, **request))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # shield: one caller giving up must not cancel the call others are waiting on
+        result, token_usage = await asyncio.shield(future)
+        # Every caller gets its own copies; only the caller that made the call is billed for it
+        return copy.deepcopy(result), token_usage.model_copy(update={"reused": coalesced})
+    
+    async def _complete_with_retries(self, max_retries: int, **request) -> Tuple[Dict, TokenUsage]:
+        estimated = self._estimate_tokens(request)
+        
+        for attempt in range(max_retries):
+            await self.limiter.acquire(estimated)
+            metrics.inc("llm_requests_total")
+            logger.info(f"Groq LLM attempt {attempt + 1}/{max_retries}")
+            
+            try:
+                response = await self.client.chat.completions.create(**request)
+            except RateLimitError as e:
+                metrics.inc("llm_rate_limited_total")
+                delay = self._retry_delay(attempt, e)
+                # Everyone backs off, not just this request
+                self.limiter.pause(delay)
+                logger.warning(f"Groq rate limit hit, retrying in {delay:.1f}s")
+                error = e
+            except APIStatusError as e:
+                if e.status_code < 500 and e.status_code not in (408, 409):
+                    # Bad request / auth errors won't fix themselves
+                    logger.error(f"Groq LLM extraction failed: {e}")
+                    raise
+                delay = self._retry_delay(attempt, e)
+                logger.error(f"Groq LLM extraction failed ({e.status_code}): {e}")
+                error = e
+            except APIConnectionError as e:
+                delay = self._retry_delay(attempt)
+                logger.error(f"Groq connection failed: {e}")
+                error = e
+            else:
+                usage = response.usage
+                self.limiter.settle(estimated, usage.total_tokens)
+                token_usage = TokenUsage(
+                    total_tokens=usage.total_tokens,
+                    input_tokens=usage.prompt_tokens,
+                    output_tokens=usage.completion_tokens
+                )
+                try:
+                    result = json.loads(response.choices[0].message.content)
+                    logger.info("Groq LLM extraction successful")
+                    return result, token_usage
+                except json.JSONDecodeError as e:
+                    logger.error(f"JSON parsing failed: {e}")
+                    delay = self._retry_delay(attempt)
+                    error = e
+            
+            if attempt == max_retries - 1:
+                raise error
+            metrics.inc("llm_retries_total")
+            await asyncio.sleep(delay)
+        
+        raise RuntimeError("LLM request was not attempted (max_retries < 1)")
+    
+    def _estimate_tokens(self, request: Dict) -> float:
+        prompt_chars = sum(len(message.get("content", "")) for message in request.get("messages", []))
+        # Completion usually needs far less than max_tokens; settle() corrects the guess
+        return prompt_chars / CHARS_PER_TOKEN + min(request.get("max_tokens", 1000), 1000)
+    
+    def _retry_delay(self, attempt: int, error: Optional[APIStatusError] = None) -> float:
+        """retry-after from the server if given, else full-jitter exponential backoff"""
+        if error is not None and getattr(error, "response", None) is not None:
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                if retry_after is not None:
+                    return min(float(retry_after), BACKOFF_MAX_SECONDS * 4)
+            except ValueError:
+                pass
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
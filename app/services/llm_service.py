@@ -1,14 +1,36 @@
 import os
 import json
-from typing import Dict, List, Tuple
-from groq import Groq
+import hashlib
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
-from app.utils.logger import logger
+from app.utils.logger import logger, log_text
+from app.utils.metrics import metrics
 from app.models.schemas import TokenUsage
+from app.services.cache import TieredCache
+from app.services.llm_client import GroqClient
+from app.services.prompt_compactor import PromptCompactor, CHUNK_OVERLAP_LINES
 import asyncio
 
 load_dotenv()
 
+# Using Llama 3.3 70B - Latest and best model (still free!)
+LLM_MODEL = "llama-3.3-70b-versatile"
+LLM_TEMPERATURE = 0.1
+LLM_MAX_TOKENS = 4000
+
+# Rules shared by every request live in the system prompt; this stays short
+EXTRACTION_PROMPT_TEMPLATE = """Extract all line items from this medical bill/invoice. The OCR text may contain errors, use context to understand correctly.
+Each table row is on its own line with " | " between columns; addresses, contact details and footers were removed.
+
+1. Extract EVERY service, charge, medicine and fee row as a separate line item (ward, lab, pharmacy, consultations, procedures)
+2. Keep items that lack quantity or rate - the amount is mandatory
+3. Amounts are the numbers with decimal points or currency symbols, usually the last column
+
+OCR TEXT (may contain errors):
+{ocr_text}
+
+Return valid JSON only."""
+
 class LLMService:
     def __init__(self):
         api_key = os.getenv("GROQ_API_KEY")
@@ -16,66 +38,154 @@ class LLMService:
             logger.warning("GROQ_API_KEY not set. LLM extraction will fail.")
             raise ValueError("GROQ_API_KEY is required. Get free API key from https://console.groq.com/")
         
-        self.client = Groq(api_key=api_key)
+        self.client = GroqClient(api_key)
+        self.model = LLM_MODEL
+        self.cache = TieredCache.from_env("llm", default_size=1024)
+        self.compactor = PromptCompactor()
         logger.info("Groq LLM Service initialized (FREE & FAST!)")
     
     async def extract_invoice_data(self, ocr_data: Dict, max_retries: int = 3) -> Tuple[Dict, TokenUsage]:
         """
         Use Groq (Llama 3.3) to extract structured invoice data with retry logic
+        Text over the prompt budget is split into row-aligned chunks extracted concurrently
+        and merged page by page
         Returns tuple of (extracted_data, token_usage)
         """
         logger.info("Extracting structured data using Groq LLM...")
         
-        for attempt in range(max_retries):
-            try:
-                prompt = self._build_extraction_prompt(ocr_data["text"])
-                
-                logger.info(f"Groq LLM attempt {attempt + 1}/{max_retries}")
-                
-                # Using Llama 3.3 70B - Latest and best model (still free!)
-                response = self.client.chat.completions.create(
-                    model="llama-3.3-70b-versatile",
-                    messages=[
-                        {"role": "system", "content": self._get_system_prompt()},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    max_tokens=4000,
-                    response_format={"type": "json_object"}
-                )
-                
-                # Capture token usage
-                usage = response.usage
-                token_usage = TokenUsage(
-                    total_tokens=usage.total_tokens,
-                    input_tokens=usage.prompt_tokens,
-                    output_tokens=usage.completion_tokens
-                )
-                
-                result = json.loads(response.choices[0].message.content)
-                logger.info("Groq LLM extraction successful")
-                
-                validated_data = self._validate_and_reconcile(result)
-                return validated_data, token_usage
-            
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing failed: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(1)
-                    continue
-                else:
-                    raise
-            
-            except Exception as e:
-                logger.error(f"Groq LLM extraction failed: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2)
-                    continue
-                else:
-                    raise
+        prompts, compaction = self._build_extraction_prompts(ocr_data)
+        with metrics.stage("llm"):
+            outputs = await asyncio.gather(*(self._complete(prompt, max_retries) for prompt in prompts))
+        
+        if len(outputs) == 1:
+            result, token_usage = outputs[0]
+        else:
+            logger.info(f"Merging {len(outputs)} chunk extractions")
+            result = self._merge_chunks([chunk_result for chunk_result, _ in outputs])
+            token_usage = TokenUsage(
+                total_tokens=sum(usage.total_tokens for _, usage in outputs),
+                input_tokens=sum(usage.input_tokens for _, usage in outputs),
+                output_tokens=sum(usage.output_tokens for _, usage in outputs),
+                reused=all(usage.reused for _, usage in outputs)
+            )
+        
+        token_usage.tokens_saved = compaction["tokens_saved"]
+        
+        with metrics.stage("validate"):
+            validated_data = self._validate_and_reconcile(result)
+        return validated_data, token_usage
+    
+    async def _complete(self, prompt: str, max_retries: int) -> Tuple[Dict, TokenUsage]:
+        """
+        One extraction call; the raw LLM output is cached by prompt hash, so re-running
+        documents after a validation/reconciliation change doesn't call Groq again
+        """
+        messages = [
+            {"role": "system", "content": self._get_system_prompt()},
+            {"role": "user", "content": prompt}
+        ]
+        cache_key = self._cache_key(messages)
+        
+        cached = await asyncio.to_thread(self.cache.get, cache_key)
+        if cached is not None:
+            logger.info("LLM cache hit, skipping Groq call")
+            return cached["result"], TokenUsage(**{**cached["token_usage"], "reused": True})
         
-        # Should not reach here due to raise
-        return {}, TokenUsage(total_tokens=0, input_tokens=0, output_tokens=0)
+        result, token_usage = await self.client.complete_json(
+            max_retries=max_retries,
+            key=cache_key,
+            model=self.model,
+            messages=messages,
+            temperature=LLM_TEMPERATURE,
+            max_tokens=LLM_MAX_TOKENS,
+            response_format={"type": "json_object"}
+        )
+        await asyncio.to_thread(
+            self.cache.set, cache_key, {"result": result, "token_usage": token_usage.model_dump()}
+        )
+        self._record_spend(token_usage)
+        return result, token_usage
+    
+    def _record_spend(self, token_usage: TokenUsage):
+        """Billed tokens, counted per call so cached and coalesced replies aren't counted twice"""
+        if token_usage.reused:
+            metrics.inc("llm_reused_tokens_total", token_usage.total_tokens)
+            return
+        metrics.inc("llm_input_tokens_total", token_usage.input_tokens)
+        metrics.inc("llm_output_tokens_total", token_usage.output_tokens)
+    
+    def _merge_chunks(self, results: List[Dict]) -> Dict:
+        """
+        Combine per-chunk extractions page by page, in chunk order
+        A chunk that continues a page repeats the boundary row, so its leading items
+        that match the page's trailing items are dropped
+        """
+        merged_pages: Dict[str, Dict] = {}
+        for result in results:
+            for index, page in enumerate(result.get("pagewise_line_items") or []):
+                page_no = str(page.get("page_no", "1"))
+                items = page.get("bill_items") or []
+                merged = merged_pages.get(page_no)
+                if merged is None:
+                    merged = merged_pages[page_no] = {"page_no": page_no, "bill_items": []}
+                elif index == 0:
+                    items = self._drop_boundary_duplicates(merged["bill_items"], items)
+                if page.get("page_type") and "page_type" not in merged:
+                    merged["page_type"] = page["page_type"]
+                merged["bill_items"].extend(items)
+        return {"pagewise_line_items": list(merged_pages.values())}
+    
+    def _drop_boundary_duplicates(self, previous: List[Dict], items: List[Dict]) -> List[Dict]:
+        """
+        Leading items that repeat one of the previous chunk's last items (same amount,
+        same or cut-off name); only the CHUNK_OVERLAP_LINES rows a split chunk repeats
+        are compared, so genuinely repeated charges further in are kept
+        """
+        tail = previous[-CHUNK_OVERLAP_LINES:]
+        kept = []
+        for position, item in enumerate(items):
+            match = None
+            if position < CHUNK_OVERLAP_LINES:
+                match = next((prev for prev in tail if self._same_item(prev, item)), None)
+            if match is None:
+                kept.append(item)
+                continue
+            # The repeated row is complete in one of the chunks; keep the longer name
+            if len(str(item.get("item_name") or "")) > len(str(match.get("item_name") or "")):
+                match["item_name"] = item["item_name"]
+            logger.info(f"Dropped item repeated across chunk boundary: {item.get('item_name')}")
+        return kept
+    
+    def _same_item(self, a: Dict, b: Dict) -> bool:
+        amount_a, amount_b = self._as_float(a.get("item_amount")), self._as_float(b.get("item_amount"))
+        if amount_a is None or amount_b is None or abs(amount_a - amount_b) > 0.01:
+            return False
+        name_a = " ".join(str(a.get("item_name") or "").lower().split())
+        name_b = " ".join(str(b.get("item_name") or "").lower().split())
+        return name_a.startswith(name_b) or name_b.startswith(name_a)
+    
+    def _as_float(self, value) -> Optional[float]:
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            return None
+    
+    def _cache_key(self, messages: List[Dict]) -> str:
+        """Hash of model settings plus the exact system and user prompts"""
+        payload = json.dumps(
+            {"model": self.model, "temperature": LLM_TEMPERATURE, "max_tokens": LLM_MAX_TOKENS, "messages": messages},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+    
+    def cache_signature(self) -> str:
+        """Model settings and prompts that affect the extraction"""
+        return "\n".join([
+            f"model={self.model};temperature={LLM_TEMPERATURE};max_tokens={LLM_MAX_TOKENS}",
+            f"prompt_token_budget={self.compactor.token_budget};max_chunks={self.compactor.max_chunks}",
+            self._get_system_prompt(),
+            EXTRACTION_PROMPT_TEMPLATE
+        ])
     
     def _get_system_prompt(self) -> str:
         return """You are an expert at extracting structured data from medical bills, invoices, and receipts.
@@ -94,7 +204,7 @@ CRITICAL RULES:
    - "Final Bill": If it's a summary page or main invoice page.
    - "Bill Detail": If it's a detailed breakdown page.
 5. item_amount MUST ALWAYS be a valid number (float), never null or string.
-6. Group items by page number (use "1" for single page documents).
+6. Group items by page number (use "1" for single page documents). Multi-page text is split by "--- Page N ---" markers; put each item under the page_no N it appears on.
 
 Return ONLY valid JSON with this exact structure:
 {
@@ -117,11 +227,16 @@ Return ONLY valid JSON with this exact structure:
 }
 
 REMEMBER: item_amount must ALWAYS be a number, never null!"""
-    
-    def _build_extraction_prompt(self, ocr_text: str) -> str:
-        # Log the OCR text for debugging
+
+    def _build_extraction_prompts(self, ocr_data: Dict) -> Tuple[List[str], Dict]:
+        """
+        User prompts with the OCR text compacted to PROMPT_TOKEN_BUDGET per chunk
+        Returns (prompts, compaction_stats)
+        """
+        ocr_text = ocr_data.get("text", "")
+        
         logger.info(f"OCR text length: {len(ocr_text)} characters")
-        logger.info(f"OCR text preview (first 500 chars):\n{ocr_text[:500]}")
+        log_text("OCR text sent to the LLM", ocr_text, limit=500)
         
         # Check if text is too garbled
         readable_ratio = sum(c.isalnum() or c.isspace() for c in ocr_text[:500]) / max(len(ocr_text[:500]), 1)
@@ -130,22 +245,8 @@ REMEMBER: item_amount must ALWAYS be a number, never null!"""
         if readable_ratio < 0.5:
             logger.warning("⚠️  OCR text appears heavily garbled (less than 50% readable characters)")
         
-        return f"""Extract all line items from this medical bill/invoice. The OCR text may contain errors, use context to understand correctly.
-
-IMPORTANT INSTRUCTIONS:
-1. Look for ALL services, charges, medicines, and fees listed in the bill
-2. Extract the service name and amount even if quantity/rate is missing
-3. Common sections to check: Ward charges, Lab charges, Pharmacy, Consultations, Procedures
-4. If you see a table, extract EVERY row as a separate line item
-5. Don't skip items just because they lack quantity or rate - the amount is mandatory
-6. Look for number patterns that indicate amounts (with decimal points or currency symbols)
-7. CRITICAL: item_amount must ALWAYS be a valid number (like 1500.00, 500, 2500.50) NEVER null or text
-8. Determine the page_type based on content (Pharmacy, Final Bill, or Bill Detail)
-
-OCR TEXT (may contain errors):
-{ocr_text[:6000]}
-
-Extract EVERY line item you can identify. Return valid JSON only."""
+        chunks, stats = self.compactor.compact_chunks(ocr_data)
+        return [EXTRACTION_PROMPT_TEMPLATE.format(ocr_text=chunk) for chunk in chunks], stats
     
     def _validate_and_reconcile(self, data: Dict) -> Dict:
         """Validate extraction and ensure amounts reconcile"""
@@ -159,7 +260,7 @@ Extract EVERY line item you can identify. Return valid JSON only."""
             # Ensure page_type exists
             if "page_type" not in page:
                 page["page_type"] = "Bill Detail" # Default
-                
+            
             valid_items = []
             
             for item in page.get("bill_items", []):
@@ -0,0 +1,189 @@
+import os
+import shlex
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import pytesseract
+from PIL import Image
+from app.utils.logger import logger
+
+# Warm in-process Tesseract engines (pip install tesserocr)
+try:
+    from tesserocr import PyTessBaseAPI, RIL, iterate_level
+    HAS_TESSEROCR = True
+except ImportError:
+    HAS_TESSEROCR = False
+
+# Tesseract calls allowed to run at once. The executor replaces this with one semaphore
+# shared by all CPU worker processes, so the limit holds for the whole server
+_slots = threading.BoundedSemaphore(max(1, int(os.getenv("TESSERACT_SLOTS", os.cpu_count() or 1))))
+
+def set_tesseract_slots(semaphore):
+    """Install the shared limit (the CPU pool's worker initializer)"""
+    global _slots
+    _slots = semaphore
+
+def tesseract_slot():
+    """Context manager held for the duration of one Tesseract call"""
+    return _slots
+
+def parse_config(config: str) -> Tuple[int, str, List[str]]:
+    """(psm, lang, other args) of a Tesseract command-line config string"""
+    psm, lang, rest = 3, "eng", []
+    args = shlex.split(config)
+    i = 0
+    while i < len(args):
+        if args[i] == "--psm" and i + 1 < len(args):
+            psm = int(args[i + 1])
+            i += 2
+        elif args[i] == "-l" and i + 1 < len(args):
+            lang = args[i + 1]
+            i += 2
+        else:
+            rest.append(args[i])
+            i += 1
+    return psm, lang, rest
+
+class OCRBackend(ABC):
+    """Runs Tesseract on an in-memory image; results use pytesseract's image_to_data DICT layout"""
+    
+    name = "base"
+    
+    @abstractmethod
+    def image_to_data(self, image: np.ndarray, config: str) -> Dict[str, list]:
+        ...
+
+class PytesseractBackend(OCRBackend):
+    """One tesseract process per call (temp image file, traineddata loaded every time)"""
+    
+    name = "pytesseract"
+    
+    def image_to_data(self, image: np.ndarray, config: str) -> Dict[str, list]:
+        return pytesseract.image_to_data(image, config=config, output_type=pytesseract.Output.DICT)
+
+class EnginePool:
+    """Idle Tesseract engines of one tessdata directory, per language"""
+    
+    def __init__(self, tessdata: Optional[str]):
+        self.tessdata = tessdata
+        self._lock = threading.Lock()
+        self._idle: Dict[str, List["PyTessBaseAPI"]] = {}
+        self._unavailable: Dict[str, str] = {}
+    
+    @contextmanager
+    def engine(self, lang: str) -> Iterator["PyTessBaseAPI"]:
+        with self._lock:
+            if lang in self._unavailable:
+                raise RuntimeError(self._unavailable[lang])
+            idle = self._idle.setdefault(lang, [])
+            engine = idle.pop() if idle else None
+        
+        if engine is None:
+            kwargs = {"lang": lang}
+            if self.tessdata:
+                kwargs["path"] = self.tessdata
+            try:
+                engine = PyTessBaseAPI(**kwargs)
+            except RuntimeError as e:
+                # Missing traineddata won't appear later; fail fast like the binary would
+                with self._lock:
+                    self._unavailable[lang] = f"Tesseract engine for '{lang}' failed to start: {e}"
+                raise RuntimeError(self._unavailable[lang]) from e
+            logger.info(f"Started Tesseract engine for '{lang}'")
+        
+        try:
+            yield engine
+        finally:
+            engine.Clear()
+            with self._lock:
+                self._idle[lang].append(engine)
+
+# Engine pools of this process by tessdata directory. The OCR service is pickled into
+# the worker processes with every task, so engines must not live on the backend
+# object or they would be reloaded for every document
+_POOLS: Dict[Optional[str], EnginePool] = {}
+_POOLS_LOCK = threading.Lock()
+
+def engine_pool(tessdata: Optional[str]) -> EnginePool:
+    with _POOLS_LOCK:
+        pool = _POOLS.get(tessdata)
+        if pool is None:
+            pool = _POOLS[tessdata] = EnginePool(tessdata)
+        return pool
+
+class TesserocrBackend(OCRBackend):
+    """
+    Long-lived Tesseract engines via the C API, pooled per process and language
+    Traineddata is loaded once per engine and images are passed in memory;
+    an engine serves one call at a time and is reused by whichever thread comes next
+    """
+    
+    name = "tesserocr"
+    
+    def __init__(self):
+        self.tessdata = os.getenv("TESSDATA_PREFIX")
+        self._pool = engine_pool(self.tessdata)
+    
+    def __getstate__(self):
+        # Engines can't cross process boundaries; each worker process warms its own
+        return {"tessdata": self.tessdata}
+    
+    def __setstate__(self, state):
+        # Attach to the worker's pool, whose engines outlive this copy of the backend
+        self.tessdata = state["tessdata"]
+        self._pool = engine_pool(self.tessdata)
+    
+    def image_to_data(self, image: np.ndarray, config: str) -> Dict[str, list]:
+        psm, lang, extra = parse_config(config)
+        if extra:
+            logger.warning(f"tesserocr backend ignores Tesseract options {extra}")
+        
+        with self._pool.engine(lang) as engine:
+            engine.SetPageSegMode(psm)
+            engine.SetImage(Image.fromarray(image))
+            engine.Recognize()
+            
+            data = {key: [] for key in ("block_num", "par_num", "line_num", "word_num",
+                                       "left", "top", "width", "height", "conf", "text")}
+            block = par = line = word = 0
+            iterator = engine.GetIterator()
+            for result in iterate_level(iterator, RIL.WORD):
+                if result.IsAtBeginningOf(RIL.BLOCK):
+                    block, par, line, word = block + 1, 0, 0, 0
+                if result.IsAtBeginningOf(RIL.PARA):
+                    par, line, word = par + 1, 0, 0
+                if result.IsAtBeginningOf(RIL.TEXTLINE):
+                    line, word = line + 1, 0
+                word += 1
+                
+                box = result.BoundingBox(RIL.WORD)
+                if box is None:
+                    continue
+                x0, y0, x1, y1 = box
+                data["block_num"].append(block)
+                data["par_num"].append(par)
+                data["line_num"].append(line)
+                data["word_num"].append(word)
+                data["left"].append(x0)
+                data["top"].append(y0)
+                data["width"].append(x1 - x0)
+                data["height"].append(y1 - y0)
+                data["conf"].append(int(result.Confidence(RIL.WORD)))
+                data["text"].append(result.GetUTF8Text(RIL.WORD) or "")
+            
+            return data
+
+def create_backend(name: str = None) -> OCRBackend:
+    """
+    Backend from OCR_BACKEND: "tesserocr", "pytesseract", or "auto"
+    (tesserocr when installed, else pytesseract)
+    """
+    name = (name or os.getenv("OCR_BACKEND", "auto")).lower()
+    if name in ("auto", "tesserocr"):
+        if HAS_TESSEROCR:
+            return TesserocrBackend()
+        if name == "tesserocr":
+            logger.warning("OCR_BACKEND=tesserocr but tesserocr is not installed, using pytesseract")
+    return PytesseractBackend()
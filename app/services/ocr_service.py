@@ -1,8 +1,17 @@
 import pytesseract
-from typing import Dict, List
-from app.utils.logger import logger
+from typing import Dict, List, Union
+from app.utils.logger import logger, log_text
+from app.utils.document_io import spill_to_disk
+from app.services.ocr_backend import create_backend, tesseract_slot
+from app.services.pdf_text import PDFTextLayer
+from app.services.layout_analyzer import LayoutAnalyzer, REGION_HEADER, REGION_TABLE, REGION_TOTALS
+from app.services.duplicate_index import perceptual_hashes
 import os
 import platform
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Try to import cv2, fallback to PIL if not available
 try:
@@ -17,12 +26,45 @@ except ImportError:
 
 # PDF support
 try:
-    from pdf2image import convert_from_path
+    from pdf2image import convert_from_path, pdfinfo_from_path
     HAS_PDF2IMAGE = True
 except ImportError:
     HAS_PDF2IMAGE = False
     logger.warning("pdf2image not available, PDF support disabled")
 
+# Single pass that produces both text and word boxes
+PRIMARY_CONFIG = '--psm 3 -l eng+hin'  # English + Hindi
+
+# Only run when the primary pass scores below OCR_MIN_QUALITY (or fails,
+# e.g. when the Hindi traineddata isn't installed)
+FALLBACK_CONFIGS = [
+    '--psm 6 -l eng+hin',  # Uniform block with multilingual
+    '--psm 4 -l eng',      # Single column English
+    '--psm 3',             # Default
+]
+
+# Page segmentation per region type when only the regions of interest are OCR'd:
+# tables and headers as uniform blocks, the totals block as a single column
+REGION_CONFIGS = {
+    REGION_HEADER: '--psm 6 -l eng+hin',
+    REGION_TABLE: '--psm 6 -l eng+hin',
+    REGION_TOTALS: '--psm 4 -l eng+hin',
+}
+
+PDF_DPI = 300
+# Per-page DPI: narrow pages (receipts) get more, huge pages less, so the
+# rendered long side stays under PDF_MAX_PAGE_SIDE pixels
+PDF_SMALL_PAGE_DPI = 400
+PDF_MIN_DPI = 150
+PDF_MAX_PAGE_SIDE = 4200  # legal size at 300 DPI
+SMALL_PAGE_INCHES = 4.0
+# Enough for the 32x32 perceptual hash of a first page read from the text layer
+PDF_HASH_DPI = 36
+PAGE_SIZE_KEY_RE = re.compile(r"^Page\s+(\d+)\s+size$")
+PAGE_SIZE_RE = re.compile(r"([\d.]+)\s*x\s*([\d.]+)\s*pts")
+MIN_GOOD_CHARS = 100
+READABLE_PUNCTUATION = set(".,:;/-()%&#'\"₹$@*+=")
+
 class OCRService:
     def __init__(self):
         logger.info("Initializing OCR Service...")
@@ -45,6 +87,52 @@ class OCRService:
                 logger.warning("Using fallback OCR (Pillow only)")
         else:
             logger.warning("Running on Vercel - Tesseract not available, using fallback OCR")
+        
+        # Number of PDF pages (or image regions) OCR'd concurrently per document; the
+        # Tesseract calls themselves are bounded server-wide by TESSERACT_SLOTS
+        self.page_workers = max(1, int(os.getenv("OCR_PAGE_WORKERS", os.cpu_count() or 1)))
+        if self.page_workers > 1:
+            # Keep Tesseract single-threaded so parallel pages don't oversubscribe the cores
+            os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+        
+        # Rendered pages held in memory at once (rasterized, queued or being OCR'd)
+        self.pages_in_flight = max(1, int(os.getenv("OCR_PAGES_IN_FLIGHT", self.page_workers + 1)))
+        
+        # Below this quality score (0-1) a fallback Tesseract config is tried
+        self.min_quality = float(os.getenv("OCR_MIN_QUALITY", 0.5))
+        
+        # OCR only the header/table/totals regions found by layout analysis
+        self.roi_enabled = os.getenv("OCR_ROI", "true").lower() in ("1", "true", "yes")
+        self.layout = LayoutAnalyzer()
+        
+        # Born-digital PDF pages are read from their text layer instead of OCR'd
+        self.text_layer = PDFTextLayer()
+        
+        # Pytesseract subprocesses, or warm in-process engines when tesserocr is installed
+        self.backend = create_backend()
+        logger.info(f"OCR backend: {self.backend.name}")
+        
+        # Remembered so pickled copies running in worker processes use the same binary
+        self.tesseract_cmd = pytesseract.pytesseract.tesseract_cmd
+    
+    def cache_signature(self) -> str:
+        """OCR settings that affect the extracted text"""
+        roi = (
+            f"v{self.layout.VERSION}|" + "|".join(f"{name}:{config}" for name, config in REGION_CONFIGS.items())
+            if self.roi_enabled else "off"
+        )
+        return (
+            f"primary={PRIMARY_CONFIG};fallbacks={'|'.join(FALLBACK_CONFIGS)};min_quality={self.min_quality};"
+            f"dpi={PDF_DPI},{PDF_SMALL_PAGE_DPI},{PDF_MIN_DPI},{PDF_MAX_PAGE_SIDE};gray_pdf=1;"
+            f"roi={roi};backend={self.backend.name};text_layer={self.text_layer.enabled}"
+        )
+    
+    def __setstate__(self, state):
+        """Restore in a worker process, re-applying the Tesseract location found at startup"""
+        self.__dict__.update(state)
+        pytesseract.pytesseract.tesseract_cmd = self.tesseract_cmd
+        if self.page_workers > 1:
+            os.environ.setdefault("OMP_THREAD_LIMIT", "1")
     
     def _setup_tesseract_windows(self):
         """Auto-detect Tesseract installation on Windows"""
@@ -63,111 +151,401 @@ class OCRService:
         
         logger.warning("Tesseract not found in common Windows locations")
     
-    def extract_text(self, image_path: str) -> Dict[str, any]:
+    def extract_text(self, image_path: Union[str, bytes, np.ndarray]) -> Dict[str, any]:
         """
         Extract text using Tesseract OCR or fallback
+        Takes an already decoded page array, raw PDF bytes, or a path to an image/PDF file
+        PDFs are OCR'd page by page, see _extract_pdf
         """
+        if isinstance(image_path, np.ndarray):
+            logger.info(f"Extracting text from in-memory image {image_path.shape}")
+            return self._combine_pages([self._ocr_image(image_path)])
+        
+        if isinstance(image_path, (bytes, bytearray)):
+            # pdf2image needs a path: the only place the pipeline touches disk
+            with spill_to_disk(image_path, suffix=".pdf") as pdf_path:
+                return self.extract_text(pdf_path)
+        
         logger.info(f"Extracting text from: {image_path}")
         
         try:
-            # Read image
             if image_path.lower().endswith('.pdf'):
-                if not HAS_PDF2IMAGE:
-                    raise RuntimeError("PDF support not available. Install: pip install pdf2image")
-                logger.info("Converting PDF to image...")
-                images = convert_from_path(image_path, dpi=300)
-                image = np.array(images[0])
+                return self._extract_pdf(image_path)
+            
+            # Read image
+            if HAS_CV2:
+                image = cv2.imread(image_path)
+                if image is None:
+                    raise ValueError(f"Failed to load image: {image_path}")
             else:
-                if HAS_CV2:
-                    image = cv2.imread(image_path)
-                    if image is None:
-                        raise ValueError(f"Failed to load image: {image_path}")
-                else:
-                    # Use PIL
-                    pil_image = Image.open(image_path)
-                    # Convert RGBA to RGB if needed
-                    if pil_image.mode == 'RGBA':
-                        background = Image.new('RGB', pil_image.size, (255, 255, 255))
-                        background.paste(pil_image, mask=pil_image.split()[3])
-                        pil_image = background
-                    image = np.array(pil_image)
+                # Use PIL
+                pil_image = Image.open(image_path)
+                # Convert RGBA to RGB if needed
+                if pil_image.mode == 'RGBA':
+                    background = Image.new('RGB', pil_image.size, (255, 255, 255))
+                    background.paste(pil_image, mask=pil_image.split()[3])
+                    pil_image = background
+                image = np.array(pil_image)
             
             logger.info(f"Image loaded successfully")
             
-            # Try Tesseract if available
+            page = self._ocr_image(image)
+            return self._combine_pages([page])
+        
+        except Exception as e:
+            logger.error(f"OCR extraction failed: {str(e)}", exc_info=True)
+            raise
+    
+    def _extract_pdf(self, pdf_path: str) -> Dict[str, any]:
+        """
+        Text of every page of a PDF: from the embedded text layer where it is usable,
+        otherwise rasterized (first_page/last_page, one page at a time) and OCR'd
+        image_hashes holds the (pHash, dHash) of the first page, for near-duplicate lookup
+        """
+        if not HAS_PDF2IMAGE:
+            raise RuntimeError("PDF support not available. Install: pip install pdf2image")
+        
+        page_count = int(pdfinfo_from_path(pdf_path)["Pages"])
+        page_dpis = self._page_dpis(pdf_path, page_count)
+        pages = self.text_layer.extract(pdf_path, page_count, page_dpis, PDF_DPI)
+        
+        to_ocr = [page_no for page_no in range(1, page_count + 1) if page_no not in pages]
+        logger.info(
+            f"PDF has {page_count} page(s), {len(to_ocr)} to OCR with {self.page_workers} worker(s), "
+            f"{self.pages_in_flight} page(s) in flight"
+        )
+        
+        if len(to_ocr) == 1:
+            page_no = to_ocr[0]
+            dpi = page_dpis.get(page_no, PDF_DPI)
+            pages[page_no] = self._ocr_pdf_page(self._rasterize_page(pdf_path, page_no, dpi), page_no, dpi)
+        elif to_ocr:
+            pages.update(self._ocr_pdf_pages(pdf_path, to_ocr, page_dpis))
+        
+        image_hashes = pages[1].pop("image_hashes", None) if page_count else None
+        if image_hashes is None and page_count:
             try:
-                import pytesseract
-                logger.info("Running Tesseract OCR with multiple PSM modes...")
-                
-                # Try different page segmentation modes for better results
-                configs = [
-                    '--psm 3 -l eng+hin',  # English + Hindi
-                    '--psm 6 -l eng+hin',  # Uniform block with multilingual
-                    '--psm 4 -l eng',      # Single column English
-                    '--psm 3',             # Default
-                    '',                    # No special config
-                ]
-                
-                texts = []
-                for config in configs:
-                    try:
-                        if config:
-                            text = pytesseract.image_to_string(image, config=config)
-                        else:
-                            text = pytesseract.image_to_string(image)
-                        texts.append(text)
-                        logger.info(f"OCR with {config if config else 'default'}: {len(text)} chars")
-                        # If we got good text, stop trying
-                        if len(text.strip()) > 100:
-                            logger.info(f"Got good OCR result, stopping")
-                            break
-                    except Exception as e:
-                        logger.warning(f"OCR with config '{config}' failed: {e}")
-                
-                # Use the longest result (usually most complete)
-                tesseract_text = max(texts, key=len) if texts else ""
-                
+                image_hashes = list(perceptual_hashes(self._rasterize_page(pdf_path, 1, PDF_HASH_DPI)))
             except Exception as e:
-                logger.warning(f"Tesseract OCR failed, using fallback: {e}")
-                # Fallback: return basic image info for LLM
-                tesseract_text = f"[Image: {image.shape[1]}x{image.shape[0]} pixels]\n"
-                tesseract_text += "Note: OCR unavailable, please deploy on platform with Tesseract support for full functionality."
+                logger.warning(f"Could not hash the first PDF page: {e}")
+        
+        result = self._combine_pages([pages[page_no] for page_no in range(1, page_count + 1)])
+        result["image_hashes"] = image_hashes
+        return result
+    
+    def _ocr_pdf_pages(self, pdf_path: str, page_nos: List[int], page_dpis: Dict[int, int]) -> Dict[int, Dict]:
+        """
+        Rasterize pages one at a time while earlier pages are OCR'd;
+        at most pages_in_flight rendered pages exist at any moment
+        """
+        in_flight = threading.BoundedSemaphore(self.pages_in_flight)
+        
+        def ocr_and_release(image: np.ndarray, page_no: int, dpi: int) -> Dict[str, any]:
+            try:
+                return self._ocr_pdf_page(image, page_no, dpi)
+            finally:
+                in_flight.release()
+        
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.page_workers) as pool:
+            for page_no in page_nos:
+                # Blocks while pages_in_flight pages are rendered but not yet OCR'd
+                in_flight.acquire()
+                if any(future.done() and future.exception() for future in futures.values()):
+                    in_flight.release()
+                    break
+                dpi = page_dpis.get(page_no, PDF_DPI)
+                try:
+                    image = self._rasterize_page(pdf_path, page_no, dpi)
+                except Exception:
+                    in_flight.release()
+                    raise
+                futures[page_no] = pool.submit(ocr_and_release, image, page_no, dpi)
+                del image
+            return {page_no: future.result() for page_no, future in futures.items()}
+    
+    def _page_dpis(self, pdf_path: str, page_count: int) -> Dict[int, int]:
+        """Rendering DPI per page from its physical size (pdfinfo page sizes in points)"""
+        try:
+            info = pdfinfo_from_path(pdf_path, first_page=1, last_page=page_count)
+        except Exception as e:
+            logger.warning(f"Could not read PDF page sizes, using {PDF_DPI} DPI: {e}")
+            return {}
+        
+        dpis = {}
+        for key, value in info.items():
+            key_match = PAGE_SIZE_KEY_RE.match(key)
+            size_match = PAGE_SIZE_RE.search(str(value))
+            if key_match and size_match:
+                width, height = float(size_match.group(1)), float(size_match.group(2))
+                dpis[int(key_match.group(1))] = self._page_dpi(width / 72, height / 72)
+        return dpis
+    
+    def _page_dpi(self, width_inches: float, height_inches: float) -> int:
+        short_side, long_side = sorted((width_inches, height_inches))
+        if short_side <= 0:
+            return PDF_DPI
+        dpi = PDF_SMALL_PAGE_DPI if short_side < SMALL_PAGE_INCHES else PDF_DPI
+        dpi = min(dpi, PDF_MAX_PAGE_SIDE / long_side)
+        return int(max(PDF_MIN_DPI, dpi))
+    
+    def _rasterize_page(self, pdf_path: str, page_no: int, dpi: int) -> np.ndarray:
+        """Render one PDF page as a grayscale array (a third of the memory of RGB)"""
+        logger.info(f"Converting PDF page {page_no} to image at {dpi} DPI...")
+        images = convert_from_path(pdf_path, dpi=dpi, first_page=page_no, last_page=page_no, grayscale=True)
+        if not images:
+            raise ValueError(f"Failed to rasterize page {page_no} of {pdf_path}")
+        image = np.array(images[0])
+        del images
+        return image
+    
+    def _ocr_pdf_page(self, image: np.ndarray, page_no: int, dpi: int) -> Dict[str, any]:
+        page = self._ocr_image(image)
+        page["ocr_stats"]["dpi"] = dpi
+        if page_no == 1:
+            # Hashed while the rendered page is in memory anyway
+            page["image_hashes"] = list(perceptual_hashes(image))
+        return page
+    
+    def _combine_pages(self, pages: List[Dict]) -> Dict[str, any]:
+        """Merge per-page OCR results; page texts are separated by page markers"""
+        for page_no, page in enumerate(pages, start=1):
+            page["page_no"] = str(page_no)
+        
+        if len(pages) == 1:
+            text = pages[0]["text"]
+        else:
+            text = "\n\n".join(f"--- Page {page['page_no']} ---\n{page['text']}" for page in pages)
+        
+        bounding_boxes = [box for page in pages for box in page["bounding_boxes"]]
+        
+        page_stats = [page.get("ocr_stats", {}) for page in pages]
+        ocr_stats = {
+            "pages": len(pages),
+            "passes": sum(stats.get("passes", 0) for stats in page_stats),
+            "fallbacks": sum(stats.get("fallbacks", 0) for stats in page_stats),
+            "pages_with_fallback": sum(1 for stats in page_stats if stats.get("fallbacks", 0) > 0),
+            "tesseract_seconds": round(sum(stats.get("tesseract_seconds", 0.0) for stats in page_stats), 4),
+            "roi_pages": sum(1 for stats in page_stats if stats.get("roi")),
+            "pixels": sum(stats.get("pixels", 0) for stats in page_stats),
+            "text_layer_pages": sum(1 for stats in page_stats if stats.get("text_layer"))
+        }
+        
+        logger.info(f"Extracted {len(text)} characters from {len(pages)} page(s)")
+        
+        return {
+            "text": text,
+            "bounding_boxes": bounding_boxes,
+            "raw_tesseract": text,
+            "pages": pages,
+            "page_count": len(pages),
+            "ocr_stats": ocr_stats
+        }
+    
+    def _ocr_image(self, image: np.ndarray) -> Dict[str, any]:
+        """
+        Run OCR on a single decoded page image
+        One image_to_data pass yields both the text and the word boxes; fallback
+        configs only run when that pass scores below min_quality
+        """
+        page_start = time.perf_counter()
+        best = None
+        passes = 0
+        tesseract_seconds = 0.0
+        # Tesseract time per config, for the per-config latency histograms
+        config_seconds: Dict[str, float] = {}
+        pixels = 0
+        
+        if self.roi_enabled:
+            regions = self.layout.find_regions(image)
+            if regions:
+                roi_page = self._ocr_regions(image, regions)
+                if roi_page["ocr_stats"]["quality"] >= self.min_quality:
+                    roi_page["ocr_stats"]["seconds"] = round(time.perf_counter() - page_start, 4)
+                    return roi_page
+                logger.info(
+                    f"Region OCR quality {roi_page['ocr_stats']['quality']:.2f} below {self.min_quality:.2f}, "
+                    f"OCR'ing the full page"
+                )
+                passes += roi_page["ocr_stats"]["passes"]
+                tesseract_seconds += roi_page["ocr_stats"]["tesseract_seconds"]
+                pixels += roi_page["ocr_stats"]["pixels"]
+                config_seconds.update(roi_page["ocr_stats"]["config_seconds"])
+        
+        logger.info(f"Running Tesseract OCR ({PRIMARY_CONFIG})...")
+        full_page_passes = 0
+        
+        for config in [PRIMARY_CONFIG] + FALLBACK_CONFIGS:
+            if best is not None and best["quality"] >= self.min_quality:
+                break
+            if full_page_passes > 0:
+                logger.info(f"OCR quality {best['quality'] if best else 0:.2f} below {self.min_quality:.2f}, trying fallback '{config}'")
             
-            # Log extracted text for debugging
-            logger.info(f"Best OCR result: {len(tesseract_text)} characters")
-            logger.info(f"OCR Text Preview (first 1000 chars):\n{tesseract_text[:1000]}")
-            if len(tesseract_text) > 1000:
-                logger.info(f"OCR Text Preview (last 500 chars):\n{tesseract_text[-500:]}")
+            passes += 1
+            full_page_passes += 1
+            pixels += image.shape[0] * image.shape[1]
+            with tesseract_slot():
+                pass_start = time.perf_counter()
+                try:
+                    data = self.backend.image_to_data(image, config)
+                except Exception as e:
+                    logger.warning(f"OCR with config '{config}' failed: {e}")
+                    continue
+                finally:
+                    pass_seconds = time.perf_counter() - pass_start
+                    tesseract_seconds += pass_seconds
+                    config_seconds[config] = round(config_seconds.get(config, 0.0) + pass_seconds, 4)
             
-            # Check if we got meaningful text
-            if len(tesseract_text.strip()) < 50:
-                logger.warning("OCR extracted very little text - image quality may be poor or Tesseract unavailable")
+            result = self._parse_tesseract_data(data)
+            result["config"] = config
+            logger.info(f"OCR with {config}: {len(result['text'])} chars, quality {result['quality']:.2f}")
             
-            # Also get data with bounding boxes for better structure (if Tesseract available)
-            try:
-                import pytesseract
-                data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-                bounding_boxes = self._extract_bounding_boxes(data)
-            except Exception as e:
-                logger.warning(f"Failed to extract bounding boxes: {e}")
-                bounding_boxes = []
+            if best is None or result["quality"] > best["quality"]:
+                best = result
+        
+        if best is None:
+            logger.warning("All Tesseract passes failed")
+            best = {"text": "", "bounding_boxes": [], "quality": 0.0, "config": None}
+        
+        tesseract_text = best["text"]
+        
+        logger.info(f"Best OCR result: {len(tesseract_text)} characters")
+        log_text("OCR text", tesseract_text, limit=1500)
+        
+        # Check if we got meaningful text
+        if len(tesseract_text.strip()) < 50:
+            logger.warning("OCR extracted very little text - image quality may be poor or Tesseract unavailable")
+        
+        return {
+            "text": tesseract_text,
+            "bounding_boxes": best["bounding_boxes"],
+            "ocr_stats": {
+                "passes": passes,
+                "fallbacks": passes - 1,
+                "config": best["config"],
+                "quality": round(best["quality"], 3),
+                "tesseract_seconds": round(tesseract_seconds, 4),
+                "config_seconds": config_seconds,
+                "seconds": round(time.perf_counter() - page_start, 4),
+                "roi": False,
+                "pixels": pixels
+            }
+        }
+    
+    def _ocr_regions(self, image: np.ndarray, regions: List[Dict]) -> Dict[str, any]:
+        """
+        OCR each region crop in parallel with its own page segmentation mode
+        Word boxes are shifted back to page coordinates; text follows region order
+        """
+        def ocr_region(region: Dict) -> Dict:
+            x0, y0, x1, y1 = region["box"]
+            crop = image[y0:y1, x0:x1]
+            config = REGION_CONFIGS[region["type"]]
+            with tesseract_slot():
+                start = time.perf_counter()
+                try:
+                    data = self.backend.image_to_data(crop, config)
+                except Exception as e:
+                    logger.warning(f"OCR of {region['type']} region with '{config}' failed: {e}")
+                    data = {}
+                seconds = time.perf_counter() - start
+            result = self._parse_tesseract_data(data)
+            result["seconds"] = seconds
+            result["config"] = config
+            result["pixels"] = crop.shape[0] * crop.shape[1]
+            result["bounding_boxes"] = [
+                [[[x + x0, y + y0] for x, y in coords], text, conf]
+                for coords, text, conf in result["bounding_boxes"]
+            ]
+            return result
+        
+        logger.info(f"Running Tesseract OCR on {len(regions)} region(s): {', '.join(r['type'] for r in regions)}")
+        with ThreadPoolExecutor(max_workers=min(len(regions), self.page_workers)) as pool:
+            results = list(pool.map(ocr_region, regions))
+        
+        text = "\n\n".join(result["text"] for result in results if result["text"])
+        # Scored as one page, so a short totals block doesn't drag the quality down
+        quality = self._quality_score(text, [conf for result in results for conf in result["confidences"]])
+        logger.info(f"Region OCR: {len(text)} chars, quality {quality:.2f}")
+        
+        return {
+            "text": text,
+            "bounding_boxes": [box for result in results for box in result["bounding_boxes"]],
+            "ocr_stats": {
+                "passes": len(results),
+                "fallbacks": 0,
+                "config": "roi",
+                "quality": round(quality, 3),
+                # Regions run concurrently; this is the summed Tesseract time, like the page totals
+                "tesseract_seconds": round(sum(result["seconds"] for result in results), 4),
+                "config_seconds": {
+                    result["config"]: round(sum(r["seconds"] for r in results if r["config"] == result["config"]), 4)
+                    for result in results
+                },
+                "roi": True,
+                "pixels": sum(result["pixels"] for result in results)
+            }
+        }
+    
+    def _parse_tesseract_data(self, data: Dict) -> Dict[str, any]:
+        """
+        Rebuild text from image_to_data word entries and score its quality
+        Words are joined per line, lines per paragraph, and paragraphs/blocks
+        are separated by a blank line, matching image_to_string layout
+        """
+        lines = []
+        current_key = None
+        current_para = None
+        confidences = []
+        
+        for i in range(len(data.get('text', []))):
+            word = str(data['text'][i]).strip()
+            conf = int(data['conf'][i])
+            if not word or conf < 0:
+                continue
             
-            logger.info(f"Extracted {len(tesseract_text)} characters")
+            confidences.append(conf)
+            para = (data['block_num'][i], data['par_num'][i])
+            key = para + (data['line_num'][i],)
             
-            return {
-                "text": tesseract_text,
-                "bounding_boxes": bounding_boxes,
-                "raw_tesseract": tesseract_text
-            }
+            if key != current_key:
+                if current_para is not None and para != current_para:
+                    lines.append("")
+                lines.append(word)
+                current_key = key
+                current_para = para
+            else:
+                lines[-1] += " " + word
         
-        except Exception as e:
-            logger.error(f"OCR extraction failed: {str(e)}", exc_info=True)
-            raise
+        text = "\n".join(lines)
+        
+        return {
+            "text": text,
+            "bounding_boxes": self._extract_bounding_boxes(data),
+            "quality": self._quality_score(text, confidences),
+            "confidences": confidences
+        }
+    
+    def _quality_score(self, text: str, confidences: List[int]) -> float:
+        """
+        Cheap 0-1 OCR quality estimate: mean word confidence x readable-character
+        ratio, scaled down for pages with under MIN_GOOD_CHARS characters
+        """
+        chars = [c for c in text if not c.isspace()]
+        if not chars or not confidences:
+            return 0.0
+        
+        mean_conf = sum(confidences) / len(confidences) / 100
+        readable_ratio = sum(c.isalnum() or c in READABLE_PUNCTUATION for c in chars) / len(chars)
+        length_factor = min(len(chars) / MIN_GOOD_CHARS, 1.0)
+        
+        return mean_conf * readable_ratio * length_factor
     
     def _extract_bounding_boxes(self, data: Dict) -> List:
         """Extract bounding boxes from Tesseract data output"""
         bounding_boxes = []
-        n_boxes = len(data['text'])
+        # Empty when the Tesseract call failed
+        n_boxes = len(data.get('text', []))
         
         for i in range(n_boxes):
             if int(data['conf'][i]) > 30:  # Only confident detections
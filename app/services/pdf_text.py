@@ -0,0 +1,99 @@
+import os
+import subprocess
+import unicodedata
+import xml.etree.ElementTree as ET
+from typing import Dict, List
+from app.utils.logger import logger
+from app.utils.layout import group_rows
+
+XHTML_NS = "{http://www.w3.org/1999/xhtml}"
+
+# A page needs this many words, mostly readable, before its text layer replaces OCR
+MIN_PAGE_WORDS = 10
+MIN_READABLE_RATIO = 0.6
+READABLE_PUNCTUATION = set(".,:;/-()%&#'\"₹$@*+=")
+
+class PDFTextLayer:
+    """
+    Reads the embedded text of born-digital PDFs with poppler's `pdftotext -bbox`
+    Returns pages in the OCR page structure (text, word boxes), so scanned pages
+    and pages with broken font encodings can still go through Tesseract
+    """
+    
+    def __init__(self):
+        self.enabled = os.getenv("PDF_TEXT_LAYER", "true").lower() in ("1", "true", "yes")
+        self.timeout = float(os.getenv("PDF_TEXT_TIMEOUT", 30))
+    
+    def extract(self, pdf_path: str, page_count: int, page_dpis: Dict[int, int], default_dpi: int) -> Dict[int, Dict]:
+        """
+        Usable text-layer pages by page number; word boxes are scaled to the pixel
+        coordinates the page would have had when rasterized for OCR
+        """
+        if not self.enabled:
+            return {}
+        
+        try:
+            completed = subprocess.run(
+                ["pdftotext", "-bbox", "-f", "1", "-l", str(page_count), pdf_path, "-"],
+                capture_output=True,
+                timeout=self.timeout,
+                check=True
+            )
+            root = ET.fromstring(completed.stdout)
+        except FileNotFoundError:
+            logger.warning("pdftotext not found (install poppler-utils), OCR'ing every PDF page")
+            return {}
+        except (subprocess.SubprocessError, ET.ParseError) as e:
+            logger.warning(f"Could not read PDF text layer: {e}")
+            return {}
+        
+        pages = {}
+        for page_no, page in enumerate(root.iter(f"{XHTML_NS}page"), start=1):
+            scale = page_dpis.get(page_no, default_dpi) / 72
+            boxes = []
+            for word in page.iter(f"{XHTML_NS}word"):
+                text = (word.text or "").strip()
+                if not text:
+                    continue
+                x0, y0 = round(float(word.get("xMin")) * scale), round(float(word.get("yMin")) * scale)
+                x1, y1 = round(float(word.get("xMax")) * scale), round(float(word.get("yMax")) * scale)
+                # Same [[corners], text, confidence] shape as the Tesseract boxes
+                boxes.append([[[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text, 1.0])
+            
+            if not self._usable(boxes):
+                continue
+            
+            pages[page_no] = {
+                "text": self._text(boxes),
+                "bounding_boxes": boxes,
+                "ocr_stats": {
+                    "passes": 0,
+                    "fallbacks": 0,
+                    "config": "text_layer",
+                    "quality": 1.0,
+                    "tesseract_seconds": 0.0,
+                    "roi": False,
+                    "pixels": 0,
+                    "text_layer": True
+                }
+            }
+        
+        logger.info(f"PDF text layer usable on {len(pages)} of {page_count} page(s)")
+        return pages
+    
+    def _usable(self, boxes: List) -> bool:
+        """Enough words, and not the private-use/CID garbage of fonts without a Unicode map"""
+        if len(boxes) < MIN_PAGE_WORDS:
+            return False
+        chars = "".join(box[1] for box in boxes)
+        # Letters, digits and combining marks (Devanagari vowel signs) count, private-use glyphs don't
+        readable = sum(
+            c.isalnum() or c in READABLE_PUNCTUATION or unicodedata.category(c).startswith("M")
+            for c in chars
+        )
+        return readable / max(len(chars), 1) >= MIN_READABLE_RATIO
+    
+    def _text(self, boxes: List) -> str:
+        """Words in visual reading order, one text line per row"""
+        rows, _line_height = group_rows(boxes)
+        return "\n".join(" ".join(word[4] for word in row) for row in rows)
@@ -1,62 +1,222 @@
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+from PIL import Image
 import numpy as np
+from typing import Optional, Tuple
 from app.utils.logger import logger
+from app.utils.layout import ink_mask
+import io
 import os
 
+# Tesseract reads best when a text line is roughly this many pixels tall
+TARGET_TEXT_HEIGHT = 32
+# Resolution the text-height estimate falls back to (same as PDF rasterization)
+TARGET_DPI = 300
+
+def _env_flag(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes")
+
 class DocumentPreprocessor:
-    def preprocess(self, image_path: str) -> str:
+    """
+    In-memory preprocessing on NumPy arrays
+    - Scale chosen from the estimated text line height (or DPI), not a fixed size
+    - Contrast stretch and sharpening as vectorized array ops
+    - Optional border cropping, deskew and adaptive thresholding
+    """
+    
+    # Part of the pipeline cache key; change these and cached results are invalidated
+    CONTRAST = 1.5
+    # Scales this close to 1 aren't worth a resample
+    SCALE_DEAD_BAND = (0.8, 1.25)
+    MIN_SCALE = 0.5
+    MAX_SCALE = 4.0
+    # Deskew search range/step in degrees
+    MAX_SKEW = 5.0
+    SKEW_STEP = 0.25
+    
+    def __init__(self):
+        self.text_height = float(os.getenv("PREPROCESS_TEXT_HEIGHT", TARGET_TEXT_HEIGHT))
+        self.crop_borders = _env_flag("PREPROCESS_CROP_BORDERS")
+        self.deskew = _env_flag("PREPROCESS_DESKEW")
+        self.threshold = _env_flag("PREPROCESS_THRESHOLD")
+    
+    def cache_signature(self) -> str:
+        """Parameters that affect the preprocessed image"""
+        return (
+            f"text_height={self.text_height};contrast={self.CONTRAST};sharpen=1;"
+            f"scale={self.SCALE_DEAD_BAND},{self.MIN_SCALE},{self.MAX_SCALE};"
+            f"crop={self.crop_borders};deskew={self.deskew},{self.MAX_SKEW},{self.SKEW_STEP};"
+            f"threshold={self.threshold}"
+        )
+    
+    def preprocess(self, image, rotation: int = 0, text_height: Optional[float] = None) -> np.ndarray:
         """
-        Preprocess image for better OCR accuracy using PIL
-        GENTLER preprocessing to avoid losing text
+        Preprocess image for better OCR accuracy
+        GENTLE by default: scale, contrast and sharpen, no binarization unless enabled
+        Accepts raw document bytes, a PIL image or an array; the bytes are decoded
+        here once and the grayscale result is returned in memory for OCR/fraud
+        rotation (degrees counter-clockwise, multiple of 90) and text_height come from triage
         """
-        logger.info(f"Preprocessing image: {image_path}")
+        img = self.load_image(image)
+        gray = np.asarray(img.convert('L'))
+        logger.info(f"Preprocessing image: {img.size}, mode: {img.mode}")
+        if rotation % 360:
+            gray = np.ascontiguousarray(np.rot90(gray, rotation // 90))
+            logger.info(f"Rotated by {rotation} degrees")
         
         try:
-            # Load image
-            img = Image.open(image_path)
-            original_size = img.size
-            logger.info(f"Original image size: {img.size}, mode: {img.mode}")
-            
-            # Convert RGBA to RGB first if needed
-            if img.mode == 'RGBA':
-                # Create white background
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
-                img = background
-                logger.info("Converted RGBA to RGB")
+            pixels = gray
+            if self.crop_borders:
+                pixels = self._crop_borders(pixels)
             
-            # Resize if too small (upscale for better OCR)
-            min_dimension = 2000
-            if min(img.size) < min_dimension:
-                ratio = min_dimension / min(img.size)
-                new_size = tuple(int(dim * ratio) for dim in img.size)
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-                logger.info(f"Upscaled from {original_size} to {img.size}")
+            if self.deskew:
+                angle = self._estimate_skew(pixels)
+                if abs(angle) >= self.SKEW_STEP:
+                    pixels = np.asarray(
+                        Image.fromarray(pixels).rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=255)
+                    )
+                    logger.info(f"Deskewed by {angle:.2f} degrees")
             
-            # Convert to grayscale
-            img = img.convert('L')
-            logger.info("Converted to grayscale")
+            scale = self._choose_scale(pixels, img.info.get("dpi"), text_height or self.text_height)
+            if not self.SCALE_DEAD_BAND[0] <= scale <= self.SCALE_DEAD_BAND[1]:
+                new_size = (max(1, round(pixels.shape[1] * scale)), max(1, round(pixels.shape[0] * scale)))
+                resample = Image.Resampling.LANCZOS if scale > 1 else Image.Resampling.BOX
+                pixels = np.asarray(Image.fromarray(pixels).resize(new_size, resample))
+                logger.info(f"Scaled by {scale:.2f} to {new_size}")
             
-            # GENTLE contrast enhancement (not too aggressive)
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(1.5)  # Reduced from 2.5
-            logger.info("Enhanced contrast gently")
+            pixels = self._sharpen(self._stretch_contrast(pixels))
             
-            # GENTLE sharpening (just once)
-            img = img.filter(ImageFilter.SHARPEN)
-            logger.info("Applied sharpening")
+            if self.threshold:
+                pixels = self._adaptive_threshold(pixels)
             
-            # Save WITHOUT aggressive binarization
-            base_name = os.path.splitext(image_path)[0]
-            ext = os.path.splitext(image_path)[1]
-            preprocessed_path = f"{base_name}_preprocessed{ext}"
-            
-            img.save(preprocessed_path)
-            logger.info(f"Preprocessed image saved: {preprocessed_path}")
-            
-            return preprocessed_path
+            return pixels
         
         except Exception as e:
             logger.error(f"Preprocessing failed: {str(e)}", exc_info=True)
             logger.warning("Falling back to original image")
-            return image_path
+            return gray
+    
+    def _choose_scale(self, gray: np.ndarray, dpi: Optional[Tuple[float, float]], text_height: float) -> float:
+        """Scale that brings text lines to text_height; DPI, then 1.0, when no lines are found"""
+        line_height = self._estimate_text_height(gray)
+        if line_height is not None:
+            scale = text_height / line_height
+            logger.info(f"Estimated text line height {line_height:.1f}px")
+        elif dpi and dpi[0] and dpi[0] > 1:
+            scale = TARGET_DPI / float(dpi[0]) * text_height / self.text_height
+            logger.info(f"No text lines found, scaling from {dpi[0]:.0f} DPI")
+        else:
+            scale = 1.0
+        return min(max(scale, self.MIN_SCALE), self.MAX_SCALE)
+    
+    def _estimate_text_height(self, gray: np.ndarray) -> Optional[float]:
+        """Median height of the horizontal ink bands (text lines) in the row projection profile"""
+        ink = ink_mask(gray)
+        min_pixels = max(3, int(gray.shape[1] * 0.005))
+        has_ink = (ink.sum(axis=1) > min_pixels).astype(np.int8)
+        
+        edges = np.diff(np.concatenate(([0], has_ink, [0])))
+        heights = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+        # Drop specks and figures/logos
+        heights = heights[(heights >= 4) & (heights <= gray.shape[0] * 0.1)]
+        if len(heights) < 3:
+            return None
+        return float(np.median(heights))
+    
+    def _crop_borders(self, gray: np.ndarray) -> np.ndarray:
+        """Trim blank margins and solid scanner edges, keeping a small margin around the content"""
+        ink = ink_mask(gray)
+        row_ink = ink.mean(axis=1)
+        col_ink = ink.mean(axis=0)
+        # Rows/columns that are nearly all dark are scanner or table-edge borders, not text
+        rows = np.flatnonzero((row_ink > 0.002) & (row_ink < 0.8))
+        cols = np.flatnonzero((col_ink > 0.002) & (col_ink < 0.8))
+        if len(rows) == 0 or len(cols) == 0:
+            return gray
+        
+        margin = max(10, int(min(gray.shape) * 0.01))
+        top, bottom = max(int(rows[0]) - margin, 0), min(int(rows[-1]) + margin + 1, gray.shape[0])
+        left, right = max(int(cols[0]) - margin, 0), min(int(cols[-1]) + margin + 1, gray.shape[1])
+        if (bottom - top) * (right - left) < 0.95 * gray.size:
+            logger.info(f"Cropped borders to {(right - left, bottom - top)}")
+        return gray[top:bottom, left:right]
+    
+    def _estimate_skew(self, gray: np.ndarray) -> float:
+        """Angle whose row projection of ink pixels is sharpest (highest variance)"""
+        # A ~1000px image is plenty to measure the angle
+        step = max(1, max(gray.shape) // 1000)
+        ink = ink_mask(gray[::step, ::step])
+        ys, xs = np.nonzero(ink)
+        if len(ys) < 100:
+            return 0.0
+        
+        angles = np.arange(-self.MAX_SKEW, self.MAX_SKEW + self.SKEW_STEP / 2, self.SKEW_STEP)
+        height = ink.shape[0]
+        pad = int(np.ceil(ink.shape[1] * np.tan(np.radians(self.MAX_SKEW)))) + 1
+        scores = np.empty(len(angles))
+        for i, angle in enumerate(angles):
+            shifted = np.round(ys + xs * np.tan(np.radians(angle))).astype(np.int64) + pad
+            scores[i] = np.bincount(shifted, minlength=height + 2 * pad).var()
+        # Rotating by the angle that aligns the rows levels the text
+        return float(-angles[int(np.argmax(scores))])
+    
+    def _stretch_contrast(self, gray: np.ndarray) -> np.ndarray:
+        """Same blend as PIL's ImageEnhance.Contrast: pull pixels away from the mean"""
+        mean = gray.mean()
+        out = (gray.astype(np.float32) - mean) * self.CONTRAST + mean
+        return np.clip(out, 0, 255).astype(np.uint8)
+    
+    def _sharpen(self, gray: np.ndarray) -> np.ndarray:
+        """PIL's SHARPEN kernel (32 center, -2 around, /16) as shifted-slice sums"""
+        if gray.shape[0] < 3 or gray.shape[1] < 3:
+            return gray
+        padded = np.pad(gray.astype(np.int32), 1, mode="edge")
+        height, width = gray.shape
+        window = np.zeros((height, width), dtype=np.int32)
+        for dy in range(3):
+            for dx in range(3):
+                window += padded[dy:dy + height, dx:dx + width]
+        center = gray.astype(np.int32)
+        out = (34 * center - 2 * window + 8) // 16
+        return np.clip(out, 0, 255).astype(np.uint8)
+    
+    def _adaptive_threshold(self, gray: np.ndarray) -> np.ndarray:
+        """Binarize against the local mean (integral image), tolerant of uneven lighting and shadows"""
+        window = max(15, (min(gray.shape) // 40) | 1)
+        half = window // 2
+        height, width = gray.shape
+        y0 = np.clip(np.arange(height) - half, 0, height)
+        y1 = np.clip(np.arange(height) + half + 1, 0, height)
+        x0 = np.clip(np.arange(width) - half, 0, width)
+        x1 = np.clip(np.arange(width) + half + 1, 0, width)
+        
+        # Separable box sum: cumulative sums down the columns, then along the rows
+        column_sums = np.pad(gray.astype(np.float32), ((1, 0), (0, 0))).cumsum(axis=0)
+        band = column_sums[y1] - column_sums[y0]
+        row_sums = np.pad(band, ((0, 0), (1, 0))).cumsum(axis=1)
+        sums = row_sums[:, x1] - row_sums[:, x0]
+        local_mean = sums / np.outer(y1 - y0, x1 - x0)
+        # Slightly below the local mean so paper texture stays white
+        return np.where(gray < local_mean - 10, 0, 255).astype(np.uint8)
+    
+    def load_image(self, image) -> Image.Image:
+        """Decode bytes / wrap an array as an RGB or grayscale PIL image"""
+        if isinstance(image, (bytes, bytearray)):
+            img = Image.open(io.BytesIO(image))
+            img.load()
+        elif isinstance(image, np.ndarray):
+            img = Image.fromarray(image)
+        else:
+            img = image
+        
+        # Convert RGBA to RGB first if needed
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            img = img.convert('RGBA')
+            # Create white background
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
+            background.info = img.info
+            img = background
+            logger.info("Converted RGBA to RGB")
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        
+        return img
@@ -0,0 +1,265 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from app.utils.logger import logger
+from app.utils.layout import group_rows
+
+# Same rough estimate the Groq client uses for rate-limit accounting
+CHARS_PER_TOKEN = 4
+
+# Non-table lines kept directly above the first table row (column headers, bill type),
+# plus the page's first line (hospital name) when it is further up
+HEADER_LINES = 3
+
+# Rows repeated at the start of a chunk that splits a page, so an item cut at the boundary is seen whole
+CHUNK_OVERLAP_LINES = 1
+
+AMOUNT_RE = re.compile(r"\d[\d,]*(?:\.\d{1,2})?")
+# Currency markers / punctuation that may follow the amount at the end of a row
+TRAILING_NOISE_RE = re.compile(r"(\s*(\||/-|-|rs\.?|inr|₹|\*))+\s*$", re.IGNORECASE)
+SEPARATOR_RE = re.compile(r"([-=_.*~|#+:])\1{2,}")
+WHITESPACE_RE = re.compile(r"[ \t ]+")
+# Contact details are dropped even though they contain numbers
+CONTACT_RE = re.compile(
+    r"(\b(ph|phone|mob|mobile|tel|fax|email|e-mail|website|www|gstin|gst no|pan no|cin|pincode)\b"
+    r"|@|https?://|\.com\b|\.co\.in\b)",
+    re.IGNORECASE
+)
+# Address and footer lines are dropped unless they carry an amount
+BOILERPLATE_RE = re.compile(
+    r"(\b(road|rd\.|street|nagar|marg|near|opp\.?|sector|district|dist\.)\b"
+    r"|thank you|get well|terms|conditions|signature|authori[sz]ed|computer generated|e\.\s?&\s?o\.\s?e)",
+    re.IGNORECASE
+)
+
+class PromptCompactor:
+    """
+    Shrinks OCR text to what line-item extraction needs, within a token budget
+    - Rebuilds rows from word boxes (column gaps become " | ")
+    - Keeps the table region (first to last row with amounts) plus a short header
+    - Drops addresses, contact details, footers and separator runs
+    - Long documents can be split into row-aligned chunks instead of trimmed
+    """
+    
+    def __init__(self):
+        self.token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", 2500))
+        self.max_chunks = max(1, int(os.getenv("PROMPT_MAX_CHUNKS", 8)))
+    
+    def compact(self, ocr_data: Dict, token_budget: Optional[int] = None) -> Tuple[str, Dict]:
+        """Return (compacted_text, stats); stats holds estimated tokens before/after"""
+        budget = token_budget or self.token_budget
+        pages, lines = self._collect(ocr_data)
+        multi_page = len(pages) > 1
+        
+        lines = self._fit_budget(lines, budget, multi_page, pages)
+        text = self._render(lines, pages, multi_page)
+        return text, self._stats(ocr_data, [text], budget)
+    
+    def compact_chunks(self, ocr_data: Dict, token_budget: Optional[int] = None) -> Tuple[List[str], Dict]:
+        """
+        Return (chunks, stats): the compacted text split into pieces that each fit the budget
+        Splits prefer page boundaries, then fall back to rows; lines are only dropped
+        when more than max_chunks chunks would be needed
+        """
+        budget = token_budget or self.token_budget
+        pages, lines = self._collect(ocr_data)
+        multi_page = len(pages) > 1
+        
+        if self._total_tokens(lines, pages, multi_page) <= budget:
+            chunks = [self._render(lines, pages, multi_page)]
+        else:
+            # Each chunk carries its own page markers, so always render them
+            groups = self._fit_chunks(lines, budget, pages)
+            chunks = [self._render(group, pages, True, present_only=True) for group in groups]
+        return chunks, self._stats(ocr_data, chunks, budget)
+    
+    def _fit_chunks(self, lines: List[Tuple[int, int, str]], budget: int,
+                    pages: List[Dict]) -> List[List[Tuple[int, int, str]]]:
+        """
+        Drop lines until they split into at most max_chunks chunks
+        Page-boundary breaks leave chunks part-empty, so fitting to budget * max_chunks
+        can still need more chunks; the target shrinks by the overflow and lines are re-fit
+        """
+        target = budget * self.max_chunks
+        while True:
+            fitted = self._fit_budget(lines, target, True, pages, warn=False)
+            groups = self._split(fitted, budget, pages)
+            if len(groups) <= self.max_chunks:
+                break
+            overflow = sum(
+                self.estimate_tokens(line + "\n") for group in groups[self.max_chunks:] for _p, _i, line in group
+            )
+            target -= max(1, overflow)
+        self._warn_dropped(lines, fitted, target)
+        return groups
+    
+    def estimate_tokens(self, text: str) -> int:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    
+    def _collect(self, ocr_data: Dict) -> Tuple[List[Dict], List[Tuple[int, int, str]]]:
+        """Pages plus their (priority, page_index, line) entries; lower priority is dropped first"""
+        pages = ocr_data.get("pages") or [
+            {"page_no": "1", "text": ocr_data.get("text", ""), "bounding_boxes": ocr_data.get("bounding_boxes", [])}
+        ]
+        lines: List[Tuple[int, int, str]] = []
+        for page_index, page in enumerate(pages):
+            for priority, line in self._compact_page(page):
+                lines.append((priority, page_index, line))
+        return pages, lines
+    
+    def _stats(self, ocr_data: Dict, chunks: List[str], budget: int) -> Dict:
+        original_tokens = self.estimate_tokens(ocr_data.get("text", ""))
+        compacted_tokens = sum(self.estimate_tokens(chunk) for chunk in chunks)
+        stats = {
+            "original_tokens": original_tokens,
+            "compacted_tokens": compacted_tokens,
+            "tokens_saved": max(0, original_tokens - compacted_tokens)
+        }
+        logger.info(
+            f"Prompt compaction: ~{original_tokens} -> ~{compacted_tokens} tokens in {len(chunks)} chunk(s) "
+            f"(budget {budget}, saved ~{stats['tokens_saved']})"
+        )
+        return stats
+    
+    def _compact_page(self, page: Dict) -> List[Tuple[int, str]]:
+        """Prioritized lines of one page: 3 = amount row, 2 = other table line, 1 = header"""
+        rows = self._rows(page)
+        rows = [self._clean(row) for row in rows]
+        rows = [
+            row for row in rows
+            if row and not CONTACT_RE.search(row)
+            and (self._is_amount_row(row) or not BOILERPLATE_RE.search(row))
+        ]
+        
+        numeric = [i for i, row in enumerate(rows) if self._is_amount_row(row)]
+        if not numeric:
+            # Nothing table-like: keep the page as is and let the budget decide
+            return [(2, row) for row in rows]
+        
+        first, last = numeric[0], numeric[-1]
+        amount_rows = set(numeric)
+        header = rows[max(0, first - HEADER_LINES):first]
+        if first > HEADER_LINES:
+            header.insert(0, rows[0])
+        result = [(1, row) for row in header]
+        for i in range(first, last + 1):
+            result.append((3 if i in amount_rows else 2, rows[i]))
+        return result
+    
+    def _rows(self, page: Dict) -> List[str]:
+        """Rows rebuilt from word boxes when they cover the text, else the OCR text lines"""
+        text = page.get("text", "")
+        boxes = page.get("bounding_boxes") or []
+        text_words = len(text.split())
+        if not boxes or len(boxes) < 0.8 * text_words:
+            return text.splitlines()
+        
+        rows = []
+        grouped, line_height = group_rows(boxes)
+        for row_words in grouped:
+            parts = [row_words[0][4]]
+            for prev, word in zip(row_words, row_words[1:]):
+                gap = word[0] - prev[2]
+                parts.append((" | " if gap > 2 * line_height else " ") + word[4])
+            rows.append("".join(parts))
+        return rows
+    
+    def _clean(self, line: str) -> str:
+        line = SEPARATOR_RE.sub(" ", line)
+        line = WHITESPACE_RE.sub(" ", line)
+        line = re.sub(r"(\s*\|\s*)+", " | ", line)
+        return line.strip(" |")
+    
+    def _is_amount_row(self, row: str) -> bool:
+        """Row ending in an amount-looking number, with an item name or other numbers before it"""
+        tokens = TRAILING_NOISE_RE.sub("", row).split()
+        if len(tokens) < 2 or not AMOUNT_RE.fullmatch(tokens[-1]):
+            return False
+        amount = tokens[-1].replace(",", "")
+        return "." in amount or len(amount) >= 2
+    
+    def _fit_budget(self, lines: List[Tuple[int, int, str]], budget: int, multi_page: bool,
+                    pages: List[Dict], warn: bool = True) -> List[Tuple[int, int, str]]:
+        """Drop lowest-priority lines (bottom-up within a priority) until the estimate fits"""
+        total = self._total_tokens(lines, pages, multi_page)
+        if total <= budget:
+            return lines
+        
+        keep = [True] * len(lines)
+        for priority in (1, 2, 3):
+            for index in range(len(lines) - 1, -1, -1):
+                if total <= budget:
+                    break
+                if lines[index][0] == priority and keep[index]:
+                    keep[index] = False
+                    total -= self.estimate_tokens(lines[index][2] + "\n")
+        
+        fitted = [line for line, kept in zip(lines, keep) if kept]
+        if warn:
+            self._warn_dropped(lines, fitted, budget)
+        return fitted
+    
+    def _warn_dropped(self, lines: List[Tuple[int, int, str]], fitted: List[Tuple[int, int, str]], budget: int):
+        dropped = sum(1 for line in lines if line[0] == 3) - sum(1 for line in fitted if line[0] == 3)
+        if dropped:
+            logger.warning(f"Prompt budget {budget} too small: dropped {dropped} amount row(s)")
+    
+    def _split(self, lines: List[Tuple[int, int, str]], budget: int,
+               pages: List[Dict]) -> List[List[Tuple[int, int, str]]]:
+        """
+        Pack lines into chunks of at most `budget` tokens, in document order
+        A page that fits a chunk but not what is left of the current one starts a new
+        chunk; other splits fall between rows and repeat the boundary row
+        """
+        page_tokens: Dict[int, int] = {}
+        for _p, page_index, line in lines:
+            page_tokens[page_index] = page_tokens.get(page_index, 0) + self.estimate_tokens(line + "\n")
+        
+        chunks: List[List[Tuple[int, int, str]]] = []
+        current: List[Tuple[int, int, str]] = []
+        used = 0
+        for entry in lines:
+            page_index = entry[1]
+            starts_page = not current or current[-1][1] != page_index
+            cost = self.estimate_tokens(entry[2] + "\n")
+            if starts_page:
+                cost += self._marker_tokens(pages, page_index)
+                page_total = page_tokens[page_index] + self._marker_tokens(pages, page_index)
+                if current and used + page_total > budget and page_total <= budget:
+                    chunks.append(current)
+                    current, used = [], 0
+            
+            if current and used + cost > budget:
+                chunks.append(current)
+                current = current[-CHUNK_OVERLAP_LINES:] if not starts_page else []
+                used = sum(self.estimate_tokens(line + "\n") for _p, _i, line in current)
+                if current:
+                    used += self._marker_tokens(pages, page_index)
+            
+            current.append(entry)
+            used += cost
+        
+        if current:
+            chunks.append(current)
+        return chunks
+    
+    def _marker_tokens(self, pages: List[Dict], page_index: int) -> int:
+        return self.estimate_tokens(f"--- Page {pages[page_index].get('page_no', page_index + 1)} ---\n")
+    
+    def _total_tokens(self, lines: List[Tuple[int, int, str]], pages: List[Dict], multi_page: bool) -> int:
+        marker_tokens = sum(self._marker_tokens(pages, i) for i in range(len(pages))) if multi_page else 0
+        return marker_tokens + sum(self.estimate_tokens(line + "\n") for _p, _i, line in lines)
+    
+    def _render(self, lines: List[Tuple[int, int, str]], pages: List[Dict], multi_page: bool,
+                present_only: bool = False) -> str:
+        if not multi_page:
+            return "\n".join(line for _p, _i, line in lines)
+        
+        present = {i for _p, i, _line in lines}
+        out = []
+        for page_index, page in enumerate(pages):
+            if present_only and page_index not in present:
+                continue
+            out.append(f"--- Page {page.get('page_no', page_index + 1)} ---")
+            out.extend(line for _p, i, line in lines if i == page_index)
+        return "\n".join(out)
@@ -0,0 +1,185 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from app.utils.logger import logger
+from app.utils.layout import Word, group_rows
+
+# Same tolerance _validate_and_reconcile uses before it overrides an amount with qty * rate
+AMOUNT_TOLERANCE = 1.0
+
+NUMBER_RE = re.compile(r"(?:rs\.?|inr|₹)?(\d{1,3}(?:,\d{2,3})+|\d+)(\.\d{1,2})?(?:/-)?", re.IGNORECASE)
+TOTAL_RE = re.compile(
+    r"\b(grand total|net total|sub ?total|total amount|net amount|net payable|amount payable|bill amount|total)\b",
+    re.IGNORECASE
+)
+# Rows below the items that are not line items themselves
+SUMMARY_RE = re.compile(
+    r"\b(discount|concession|cgst|sgst|igst|gst|tax|paid|received|advance|deposit|balance|due|round ?off|refund)\b",
+    re.IGNORECASE
+)
+PHARMACY_RE = re.compile(r"\b(pharmacy|medicines?|drugs?|tab|tabs|cap|caps|syp|syrup|inj|mg|ml)\b", re.IGNORECASE)
+FINAL_BILL_RE = re.compile(r"\b(final bill|summary|bill summary|discharge bill)\b", re.IGNORECASE)
+
+# Header words that name a column (punctuation stripped, lowercased)
+AMOUNT_HEADERS = {"amount", "amt", "total", "value", "net"}
+RATE_HEADERS = {"rate", "price", "mrp", "unit"}
+QTY_HEADERS = {"qty", "quantity", "units", "nos"}
+NAME_HEADERS = {"particulars", "description", "item", "items", "service", "services", "medicine", "details", "name"}
+
+class TableExtractor:
+    """
+    Rule-based line item extraction from OCR word boxes, for clean printed tables
+    - Finds the header row and uses its words as qty / rate / amount column anchors
+    - Reads item rows below it, assigning numbers to columns by position
+    - Only answers when every qty * rate matches its amount and the items add up
+      to a printed total; otherwise returns None and the LLM takes over
+    """
+    
+    def __init__(self):
+        self.enabled = os.getenv("TABLE_EXTRACTOR_ENABLED", "true").lower() in ("1", "true", "yes")
+    
+    def cache_signature(self) -> str:
+        return f"table_extractor={self.enabled};tolerance={AMOUNT_TOLERANCE}"
+    
+    def extract(self, ocr_data: Dict) -> Optional[Dict]:
+        """Return data shaped like the LLM output (pagewise_line_items, totals), or None if unsure"""
+        if not self.enabled:
+            return None
+        
+        pagewise = []
+        printed_totals: List[float] = []
+        for index, page in enumerate(ocr_data.get("pages") or []):
+            parsed = self._parse_page(page)
+            if parsed is None:
+                logger.info(f"Table extractor: no verifiable table on page {index + 1}")
+                return None
+            items, totals = parsed
+            printed_totals.extend(totals)
+            pagewise.append({
+                "page_no": str(page.get("page_no", index + 1)),
+                "page_type": self._page_type(page.get("text", ""), items),
+                "bill_items": items
+            })
+        
+        items = [item for page in pagewise for item in page["bill_items"]]
+        if not items:
+            return None
+        
+        total = round(sum(item["item_amount"] for item in items), 2)
+        if not any(abs(total - printed) <= AMOUNT_TOLERANCE for printed in printed_totals):
+            logger.info(f"Table extractor: items sum to {total:.2f}, printed totals {printed_totals}")
+            return None
+        
+        logger.info(f"Table extractor: {len(items)} items reconcile with printed total {total:.2f}")
+        return {
+            "pagewise_line_items": pagewise,
+            "total_item_count": len(items),
+            "reconciled_amount": total
+        }
+    
+    def _parse_page(self, page: Dict) -> Optional[Tuple[List[Dict], List[float]]]:
+        """(items, printed totals) of one page, or None if any row can't be read with confidence"""
+        rows, line_height = group_rows(page.get("bounding_boxes") or [])
+        
+        header_index, columns = self._find_header(rows)
+        if header_index is None:
+            return None
+        name_limit = min(x0 for x0, _x1 in columns.values())
+        
+        items: List[Dict] = []
+        totals: List[float] = []
+        for row in rows[header_index + 1:]:
+            label = " ".join(word[4] for word in row if word[2] <= name_limit)
+            numbers = [(word, self._parse_number(word[4])) for word in row if word[0] >= name_limit - line_height]
+            numbers = [(word, value) for word, value in numbers if value is not None]
+            
+            row_text = " ".join(word[4] for word in row)
+            if TOTAL_RE.search(row_text):
+                if numbers:
+                    totals.append(numbers[-1][1])
+                continue
+            if SUMMARY_RE.search(row_text):
+                continue
+            
+            if not numbers:
+                # Section titles and wrapped names carry no amounts
+                continue
+            
+            cells = self._assign_columns(numbers, columns, line_height)
+            if cells is None or "amount" not in cells:
+                return None
+            
+            name = self._clean_name(label)
+            if not name:
+                return None
+            
+            quantity, rate, amount = cells.get("qty"), cells.get("rate"), cells["amount"]
+            if quantity is not None and rate is not None and abs(quantity * rate - amount) > AMOUNT_TOLERANCE:
+                return None
+            
+            items.append({
+                "item_name": name,
+                "item_amount": amount,
+                "item_rate": rate,
+                "item_quantity": quantity
+            })
+        
+        return items, totals
+    
+    def _find_header(self, rows: List[List[Word]]) -> Tuple[Optional[int], Dict[str, Tuple[float, float]]]:
+        """Index of the first row naming an amount column plus another known column, and its column spans"""
+        for index, row in enumerate(rows):
+            columns: Dict[str, Tuple[float, float]] = {}
+            has_name = False
+            for word in row:
+                key = re.sub(r"[^a-z]", "", word[4].lower())
+                if key in AMOUNT_HEADERS:
+                    # The rightmost amount-like word wins ("Total Amount", "Net Amt")
+                    columns["amount"] = (word[0], word[2])
+                elif key in RATE_HEADERS:
+                    columns.setdefault("rate", (word[0], word[2]))
+                elif key in QTY_HEADERS:
+                    columns.setdefault("qty", (word[0], word[2]))
+                elif key in NAME_HEADERS:
+                    has_name = True
+            if "amount" in columns and (has_name or len(columns) > 1):
+                return index, columns
+        return None, {}
+    
+    def _assign_columns(self, numbers: List[Tuple[Word, float]], columns: Dict[str, Tuple[float, float]],
+                        line_height: float) -> Optional[Dict[str, float]]:
+        """Map each number to the header column its center is nearest to; None on a clash or stray number"""
+        cells: Dict[str, float] = {}
+        for word, value in numbers:
+            center = (word[0] + word[2]) / 2
+            best, best_distance = None, None
+            for column, (x0, x1) in columns.items():
+                distance = abs(center - (x0 + x1) / 2)
+                if best_distance is None or distance < best_distance:
+                    best, best_distance = column, distance
+            
+            x0, x1 = columns[best]
+            reach = max(x1 - x0, word[2] - word[0]) + 2 * line_height
+            if best_distance > reach or best in cells:
+                return None
+            cells[best] = value
+        return cells
+    
+    def _parse_number(self, text: str) -> Optional[float]:
+        match = NUMBER_RE.fullmatch(text.strip())
+        if match is None:
+            return None
+        return float(match.group(1).replace(",", "") + (match.group(2) or ""))
+    
+    def _clean_name(self, label: str) -> str:
+        # Leading serial numbers ("1", "12.", "3)") are not part of the name
+        name = re.sub(r"^\s*\d+[.)]?\s+", "", label).strip(" |:-")
+        return name if re.search(r"[A-Za-z]{2,}", name) else ""
+    
+    def _page_type(self, text: str, items: List[Dict]) -> str:
+        if FINAL_BILL_RE.search(text):
+            return "Final Bill"
+        medicines = sum(1 for item in items if PHARMACY_RE.search(item["item_name"]))
+        if re.search(r"\bpharmacy\b", text, re.IGNORECASE) or (items and medicines * 2 > len(items)):
+            return "Pharmacy"
+        return "Bill Detail"
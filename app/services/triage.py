@@ -0,0 +1,242 @@
+import os
+import time
+from typing import Dict, Optional, Tuple
+import numpy as np
+from PIL import Image
+from app.services.preprocessor import DocumentPreprocessor
+from app.utils.logger import logger
+
+ROUTE_REJECT = "reject"
+ROUTE_ROTATE = "rotate"
+ROUTE_LOW_RES = "low_res"
+ROUTE_FULL = "full"
+
+class DocumentTriage:
+    """
+    Cheap checks on a downscaled thumbnail that decide how (and whether) an
+    image upload is OCR'd, before any full-resolution work
+    - reject: blank page, no text lines (a photo, not a document), or too blurry to read
+    - rotate: text runs sideways or upside down; the page is turned before preprocessing
+    - low_res: sharp, clean page; OCR'd at a smaller text height (fewer pixels for Tesseract)
+    - full: everything else, the normal pipeline
+    """
+    
+    # Long side of the thumbnail all statistics are computed on
+    THUMB_SIDE = 1024
+    # Ink is this much darker than the paper (90th percentile gray)
+    INK_CONTRAST = 40
+    # Below this share of ink pixels the page is blank
+    MIN_INK_RATIO = 0.002
+    # Rows/columns with less paper than this are the desk around a photographed page
+    MIN_PAPER_SHARE = 0.25
+    # Fewer text line bands than this and it isn't a document
+    MIN_TEXT_LINES = 3
+    # Line bands taller than this share of the page are figures/photos, not text
+    MAX_LINE_SHARE = 0.08
+    # Gaps up to this many pixels are closed when measuring ink runs: letter spacing, not line spacing
+    RUN_GAP = 4
+    # Closed ink runs along text lines are this many times longer than across them; a page
+    # where neither direction wins by that much isn't turned
+    ORIENTATION_RATIO = 1.5
+    # Ascender/descender balance below which text counts as upside down
+    UPSIDE_DOWN_ASYMMETRY = -0.2
+    # Skew (degrees) searched for when straightening line profiles, so a page photographed
+    # a few degrees off still has separate lines and visible ascenders
+    MAX_SKEW = 6
+    SKEW_STEP = 0.5
+    
+    def __init__(self):
+        self.enabled = os.getenv("TRIAGE_ENABLED", "true").lower() in ("1", "true", "yes")
+        # Laplacian variance (contrast-normalized) below which a page is too blurry to OCR
+        self.min_sharpness = float(os.getenv("TRIAGE_MIN_SHARPNESS", 0.01))
+        # Sharpness from which a page takes the low-res route (0 disables it)
+        self.low_res_sharpness = float(os.getenv("TRIAGE_LOW_RES_SHARPNESS", 2.0))
+        self.low_res_text_height = float(os.getenv("TRIAGE_LOW_RES_TEXT_HEIGHT", 24))
+    
+    def cache_signature(self) -> str:
+        """Settings that change which route (and so which OCR input) a document gets"""
+        if not self.enabled:
+            return "triage=off"
+        return (
+            f"triage=v1;thumb={self.THUMB_SIDE};ink={self.INK_CONTRAST},{self.MIN_INK_RATIO},{self.MIN_PAPER_SHARE};"
+            f"lines={self.MIN_TEXT_LINES},{self.MAX_LINE_SHARE};runs={self.RUN_GAP},{self.ORIENTATION_RATIO};"
+            f"flip={self.UPSIDE_DOWN_ASYMMETRY};skew={self.MAX_SKEW},{self.SKEW_STEP};sharpness={self.min_sharpness},{self.low_res_sharpness};"
+            f"low_res_height={self.low_res_text_height}"
+        )
+    
+    def triage_and_preprocess(self, preprocessor: DocumentPreprocessor,
+                              data: bytes) -> Tuple[Dict, Optional[np.ndarray]]:
+        """
+        Decode once, triage, then preprocess along the chosen route
+        Returns (verdict, preprocessed page); the page is None when rejected
+        """
+        img = preprocessor.load_image(data)
+        verdict = self.assess(img)
+        if verdict["route"] == ROUTE_REJECT:
+            return verdict, None
+        text_height = self.low_res_text_height if verdict["route"] == ROUTE_LOW_RES else None
+        return verdict, preprocessor.preprocess(img, rotation=verdict["rotation"], text_height=text_height)
+    
+    def assess(self, img: Image.Image) -> Dict:
+        """
+        Route plus the measurements behind it:
+        {"route", "reason", "rotation" (degrees counter-clockwise), "ink_ratio", "run_ratio",
+        "text_lines", "sharpness", "seconds"}
+        """
+        start = time.perf_counter()
+        thumb = img.convert("L")
+        thumb.thumbnail((self.THUMB_SIDE, self.THUMB_SIDE), Image.Resampling.BOX)
+        gray = np.asarray(thumb, dtype=np.int16)
+        
+        paper = np.percentile(gray, 90)
+        gray = self._crop_to_paper(gray, paper)
+        ink = gray < paper - self.INK_CONTRAST
+        ink_ratio = float(ink.mean()) if ink.size else 0.0
+        verdict = {
+            "route": ROUTE_FULL,
+            "reason": None,
+            "rotation": 0,
+            "ink_ratio": round(ink_ratio, 4),
+            "run_ratio": 0.0,
+            "text_lines": 0,
+            "sharpness": 0.0
+        }
+        
+        if ink.size < thumb.width * thumb.height * 0.1:
+            return self._finish(verdict, start, ROUTE_REJECT, "no paper background, not a document")
+        if ink_ratio < self.MIN_INK_RATIO:
+            return self._finish(verdict, start, ROUTE_REJECT, "blank page")
+        
+        # Letters close up into words along a text line but not across lines, whatever the
+        # layout; projections would mistake a table's column gaps for line gaps
+        strokes = self._strokes(ink)
+        run_ratio = self._closed_run_length(strokes) / max(self._closed_run_length(strokes.T), 1e-6)
+        verdict["run_ratio"] = round(run_ratio, 3)
+        sideways = run_ratio < 1 / self.ORIENTATION_RATIO
+        oriented = sideways or run_ratio > self.ORIENTATION_RATIO
+        upright_ink = np.rot90(strokes) if sideways else strokes
+        profile = self._deskewed_profile(upright_ink)
+        lines = self._line_bands(profile, upright_ink.shape[1])
+        verdict["text_lines"] = len(lines)
+        if len(lines) < self.MIN_TEXT_LINES:
+            return self._finish(verdict, start, ROUTE_REJECT, "no text lines found")
+        
+        sharpness = self._sharpness(gray, paper, ink)
+        verdict["sharpness"] = round(sharpness, 4)
+        if sharpness < self.min_sharpness:
+            return self._finish(verdict, start, ROUTE_REJECT, "too blurry to read")
+        
+        if not oriented:
+            # Left as is, and on the full route: OCR's fallback passes cope better than a wrong turn
+            return self._finish(verdict, start, ROUTE_FULL, "orientation unclear")
+        
+        # Lines are horizontal now; which way up decides 0/180 (or 90/270)
+        rotation = 90 if sideways else 0
+        if self._line_asymmetry(profile, lines) < self.UPSIDE_DOWN_ASYMMETRY:
+            rotation += 180
+        verdict["rotation"] = rotation
+        
+        if rotation:
+            return self._finish(verdict, start, ROUTE_ROTATE, f"text rotated by {rotation} degrees")
+        if self.low_res_sharpness and sharpness >= self.low_res_sharpness:
+            return self._finish(verdict, start, ROUTE_LOW_RES, "sharp, clean page")
+        return self._finish(verdict, start, ROUTE_FULL, None)
+    
+    def _finish(self, verdict: Dict, start: float, route: str, reason: Optional[str]) -> Dict:
+        verdict["route"] = route
+        verdict["reason"] = reason
+        verdict["seconds"] = round(time.perf_counter() - start, 4)
+        logger.info(
+            f"Triage: {route}{f' ({reason})' if reason else ''} - ink {verdict['ink_ratio']:.3f}, "
+            f"{verdict['text_lines']} line(s), sharpness {verdict['sharpness']:.3f}"
+        )
+        return verdict
+    
+    def _deskewed_profile(self, ink: np.ndarray) -> np.ndarray:
+        """
+        Row ink profile along the skew (within MAX_SKEW) that makes it sharpest
+        Ink pixels are sheared rather than the image rotated, which keeps this cheap
+        """
+        ys, xs = np.nonzero(ink)
+        if len(ys) == 0:
+            return np.zeros(ink.shape[0], dtype=np.int64)
+        xs = xs - ink.shape[1] / 2
+        best, best_score = None, -1
+        for angle in np.arange(-self.MAX_SKEW, self.MAX_SKEW + self.SKEW_STEP / 2, self.SKEW_STEP):
+            rows = np.round(ys - xs * np.tan(np.radians(angle))).astype(np.int64)
+            profile = np.bincount(rows - rows.min())
+            # Lines straight along the rows concentrate the ink into fewer, fuller rows
+            score = float(np.dot(profile, profile))
+            if score > best_score:
+                best, best_score = profile, score
+        return best
+    
+    def _line_bands(self, profile: np.ndarray, width: int) -> np.ndarray:
+        """(start, end) of the bands of a row ink profile that are text-line sized"""
+        min_pixels = max(2, int(width * 0.01))
+        has_ink = (profile > min_pixels).astype(np.int8)
+        edges = np.diff(np.concatenate(([0], has_ink, [0])))
+        bands = np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1)
+        heights = bands[:, 1] - bands[:, 0]
+        return bands[(heights >= 2) & (heights <= len(profile) * self.MAX_LINE_SHARE)]
+    
+    def _crop_to_paper(self, gray: np.ndarray, paper: float) -> np.ndarray:
+        """Bounding box of the rows and columns that are mostly paper"""
+        is_paper = gray >= paper - self.INK_CONTRAST
+        rows = np.flatnonzero(is_paper.mean(axis=1) >= self.MIN_PAPER_SHARE)
+        columns = np.flatnonzero(is_paper.mean(axis=0) >= self.MIN_PAPER_SHARE)
+        if len(rows) == 0 or len(columns) == 0:
+            return gray[:0, :0]
+        return gray[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
+    
+    def _sharpness(self, gray: np.ndarray, paper: float, ink: np.ndarray) -> float:
+        """
+        Variance of the 4-neighbour Laplacian, divided by the squared ink contrast so
+        faint and dark prints score alike, and by the ink share so sparse pages aren't
+        penalized
+        """
+        laplacian = (
+            4 * gray[1:-1, 1:-1] - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:]
+        )
+        contrast = max(paper - float(np.median(gray[ink])), 1.0)
+        ink_share = max(float(ink.mean()), self.MIN_INK_RATIO)
+        return float(laplacian.var()) / (contrast ** 2) / ink_share
+    
+    def _strokes(self, ink: np.ndarray) -> np.ndarray:
+        """Ink without the interior of solid areas (shadows, page edges, filled boxes), so only thin strokes remain"""
+        interior = np.zeros_like(ink)
+        interior[1:-1, 1:-1] = (
+            ink[1:-1, 1:-1] & ink[:-2, 1:-1] & ink[2:, 1:-1] & ink[1:-1, :-2] & ink[1:-1, 2:]
+        )
+        return ink & ~interior
+    
+    def _closed_run_length(self, ink: np.ndarray) -> float:
+        """Mean length of the horizontal ink runs once gaps of up to RUN_GAP pixels are closed"""
+        # A blank column at each row end keeps runs from joining across rows
+        padded = np.pad(ink, ((0, 0), (1, 1))).ravel().astype(np.int8)
+        edges = np.diff(padded)
+        starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        if len(starts) == 0:
+            return 0.0
+        gaps = starts[1:] - ends[:-1]
+        width = ink.shape[1] + 2
+        closed = (gaps <= self.RUN_GAP) & (starts[1:] // width == ends[:-1] // width)
+        total = int((ends - starts).sum()) + int(gaps[closed].sum())
+        return total / (len(starts) - int(closed.sum()))
+    
+    def _line_asymmetry(self, profile: np.ndarray, lines: np.ndarray) -> float:
+        """
+        (ascender - descender) / (ascender + descender) ink, measured above and below
+        each line's x-height core (rows with at least half the line's peak ink)
+        Upright Latin and Devanagari are top-heavy (capitals, digits, ascenders and the
+        shirorekha outnumber descenders); upside-down text is bottom-heavy
+        """
+        above = below = 0
+        for start, end in lines:
+            line = profile[start:end]
+            if len(line) < 4:
+                continue
+            core = np.flatnonzero(line >= line.max() / 2)
+            above += int(line[:core[0]].sum())
+            below += int(line[core[-1] + 1:].sum())
+        return (above - below) / max(above + below, 1)
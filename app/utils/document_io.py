@@ -0,0 +1,46 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Leading bytes of the formats we accept, checked in order
+MAGIC_NUMBERS = [
+    (b"%PDF", "pdf"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+]
+
+def sniff_document_type(data: bytes) -> Optional[str]:
+    """Detect the document format from its magic bytes (None if unknown)"""
+    head = data[:16]
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for magic, doc_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return doc_type
+    # Some generators put junk before the PDF header
+    if b"%PDF" in data[:1024]:
+        return "pdf"
+    return None
+
+@contextmanager
+def spill_to_disk(data: bytes, suffix: str = "") -> Iterator[str]:
+    """
+    Write bytes to a temporary file for tools that only accept paths (pdf2image)
+    The file is removed when the context exits
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="finserv_", dir=os.getenv("TEMP_DIR") or None)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
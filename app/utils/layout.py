@@ -0,0 +1,55 @@
+from typing import List, Tuple
+import numpy as np
+
+# (x0, y0, x1, y1, text, confidence) of one OCR word
+Word = Tuple[float, float, float, float, str, float]
+
+def group_rows(bounding_boxes: List) -> Tuple[List[List[Word]], float]:
+    """
+    Group OCR word boxes ([[coords], text, conf]) into visual rows, top to bottom
+    Returns (rows of words sorted left to right, median word height)
+    """
+    words: List[Word] = []
+    for coords, text, conf in bounding_boxes:
+        x0, y0 = coords[0]
+        x1, y1 = coords[2]
+        words.append((x0, y0, x1, y1, text, conf))
+    if not words:
+        return [], 1.0
+    
+    heights = sorted(y1 - y0 for _x0, y0, _x1, y1, _t, _c in words)
+    line_height = max(heights[len(heights) // 2], 1)
+    
+    # Words whose vertical centers are within half a line of the row's center share a row
+    words.sort(key=lambda w: (w[1] + w[3]) / 2)
+    grouped = []
+    for word in words:
+        center = (word[1] + word[3]) / 2
+        if grouped and abs(center - grouped[-1][0]) <= line_height / 2:
+            row = grouped[-1]
+            row[1].append(word)
+            row[0] = sum((w[1] + w[3]) / 2 for w in row[1]) / len(row[1])
+        else:
+            grouped.append([center, [word]])
+    
+    rows = [sorted(row_words, key=lambda w: w[0]) for _center, row_words in grouped]
+    return rows, line_height
+
+def ink_mask(gray: np.ndarray) -> np.ndarray:
+    """Dark pixels of a grayscale page, split by Otsu's threshold over its histogram"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(hist * levels)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return gray <= int(np.argmax(between))
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    """uint8 luminance of a grayscale, RGB or RGBA array"""
+    if image.ndim == 2:
+        return image
+    weights = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    return (image[..., :3].astype(np.float32) @ weights).astype(np.uint8)
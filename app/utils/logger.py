@@ -1,36 +1,139 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import random
 import sys
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import Optional
 
-def setup_logger(name: str = "finserv"):
-    """Setup logging configuration"""
-    # Create logs directory
-    Path("logs").mkdir(exist_ok=True)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json (one object per line) or text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Empty disables the log file
+LOG_FILE = os.getenv("LOG_FILE", "logs/app.log")
+# Share of requests whose INFO/DEBUG records are kept; warnings and errors always are
+LOG_SAMPLE_RATE = min(1.0, max(0.0, float(os.getenv("LOG_SAMPLE_RATE", 1.0))))
+# OCR/LLM text dumps, see log_text
+LOG_DEBUG_TEXT = os.getenv("LOG_DEBUG_TEXT", "false").lower() in ("1", "true", "yes")
+# Records waiting for the writer thread; more are dropped instead of blocking requests
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] - %(message)s"
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+def set_request_id(request_id: Optional[str]) -> None:
+    """Tag the log records of the current task (and the tasks/threads it starts)"""
+    _request_id.set(request_id)
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+class RequestContextFilter(logging.Filter):
+    """
+    Adds the request id and applies sampling in the calling thread,
+    so sampled-out records never reach the queue
+    """
     
-    # Create logger
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = _request_id.get()
+        record.request_id = request_id or "-"
+        if LOG_SAMPLE_RATE >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        if request_id is None:
+            return random.random() < LOG_SAMPLE_RATE
+        # Per request, not per record, so a sampled request keeps all its lines
+        return zlib.crc32(request_id.encode()) % 10000 < LOG_SAMPLE_RATE * 10000
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the writer thread without blocking; drops them when the queue is full"""
+    
+    dropped = 0
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message and traceback here (arguments may change later), but leave
+        # the formatting to the writer thread's handlers
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+            "src": f"{record.filename}:{record.lineno}",
+            "pid": record.process
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logger(name: str = "finserv"):
+    """
+    Setup logging configuration
+    Handlers run on a background listener thread behind a bounded queue, so
+    request code only pays for building the record
+    """
+    formatter = JSONFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
     
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    console_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    console_handler.setFormatter(console_formatter)
+    console_handler.setFormatter(formatter)
+    handlers = [console_handler]
     
     # File handler
-    file_handler = logging.FileHandler("logs/app.log")
-    file_handler.setLevel(logging.DEBUG)
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
-    )
-    file_handler.setFormatter(file_formatter)
+    if LOG_FILE:
+        Path(LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
+        file_handler = logging.FileHandler(LOG_FILE)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
     
-    # Add handlers
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(RequestContextFilter())
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(listener.stop)
+    
+    # Create logger
+    logger = logging.getLogger(name)
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
     
     return logger
 
+def log_text(label: str, text: str, limit: int = 1000) -> None:
+    """
+    Dump (the start and end of) OCR/LLM text, only when LOG_DEBUG_TEXT is set
+    Off by default: document text is large, slow to log and may be sensitive
+    """
+    if not LOG_DEBUG_TEXT:
+        return
+    length = len(text)
+    if length > limit:
+        text = f"{text[:limit // 2]}\n[... {length - limit} chars ...]\n{text[-(limit // 2):]}"
+    logger.info(f"{label} ({length} chars):\n{text}")
+
 logger = setup_logger()
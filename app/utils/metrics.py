@@ -0,0 +1,150 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+# Seconds; covers a cache hit (ms) up to a long multi-page PDF (minutes)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+
+# Stage durations (ms) of the request being handled; None outside a request
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    """Cumulative bucket counts plus sum and count, as Prometheus expects"""
+    
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        """(le, count) pairs ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield ("+Inf" if bound == float("inf") else f"{bound:g}"), total
+
+class Metrics:
+    """
+    In-process counters, gauges and histograms, safe to update from worker threads
+    Worker processes can't reach this registry, so they return their stats
+    and the parent records them
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+    
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+    
+    def set(self, name: str, value: float) -> None:
+        """Gauge-style value (e.g. current queue depth)"""
+        with self._lock:
+            self._counters[name] = value
+    
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0.0)
+    
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None,
+                buckets: Tuple[float, ...] = TIME_BUCKETS) -> None:
+        """Add one sample to a histogram; the buckets of its first sample are kept"""
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a pipeline stage into the stage_seconds histogram and, inside a
+        request, into its stage timings (repeated stages add up)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("stage_seconds", elapsed, {"stage": name})
+            record_stage(name, elapsed)
+    
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._counters)
+    
+    def histogram_snapshot(self) -> Dict[str, Dict]:
+        """{'name{label="value"}': {"count", "sum", "buckets": {le: cumulative count}}}"""
+        with self._lock:
+            return {
+                f"{name}{_format_labels(key)}": {
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 6),
+                    "buckets": dict(histogram.cumulative())
+                }
+                for name, series in self._histograms.items()
+                for key, histogram in series.items()
+            }
+    
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                # Everything set() writes is a gauge; the rest only ever grows
+                kind = "counter" if name.endswith("_total") else "gauge"
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for le, count in histogram.cumulative():
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum:g}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    pairs = []
+    for label, value in key:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{label}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def start_stage_timings() -> Dict[str, float]:
+    """Collect the stage durations of the current request (and the tasks it starts)"""
+    timings: Dict[str, float] = {}
+    _stage_timings.set(timings)
+    return timings
+
+def record_stage(name: str, seconds: float) -> None:
+    """Add a duration to the current request's timings, if any"""
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds * 1000
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Server-Timing header value, e.g. 'download;dur=120.4, ocr;dur=2310.9'"""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+metrics = Metrics()
@@ -0,0 +1,105 @@
+"""
+OCR backend benchmark: pytesseract subprocesses vs warm tesserocr engines
+
+Rasterizes the training PDFs at the pipeline DPI and runs image_to_data with
+each Tesseract config the OCR service uses, on every backend. Reports the first
+(cold) call, the mean/p95 of the warm calls, and how many words the backends agree on.
+
+Usage:
+    python benchmarks/ocr_backend_benchmark.py [--limit 5] [--repeat 3]
+
+Needs Tesseract and poppler; the tesserocr rows need `pip install tesserocr`.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+from pdf2image import convert_from_path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.services.ocr_backend import HAS_TESSEROCR, PytesseractBackend, TesserocrBackend  # noqa: E402
+from app.services.ocr_service import FALLBACK_CONFIGS, PDF_DPI, PRIMARY_CONFIG  # noqa: E402
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "training_samples", "TRAINING_SAMPLES")
+
+def words(data: dict) -> Counter:
+    return Counter(
+        str(text).strip().lower()
+        for text, conf in zip(data["text"], data["conf"])
+        if str(text).strip() and int(conf) >= 0
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=5, help="number of PDFs (0 = all)")
+    parser.add_argument("--max-pages", type=int, default=1, help="pages per PDF")
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs per page and config")
+    parser.add_argument("--all-configs", action="store_true", help="include the fallback configs")
+    args = parser.parse_args()
+    
+    backends = [PytesseractBackend()]
+    if HAS_TESSEROCR:
+        backends.append(TesserocrBackend())
+    else:
+        print("tesserocr not installed, benchmarking pytesseract only\n")
+    configs = [PRIMARY_CONFIG] + (FALLBACK_CONFIGS if args.all_configs else [])
+    
+    pdfs = sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.pdf")))
+    if args.limit:
+        pdfs = pdfs[:args.limit]
+    pages = []
+    for pdf in pdfs:
+        for image in convert_from_path(pdf, dpi=PDF_DPI, last_page=args.max_pages):
+            pages.append((os.path.basename(pdf), np.asarray(image.convert("L"))))
+    
+    # backend name -> config -> {"cold": [...], "warm": [...]}
+    timings = {backend.name: {config: {"cold": [], "warm": []} for config in configs} for backend in backends}
+    agreement = []
+    for config in configs:
+        for index, (name, image) in enumerate(pages):
+            results = {}
+            for backend in backends:
+                runs = []
+                for _ in range(args.repeat + 1):
+                    start = time.perf_counter()
+                    try:
+                        results[backend.name] = backend.image_to_data(image, config)
+                    except Exception as e:
+                        print(f"{name}: {backend.name} failed with '{config}': {e}")
+                        break
+                    runs.append(time.perf_counter() - start)
+                if not runs:
+                    continue
+                # Only the very first call of a backend pays engine start-up
+                bucket = timings[backend.name][config]
+                if index == 0:
+                    bucket["cold"].append(runs[0])
+                    runs = runs[1:]
+                bucket["warm"].extend(runs)
+            
+            if len(results) == 2:
+                a, b = (words(data) for data in results.values())
+                total = max(sum(a.values()), sum(b.values()), 1)
+                agreement.append(sum((a & b).values()) / total)
+    
+    print(f"{'backend':<13}{'config':<22}{'cold ms':>9}{'warm mean':>11}{'warm p95':>10}{'calls':>7}")
+    for backend_name, per_config in timings.items():
+        for config, bucket in per_config.items():
+            warm = np.array(bucket["warm"]) * 1000
+            cold = f"{bucket['cold'][0] * 1000:.0f}" if bucket["cold"] else "-"
+            if len(warm) == 0:
+                continue
+            print(
+                f"{backend_name:<13}{config:<22}{cold:>9}{warm.mean():>11.1f}"
+                f"{np.percentile(warm, 95):>10.1f}{len(warm):>7}"
+            )
+    if agreement:
+        print(f"\nWord agreement between backends: {np.mean(agreement):.1%} over {len(agreement)} page/config pairs")
+
+if __name__ == "__main__":
+    main()
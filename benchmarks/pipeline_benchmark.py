@@ -0,0 +1,335 @@
+"""
+Offline pipeline benchmark and regression check over the training PDFs
+
+Runs DocumentProcessor on every sample with all caches off and the Groq client
+replaced by a local stub (fixed latency, bill items read back from the prompt),
+so only this service's own stages are measured. Each PDF is run as-is and, to
+exercise DocumentPreprocessor, as a PNG of its first page.
+
+For every concurrency level a fresh DocumentProcessor (cold worker processes, like
+a new deploy) processes all documents and the run reports:
+- latency percentiles per stage (metrics.stage timings) and end to end
+- throughput in documents/s and pages/s
+- OCR cost per page: Tesseract seconds (from ocr_stats) and CPU seconds of the
+  worker processes, Tesseract included, per OCR'd page
+- peak RSS of this process and of the largest worker process
+
+Results are written as JSON (--output). With --baseline, the watched metrics
+(preprocess/OCR latency, OCR cost per page, throughput) are compared to an
+earlier run and the script exits with status 1 when one is worse than
+--tolerance allows.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py --output bench.json [--concurrency 1 2 4]
+    python benchmarks/pipeline_benchmark.py --baseline bench-main.json --tolerance 0.15
+
+Needs Tesseract and poppler; no network or GROQ_API_KEY.
+"""
+import argparse
+import asyncio
+import glob
+import io
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+import numpy as np
+from pdf2image import convert_from_path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Before the app modules read their configuration
+os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")
+for cache_name in ("RESULT", "OCR", "LLM", "FRAUD"):
+    os.environ[f"{cache_name}_CACHE_SIZE"] = "0"
+os.environ.pop("CACHE_DIR", None)
+# Repeated fixtures would be answered from the duplicate index
+os.environ["DUPLICATE_INDEX_PATH"] = ""
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LOG_FILE", "")
+
+from app.models.schemas import TokenUsage  # noqa: E402
+from app.services.document_processor import DocumentProcessor  # noqa: E402
+from app.services.llm_client import CHARS_PER_TOKEN  # noqa: E402
+from app.utils.metrics import start_stage_timings  # noqa: E402
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "training_samples", "TRAINING_SAMPLES")
+
+PAGE_MARKER_RE = re.compile(r"^--- Page (\d+) ---$")
+# "<name> ... <amount>" lines of the OCR text; template/example lines contain quotes or colons
+ITEM_LINE_RE = re.compile(r"^(?P<name>[A-Za-z][^\"{}:]*?)\s+(?P<amount>\d[\d,]*\.\d{2})$")
+
+# (section, metric, True when higher is better) compared against --baseline
+WATCHED = [
+    ("stages.preprocess", "p50", False),
+    ("stages.preprocess", "p95", False),
+    ("stages.ocr", "p50", False),
+    ("stages.ocr", "p95", False),
+    ("ocr", "tesseract_seconds_per_page_p50", False),
+    ("ocr", "worker_cpu_seconds_per_page", False),
+    ("throughput", "documents_per_second", True),
+]
+
+class StubGroqClient:
+    """Stands in for GroqClient: sleeps for a fixed latency, returns the prompt's amount lines as items"""
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+    
+    async def complete_json(self, max_retries: int = 3, key: str = None, **request) -> Tuple[Dict, TokenUsage]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        prompt = request["messages"][-1]["content"]
+        
+        pages: Dict[str, List[Dict]] = {}
+        page_no = "1"
+        for line in prompt.splitlines():
+            line = line.strip()
+            marker = PAGE_MARKER_RE.match(line)
+            if marker:
+                page_no = marker.group(1)
+                continue
+            match = ITEM_LINE_RE.match(line)
+            if match:
+                pages.setdefault(page_no, []).append({
+                    "item_name": match["name"].strip(),
+                    "item_amount": float(match["amount"].replace(",", "")),
+                    "item_rate": None,
+                    "item_quantity": None
+                })
+        
+        result = {
+            "pagewise_line_items": [
+                {"page_no": page, "page_type": "Bill Detail", "bill_items": items}
+                for page, items in pages.items()
+            ]
+        }
+        input_tokens = sum(len(message["content"]) for message in request["messages"]) // CHARS_PER_TOKEN
+        output_tokens = len(json.dumps(result)) // CHARS_PER_TOKEN
+        return result, TokenUsage(
+            total_tokens=input_tokens + output_tokens,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens
+        )
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"n": 0}
+    array = np.asarray(values)
+    return {
+        "n": len(values),
+        "mean": round(float(array.mean()), 4),
+        "p50": round(float(np.percentile(array, 50)), 4),
+        "p95": round(float(np.percentile(array, 95)), 4),
+        "p99": round(float(np.percentile(array, 99)), 4),
+        "max": round(float(array.max()), 4)
+    }
+
+def load_documents(inputs: List[str], limit: int) -> List[Tuple[str, bytes]]:
+    pdfs = sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.pdf")))
+    if limit:
+        pdfs = pdfs[:limit]
+    documents = []
+    for pdf in pdfs:
+        name = os.path.basename(pdf)
+        if "pdf" in inputs:
+            with open(pdf, "rb") as f:
+                documents.append((name, f.read()))
+        if "png" in inputs:
+            page = convert_from_path(pdf, dpi=200, last_page=1)[0]
+            buffer = io.BytesIO()
+            page.save(buffer, format="PNG")
+            documents.append((f"{name}.p1.png", buffer.getvalue()))
+    return documents
+
+def cpu_seconds(usage: resource.struct_rusage) -> float:
+    return usage.ru_utime + usage.ru_stime
+
+async def run_level(documents: List[Tuple[str, bytes]], concurrency: int, llm_latency: float) -> Dict:
+    """All documents through a fresh DocumentProcessor with at most `concurrency` in flight"""
+    processor = DocumentProcessor()
+    processor.llm_service.client = StubGroqClient(llm_latency)
+    
+    # Per-page OCR stats, captured on the parent side where the worker results arrive
+    page_stats: List[Dict] = []
+    extract_text_cached = processor._extract_text_cached
+    
+    async def capture_ocr(content_hash, source):
+        ocr_data = await extract_text_cached(content_hash, source)
+        page_stats.extend(page.get("ocr_stats", {}) for page in ocr_data.get("pages", []))
+        return ocr_data
+    
+    processor._extract_text_cached = capture_ocr
+    
+    limiter = asyncio.Semaphore(concurrency)
+    
+    async def run(name: str, content: bytes) -> Dict:
+        async with limiter:
+            timings = start_stage_timings()
+            start = time.perf_counter()
+            result = await processor.process_document(content)
+            seconds = time.perf_counter() - start
+        pages = len(result.data.pagewise_line_items) if result.data else 0
+        return {"name": name, "seconds": seconds, "pages": pages, "success": result.is_success, "stages": timings}
+    
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    try:
+        runs = await asyncio.gather(*(run(name, content) for name, content in documents))
+    finally:
+        wall = time.perf_counter() - start
+        # Joins the worker processes, so their CPU time shows up in RUSAGE_CHILDREN
+        processor.shutdown()
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    
+    stage_names = sorted({stage for item in runs for stage in item["stages"]})
+    ocr_pages = [stats for stats in page_stats if not stats.get("text_layer")]
+    tesseract = percentiles([stats.get("tesseract_seconds", 0.0) for stats in ocr_pages])
+    worker_cpu = cpu_seconds(children_after) - cpu_seconds(children_before)
+    total_pages = sum(item["pages"] for item in runs)
+    
+    return {
+        "concurrency": concurrency,
+        "documents": len(runs),
+        "failures": [item["name"] for item in runs if not item["success"]],
+        "stages": {
+            stage: percentiles([item["stages"][stage] / 1000 for item in runs if stage in item["stages"]])
+            for stage in stage_names
+        },
+        "latency": percentiles([item["seconds"] for item in runs]),
+        "throughput": {
+            "wall_seconds": round(wall, 3),
+            "documents_per_second": round(len(runs) / wall, 4),
+            "pages_per_second": round(total_pages / wall, 4)
+        },
+        "ocr": {
+            "pages": len(page_stats),
+            "ocr_pages": len(ocr_pages),
+            "text_layer_pages": len(page_stats) - len(ocr_pages),
+            "passes_per_page": round(sum(s.get("passes", 0) for s in ocr_pages) / max(len(ocr_pages), 1), 3),
+            "tesseract_seconds_per_page_p50": tesseract.get("p50"),
+            "tesseract_seconds_per_page_p95": tesseract.get("p95"),
+            # Rasterizing, fraud analysis and preprocessing also run in the workers
+            "worker_cpu_seconds_per_page": round(worker_cpu / max(len(ocr_pages), 1), 4)
+        },
+        "peak_rss_mb": {
+            # ru_maxrss is in KiB on Linux; both are high-water marks since start
+            "api_process": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "largest_worker": round(children_after.ru_maxrss / 1024, 1)
+        },
+        "llm_stub_calls": processor.llm_service.client.calls
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def lookup(level: Dict, section: str, metric: str):
+    value = level
+    for key in section.split("."):
+        value = value.get(key, {})
+    return value.get(metric)
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Watched metrics that got worse than the tolerance allows, per concurrency level"""
+    regressions = []
+    baseline_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    print(f"\nAgainst baseline {baseline.get('commit')} ({baseline.get('timestamp')}), tolerance {tolerance:.0%}")
+    print(f"{'conc':>5}  {'metric':<48}{'baseline':>11}{'current':>11}{'change':>9}")
+    for level in results["levels"]:
+        old_level = baseline_levels.get(level["concurrency"])
+        if old_level is None:
+            continue
+        for section, metric, higher_is_better in WATCHED:
+            old, new = lookup(old_level, section, metric), lookup(level, section, metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            worse = change < -tolerance if higher_is_better else change > tolerance
+            name = f"{section}.{metric}"
+            print(f"{level['concurrency']:>5}  {name:<48}{old:>11.4f}{new:>11.4f}{change:>+9.1%}{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append(f"concurrency {level['concurrency']}: {name} {old:.4f} -> {new:.4f} ({change:+.1%})")
+    return regressions
+
+def print_level(level: Dict):
+    throughput, ocr = level["throughput"], level["ocr"]
+    print(
+        f"\n== concurrency {level['concurrency']}: {level['documents']} documents in {throughput['wall_seconds']:.1f}s, "
+        f"{throughput['documents_per_second']:.2f} docs/s, {throughput['pages_per_second']:.2f} pages/s"
+    )
+    print(f"{'stage':<12}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in list(level["stages"].items()) + [("end-to-end", level["latency"])]:
+        if stats["n"]:
+            print(
+                f"{stage:<12}{stats['n']:>5}{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}"
+                f"{stats['p99'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}"
+            )
+    print(
+        f"OCR: {ocr['ocr_pages']} page(s) OCR'd, {ocr['text_layer_pages']} from the text layer, "
+        f"{ocr['passes_per_page']} pass(es)/page, Tesseract p50 {ocr['tesseract_seconds_per_page_p50']}s/page, "
+        f"worker CPU {ocr['worker_cpu_seconds_per_page']}s/page"
+    )
+    print(f"Peak RSS: {level['peak_rss_mb']['api_process']} MB (API), {level['peak_rss_mb']['largest_worker']} MB (worker)")
+    if level["failures"]:
+        print(f"Failed: {', '.join(level['failures'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4], help="documents in flight")
+    parser.add_argument("--inputs", nargs="+", choices=["pdf", "png"], default=["pdf", "png"], help="document variants")
+    parser.add_argument("--limit", type=int, default=0, help="only the first N PDFs")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds the stub LLM takes per call")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown")
+    args = parser.parse_args()
+    
+    documents = load_documents(args.inputs, args.limit)
+    print(f"{len(documents)} documents ({', '.join(args.inputs)}), stub LLM latency {args.llm_latency}s")
+    
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            name: os.getenv(name)
+            for name in ("CPU_WORKERS", "OCR_PAGE_WORKERS", "OCR_BACKEND", "OCR_ROI", "PDF_TEXT_LAYER", "TABLE_EXTRACTOR_ENABLED")
+        },
+        "args": vars(args),
+        "levels": []
+    }
+    for concurrency in args.concurrency:
+        level = asyncio.run(run_level(documents, concurrency, args.llm_latency))
+        print_level(level)
+        results["levels"].append(level)
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nPerformance regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo performance regressions")
+
+if __name__ == "__main__":
+    main()
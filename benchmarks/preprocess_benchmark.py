@@ -0,0 +1,103 @@
+"""
+Preprocessing benchmark over the training PDFs
+
+Each page is rasterized at 300 DPI (reference) and at lower DPIs to mimic
+phone photos / cheap scans. For every input the legacy preprocessing (fixed
+2000px LANCZOS upscale + PIL contrast/sharpen) and the current
+DocumentPreprocessor are timed, then OCR'd with the primary Tesseract config.
+Accuracy is word recall against the OCR of the clean 300 DPI render.
+
+Usage:
+    python benchmarks/preprocess_benchmark.py [--dpi 150 200 300] [--limit 5]
+
+Needs Tesseract and poppler (pdf2image) installed.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+import pytesseract
+from pdf2image import convert_from_path
+from PIL import Image, ImageEnhance, ImageFilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.services.ocr_service import PRIMARY_CONFIG  # noqa: E402
+from app.services.preprocessor import DocumentPreprocessor  # noqa: E402
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "training_samples", "TRAINING_SAMPLES")
+
+def legacy_preprocess(image: Image.Image) -> np.ndarray:
+    """The preprocessing this service used before the NumPy engine"""
+    img = image
+    if min(img.size) < 2000:
+        ratio = 2000 / min(img.size)
+        img = img.resize(tuple(int(dim * ratio) for dim in img.size), Image.Resampling.LANCZOS)
+    img = img.convert("L")
+    img = ImageEnhance.Contrast(img).enhance(1.5)
+    img = img.filter(ImageFilter.SHARPEN)
+    return np.asarray(img)
+
+def ocr_words(pixels: np.ndarray) -> Counter:
+    text = pytesseract.image_to_string(Image.fromarray(pixels), config=PRIMARY_CONFIG)
+    return Counter(word.lower() for word in text.split() if any(c.isalnum() for c in word))
+
+def recall(words: Counter, reference: Counter) -> float:
+    total = sum(reference.values())
+    return sum((words & reference).values()) / total if total else 0.0
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dpi", type=int, nargs="+", default=[150, 200, 300], help="input resolutions to simulate")
+    parser.add_argument("--limit", type=int, default=0, help="only the first N PDFs")
+    parser.add_argument("--max-pages", type=int, default=2, help="pages per PDF")
+    args = parser.parse_args()
+    
+    pdfs = sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.pdf")))
+    if args.limit:
+        pdfs = pdfs[:args.limit]
+    preprocessor = DocumentPreprocessor()
+    
+    # (variant, dpi) -> list of (seconds, recall)
+    results = {}
+    for pdf in pdfs:
+        reference_pages = convert_from_path(pdf, dpi=300, last_page=args.max_pages)
+        for page_no, reference_page in enumerate(reference_pages, 1):
+            reference = ocr_words(np.asarray(reference_page.convert("L")))
+            for dpi in args.dpi:
+                page = reference_page
+                if dpi != 300:
+                    size = (reference_page.width * dpi // 300, reference_page.height * dpi // 300)
+                    page = reference_page.resize(size, Image.Resampling.BOX)
+                page.info["dpi"] = (dpi, dpi)
+                
+                for variant, fn in (("legacy", legacy_preprocess), ("numpy", preprocessor.preprocess)):
+                    pixels, seconds = timed(fn, page)
+                    score = recall(ocr_words(pixels), reference)
+                    results.setdefault((variant, dpi), []).append((seconds, score))
+                    print(
+                        f"{os.path.basename(pdf)} p{page_no} {dpi:>3} DPI {variant:<6} "
+                        f"{seconds * 1000:8.1f}ms  {pixels.shape[1]}x{pixels.shape[0]}  recall {score:.3f}"
+                    )
+    
+    print()
+    print(f"{'variant':<8}{'dpi':>5}{'images':>8}{'mean ms':>10}{'p95 ms':>10}{'recall':>9}")
+    for (variant, dpi), rows in sorted(results.items(), key=lambda item: (item[0][1], item[0][0])):
+        seconds = np.array([row[0] for row in rows]) * 1000
+        scores = np.array([row[1] for row in rows])
+        print(
+            f"{variant:<8}{dpi:>5}{len(rows):>8}{seconds.mean():>10.1f}"
+            f"{np.percentile(seconds, 95):>10.1f}{scores.mean():>9.3f}"
+        )
+
+if __name__ == "__main__":
+    main()
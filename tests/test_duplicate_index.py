@@ -0,0 +1,30 @@
+import time
+from app.services.duplicate_index import DuplicateIndex
+
+HASHES = (0x0F0F_F0F0_1234_5678, 0x1111_2222_3333_4444)
+
+def make_index(tmp_path, **kwargs) -> DuplicateIndex:
+    return DuplicateIndex(str(tmp_path / "duplicates.sqlite3"), **kwargs)
+
+def test_near_duplicate_needs_enough_shared_amounts(tmp_path):
+    index = make_index(tmp_path)
+    index.add("a", HASHES, ["120.00", "80.00"], None, {"is_success": True})
+    index.add("b", HASHES, ["10.00", "20.00", "30.00"], None, {"is_success": True})
+    
+    # Same template, only two amounts: too little to call it the same bill
+    assert index.find_near_duplicate("c", HASHES, ["120.00", "80.00"]) is None
+    match = index.find_near_duplicate("c", (HASHES[0] ^ 0b101, HASHES[1]), ["10.00", "20.00", "30.00"])
+    assert match["doc_hash"] == "b"
+    assert match["distance"] == 2
+
+def test_expired_documents_are_pruned(tmp_path):
+    index = make_index(tmp_path, ttl_seconds=60)
+    amounts = ["10.00", "20.00", "30.00"]
+    index.add("old", HASHES, amounts, "items", {"is_success": True})
+    index._db.execute("UPDATE documents SET created = ?", (time.time() - 120,))
+    index._db.commit()
+    
+    index._prune()
+    
+    assert index.find_near_duplicate("new", HASHES, amounts) is None
+    assert index.find_by_items("new", "items") is None
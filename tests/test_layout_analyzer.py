@@ -0,0 +1,41 @@
+import numpy as np
+from app.services.layout_analyzer import LayoutAnalyzer
+
+ROW = [(100, 600), (800, 900), (1100, 1250), (1400, 1600)]
+
+class Page:
+    """Synthetic bill: text lines drawn as word-sized ink blocks"""
+    
+    def __init__(self):
+        self.image = np.full((2200, 1700), 255, dtype=np.uint8)
+        self.y = 100
+    
+    def line(self, segments):
+        top = self.y
+        for x0, x1 in segments:
+            for x in range(x0, x1, 40):
+                self.image[top:top + 24, x:min(x + 30, x1)] = 0
+        self.y += 48
+        return top + 24
+
+def test_every_table_section_and_grand_total_are_covered():
+    page = Page()
+    for _ in range(3):
+        page.line([(100, 900)])
+    page.line([(100, 400)])
+    for _ in range(6):
+        page.line(ROW)
+    page.line([(1300, 1600)])
+    # Second section: title lines, then its own table
+    for _ in range(3):
+        page.line([(100, 700)])
+    for _ in range(5):
+        last_item = page.line(ROW)
+    page.line([(1300, 1600)])
+    grand_total = page.line([(1100, 1600)])
+    
+    regions = LayoutAnalyzer().find_regions(page.image)
+    
+    table = next(region for region in regions if region["type"] == "table")
+    assert table["box"][3] >= last_item
+    assert max(region["box"][3] for region in regions) >= grand_total
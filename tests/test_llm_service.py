@@ -0,0 +1,71 @@
+import asyncio
+from app.models.schemas import TokenUsage
+from app.services.llm_client import GroqClient
+from app.services.llm_service import LLMService
+
+def merge(*chunks):
+    # _merge_chunks needs no client, so skip __init__ (which requires GROQ_API_KEY)
+    return object.__new__(LLMService)._merge_chunks(list(chunks))
+
+def item(name: str, amount: float) -> dict:
+    return {"item_name": name, "item_amount": amount, "item_rate": amount, "item_quantity": 1}
+
+def chunk(*pages) -> dict:
+    return {
+        "pagewise_line_items": [
+            {"page_no": page_no, "page_type": "Bill Detail", "bill_items": items} for page_no, items in pages
+        ]
+    }
+
+def test_boundary_row_repeated_by_the_next_chunk_is_dropped():
+    merged = merge(
+        chunk(("1", [item("Consultation", 500), item("X-Ray Ch", 800)])),
+        chunk(("1", [item("X-Ray Chest PA", 800), item("CBC", 300)]))
+    )
+    
+    items = merged["pagewise_line_items"][0]["bill_items"]
+    assert [i["item_name"] for i in items] == ["Consultation", "X-Ray Chest PA", "CBC"]
+
+def test_repeated_charge_past_the_overlap_is_kept():
+    merged = merge(
+        chunk(("1", [item("Consultation", 500), item("Injection", 50)])),
+        chunk(("1", [item("Dressing", 120), item("Injection", 50)]))
+    )
+    
+    items = merged["pagewise_line_items"][0]["bill_items"]
+    assert [i["item_name"] for i in items] == ["Consultation", "Injection", "Dressing", "Injection"]
+
+def test_pages_are_merged_in_chunk_order():
+    merged = merge(
+        chunk(("1", [item("Room", 1000)])),
+        chunk(("1", [item("Nursing", 200)]), ("2", [item("Paracetamol", 20)]))
+    )
+    
+    pages = merged["pagewise_line_items"]
+    assert [page["page_no"] for page in pages] == ["1", "2"]
+    assert [i["item_name"] for i in pages[0]["bill_items"]] == ["Room", "Nursing"]
+    assert pages[0]["page_type"] == "Bill Detail"
+
+def test_coalesced_callers_get_their_own_usage_and_only_one_is_billed():
+    client = object.__new__(GroqClient)
+    client._inflight = {}
+    calls = []
+    
+    async def complete(max_retries, **request):
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return {"items": []}, TokenUsage(total_tokens=150, input_tokens=100, output_tokens=50)
+    
+    client._complete_with_retries = complete
+    
+    async def run():
+        return await asyncio.gather(*(client.complete_json(key="same", model="m") for _ in range(3)))
+    
+    outputs = asyncio.run(run())
+    usages = [usage for _, usage in outputs]
+    
+    assert len(calls) == 1
+    assert len({id(usage) for usage in usages}) == 3
+    assert [usage.reused for usage in usages] == [False, True, True]
+    usages[0].tokens_saved = 10
+    assert usages[1].tokens_saved is None
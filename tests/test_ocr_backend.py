@@ -0,0 +1,14 @@
+import pickle
+from app.services.ocr_backend import TesserocrBackend, parse_config
+
+def test_unpickled_backends_share_the_process_engine_pool():
+    backend = TesserocrBackend()
+    
+    # What every run_cpu task does to the OCR service
+    first = pickle.loads(pickle.dumps(backend))
+    second = pickle.loads(pickle.dumps(backend))
+    
+    assert first._pool is second._pool is backend._pool
+
+def test_parse_config():
+    assert parse_config("--oem 1 --psm 6 -l eng+hin") == (6, "eng+hin", ["--oem", "1"])
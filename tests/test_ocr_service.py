@@ -0,0 +1,111 @@
+import threading
+import time
+import numpy as np
+from app.services import ocr_backend, ocr_service
+from app.services.ocr_backend import OCRBackend
+from app.services.ocr_service import OCRService
+
+class FailingBackend(OCRBackend):
+    """Fails like Tesseract does when a traineddata file (e.g. hin) is missing"""
+    
+    name = "failing"
+    
+    def image_to_data(self, image, config):
+        raise RuntimeError("Failed loading language 'hin'")
+
+def make_service() -> OCRService:
+    service = OCRService()
+    service.backend = FailingBackend()
+    return service
+
+def test_failed_region_yields_empty_result():
+    service = make_service()
+    image = np.full((600, 900), 255, dtype=np.uint8)
+    
+    page = service._ocr_regions(image, [{"type": "table", "box": (0, 0, 800, 500)}])
+    
+    assert page["text"] == ""
+    assert page["bounding_boxes"] == []
+    assert page["ocr_stats"]["quality"] == 0.0
+
+def test_failed_regions_fall_back_to_full_page(monkeypatch):
+    service = make_service()
+    service.roi_enabled = True
+    image = np.full((600, 900), 255, dtype=np.uint8)
+    monkeypatch.setattr(service.layout, "find_regions", lambda img: [{"type": "table", "box": (0, 0, 800, 500)}])
+    
+    page = service._ocr_image(image)
+    
+    # Region quality 0 sends the page through the full-page configs, which fail too but don't raise
+    assert page["ocr_stats"]["roi"] is False
+    assert page["text"] == ""
+
+class SlowBackend(OCRBackend):
+    """Records how many calls overlap"""
+    
+    name = "slow"
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+    
+    def image_to_data(self, image, config):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return {"text": []}
+
+def test_tesseract_calls_share_the_slot_limit(monkeypatch):
+    monkeypatch.setattr(ocr_backend, "_slots", threading.BoundedSemaphore(2))
+    service = make_service()
+    service.backend = SlowBackend()
+    service.page_workers = 4
+    image = np.full((600, 900), 255, dtype=np.uint8)
+    regions = [{"type": "table", "box": (0, y, 800, y + 100)} for y in range(0, 400, 100)]
+    
+    service._ocr_regions(image, regions)
+    
+    assert service.backend.peak == 2
+
+def stub_pdf(monkeypatch, service, page_count, text_layer_pages=()):
+    """A PDF of blank-ish pages; records the DPI every page is rendered at"""
+    rendered = []
+    
+    def rasterize(pdf_path, page_no, dpi):
+        rendered.append((page_no, dpi))
+        page = np.full((400, 300), 255, dtype=np.uint8)
+        page[50:100, 40:260] = 0
+        return page
+    
+    monkeypatch.setattr(ocr_service, "pdfinfo_from_path", lambda path, **kwargs: {"Pages": page_count})
+    monkeypatch.setattr(service.text_layer, "extract", lambda *args: {
+        page_no: {"text": "text layer", "bounding_boxes": [], "ocr_stats": {"text_layer": True}}
+        for page_no in text_layer_pages
+    })
+    monkeypatch.setattr(service, "_rasterize_page", rasterize)
+    monkeypatch.setattr(service, "_ocr_image", lambda image: {"text": "", "bounding_boxes": [], "ocr_stats": {}})
+    return rendered
+
+def test_pdf_result_carries_first_page_hashes(monkeypatch):
+    service = make_service()
+    rendered = stub_pdf(monkeypatch, service, page_count=2)
+    
+    result = service._extract_pdf("bill.pdf")
+    
+    assert len(result["image_hashes"]) == 2
+    assert "image_hashes" not in result["pages"][0]
+    # Hashed from the page rendered for OCR, not a second rendering
+    assert sorted(page_no for page_no, _dpi in rendered) == [1, 2]
+
+def test_text_layer_first_page_is_rendered_small_for_hashing(monkeypatch):
+    service = make_service()
+    rendered = stub_pdf(monkeypatch, service, page_count=1, text_layer_pages=[1])
+    
+    result = service._extract_pdf("bill.pdf")
+    
+    assert len(result["image_hashes"]) == 2
+    assert rendered == [(1, ocr_service.PDF_HASH_DPI)]
@@ -0,0 +1,49 @@
+from app.services import prompt_compactor
+from app.services.prompt_compactor import PromptCompactor
+
+def bill_page(page_no: int, rows: int) -> dict:
+    return {
+        "page_no": str(page_no),
+        "text": "\n".join(f"Item {page_no}-{i} charge | 1 | {100 + i}.00 | {100 + i}.00" for i in range(rows))
+    }
+
+def ocr_data(*pages: dict) -> dict:
+    return {"text": "\n".join(page["text"] for page in pages), "pages": list(pages)}
+
+def make_compactor(max_chunks: int = 8) -> PromptCompactor:
+    compactor = PromptCompactor()
+    compactor.max_chunks = max_chunks
+    return compactor
+
+def test_short_document_is_one_chunk():
+    chunks, stats = make_compactor().compact_chunks(ocr_data(bill_page(1, 5)), token_budget=2500)
+    
+    assert len(chunks) == 1
+    assert chunks[0].count("charge") == 5
+    assert stats["compacted_tokens"] <= stats["original_tokens"]
+
+def test_long_document_splits_within_budget_without_losing_rows():
+    compactor = make_compactor()
+    chunks, _stats = compactor.compact_chunks(ocr_data(bill_page(1, 30), bill_page(2, 30)), token_budget=200)
+    
+    assert len(chunks) > 1
+    assert all(compactor.estimate_tokens(chunk) <= 200 for chunk in chunks)
+    for page_no in (1, 2):
+        for i in range(30):
+            assert f"Item {page_no}-{i} charge" in "".join(chunks)
+
+def test_chunk_limit_drops_rows_with_a_warning(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(prompt_compactor.logger, "warning", warnings.append)
+    compactor = make_compactor(max_chunks=2)
+    # Page breaks leave the chunks part-empty, so fitting to 2 x budget alone needs three chunks
+    document = ocr_data(bill_page(1, 24), bill_page(2, 6), bill_page(3, 24))
+    
+    chunks, _stats = compactor.compact_chunks(document, token_budget=200)
+    
+    assert len(chunks) == 2
+    # A chunk that splits a page repeats the boundary row, so count distinct rows
+    kept = len({line for chunk in chunks for line in chunk.splitlines() if "charge" in line})
+    dropped = 54 - kept
+    assert dropped > 0
+    assert warnings and f"dropped {dropped} amount row(s)" in warnings[-1]
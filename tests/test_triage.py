@@ -0,0 +1,36 @@
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from app.services.triage import DocumentTriage, ROUTE_LOW_RES, ROUTE_ROTATE
+
+ITEMS = [
+    ("Consultation fee", 1, 500), ("X-ray chest PA view", 1, 650), ("Complete blood count", 1, 320.5),
+    ("Ward charges (general)", 3, 1200), ("Injection ceftriaxone 1g", 4, 87.25), ("Nursing charges", 3, 300),
+    ("Dressing", 2, 150), ("Paracetamol 500mg", 10, 2.5), ("ECG", 1, 250), ("Physiotherapy", 2, 400)
+]
+
+def table_bill(font_size: int = 40) -> Image.Image:
+    """A4 scan of a four-column bill: the column gaps are what fooled projection-based orientation"""
+    page = Image.new("L", (2480, 3508), 250)
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default(size=font_size)
+    draw.text((150, 150), "CITY HOSPITAL", font=ImageFont.load_default(size=font_size * 2), fill=10)
+    rows = [("Description", "Qty", "Rate", "Amount")]
+    rows += [(name, str(qty), f"{rate:.2f}", f"{qty * rate:.2f}") for name, qty, rate in ITEMS]
+    for index, row in enumerate(rows):
+        for x, cell in zip((150, 1250, 1600, 2000), row):
+            draw.text((x, 450 + index * int(font_size * 1.8)), cell, font=font, fill=20)
+    return page
+
+@pytest.mark.parametrize("turned, rotation", [(90, 270), (180, 180), (270, 90), (93, 270), (267, 90)])
+def test_turned_table_page_is_rotated_back(turned, rotation):
+    verdict = DocumentTriage().assess(table_bill().rotate(turned, expand=True, fillcolor=250))
+    
+    assert verdict["route"] == ROUTE_ROTATE
+    assert verdict["rotation"] == rotation
+
+@pytest.mark.parametrize("tilt", [0, 3, -3])
+def test_upright_table_page_is_left_alone(tilt):
+    verdict = DocumentTriage().assess(table_bill(font_size=24).rotate(tilt, expand=True, fillcolor=250))
+    
+    assert verdict["route"] == ROUTE_LOW_RES
+    assert verdict["rotation"] == 0